@@ -5,6 +5,8 @@ from cs231n.classifiers.linear_svm import *
 from cs231n.classifiers.softmax import *
 from past.builtins import xrange
 
+from cs231n.sampler import MinibatchSampler
+
 
 class LinearClassifier(object):
 
@@ -12,7 +14,7 @@ class LinearClassifier(object):
         self.W = None
 
     def train(self, X, y, learning_rate=1e-3, reg=1e-5, num_iters=100,
-              batch_size=200, verbose=False):
+              batch_size=200, verbose=False, sort_batches=False):
         """
         Train this linear classifier using stochastic gradient descent.
 
@@ -26,6 +28,8 @@ class LinearClassifier(object):
         - num_iters: (integer) number of steps to take when optimizing
         - batch_size: (integer) number of training examples to use at each step.
         - verbose: (boolean) If true, print progress during optimization.
+        - sort_batches: (boolean) If true, sort the indices within each
+          minibatch so the rows of X are read in order.
 
         Outputs:
         A list containing the value of the loss function at each training iteration.
@@ -36,7 +40,9 @@ class LinearClassifier(object):
             # lazily initialize W
             self.W = 0.001 * np.random.randn(dim, num_classes)
 
-        # Run stochastic gradient descent to optimize W
+        # Run stochastic gradient descent to optimize W; each epoch walks
+        # through a permutation of the training data
+        sampler = MinibatchSampler([X, y], batch_size, sort=sort_batches)
         loss_history = []
         for it in xrange(num_iters):
               X_batch = None
@@ -53,9 +59,7 @@ class LinearClassifier(object):
               # Hint: Use np.random.choice to generate indices. Sampling with         #
               # replacement is faster than sampling without replacement.              #
               #########################################################################
-              indicies = np.random.choice(range(num_train),batch_size,replace = True)
-              X_batch = np.array(X[indicies])
-              y_batch = np.array(y[indicies])
+              X_batch, y_batch = sampler.sample()
               #########################################################################
               #                       END OF YOUR CODE                                #
               #########################################################################
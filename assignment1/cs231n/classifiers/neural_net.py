@@ -4,6 +4,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 from past.builtins import xrange
 
+from cs231n.sampler import MinibatchSampler
+
 class TwoLayerNet(object):
     """
     A two-layer fully-connected neural network. The net has an input dimension of
@@ -143,7 +145,7 @@ class TwoLayerNet(object):
     def train(self, X, y, X_val, y_val,
             learning_rate=1e-3, learning_rate_decay=0.95,
             reg=5e-6, num_iters=100,
-            batch_size=200, verbose=False):
+            batch_size=200, verbose=False, sort_batches=False):
         """
         Train this neural network using stochastic gradient descent.
 
@@ -160,11 +162,15 @@ class TwoLayerNet(object):
         - num_iters: Number of steps to take when optimizing.
         - batch_size: Number of training examples to use per step.
         - verbose: boolean; if true print progress during optimization.
+        - sort_batches: boolean; if true sort the indices within each minibatch
+          so the rows of X are read in order.
         """
         num_train = X.shape[0]
         iterations_per_epoch = max(num_train / batch_size, 1)
 
-        # Use SGD to optimize the parameters in self.model
+        # Use SGD to optimize the parameters in self.model; each epoch walks
+        # through a permutation of the training data
+        sampler = MinibatchSampler([X, y], batch_size, sort=sort_batches)
         loss_history = []
         train_acc_history = []
         val_acc_history = []
@@ -178,9 +184,7 @@ class TwoLayerNet(object):
             # Create a random minibatch of training data and labels, storing        #
             # them in X_batch and y_batch respectively.                             #
             #########################################################################
-            I = np.random.randint(num_train, size=batch_size)
-            X_batch = np.array(X[I])
-            y_batch = np.array(y[I])
+            X_batch, y_batch = sampler.sample()
             #########################################################################
             #                             END OF YOUR CODE                          #
             #########################################################################
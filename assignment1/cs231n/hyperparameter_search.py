@@ -0,0 +1,319 @@
+from __future__ import division
+from builtins import range
+from builtins import object
+import inspect
+import math
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from cs231n.threading_policy import (apply_policy, thread_environment, worker_context,
+                                     worker_policies)
+
+
+"""
+This file implements a parallel hyperparameter search with successive halving
+and Hyperband early stopping.
+
+Tuning with nested loops over learning rates and regularization strengths
+trains every configuration to completion, one after the other. Here trials run
+in a pool of worker processes, and most configurations are only trained with a
+small budget (a few hundred iterations): successive_halving trains a set of configurations
+with the smallest budget, keeps the best 1 / eta of them, multiplies the budget
+by eta, and repeats until the survivors have been trained with the full
+budget. hyperband runs several such brackets that trade off the number of
+configurations against the initial budget, so it does not depend on a single
+guess of how early poor configurations can be recognized.
+
+The data is copied once into shared memory blocks that every worker maps, so
+trials do not pickle the training set. Each worker applies a threading policy
+when it starts (see threading_policy.py); by default the cores are split
+evenly between the workers, so their BLAS threads do not oversubscribe them.
+
+A trial is a picklable callable trial(config, data, budget) that trains a
+model with the hyperparameters in the dictionary config for budget units of
+training and returns a validation accuracy history. ClassifierTrial does this
+for the classifiers that have their own train method:
+
+    trial = ClassifierTrial(Softmax)
+
+    def sample_config(rng):
+        return {'learning_rate': 10 ** rng.uniform(-8, -6),
+                'reg': 10 ** rng.uniform(3, 5)}
+
+    best, results = hyperband(trial, sample_config, data, max_budget=1500,
+                              min_budget=50)
+"""
+
+
+def share_arrays(arrays):
+    """
+    Copy a dictionary of arrays into shared memory.
+
+    Returns a tuple of:
+    - handles: Dictionary mapping each name to a picklable (block name, shape,
+      dtype) handle that attach_arrays accepts.
+    - blocks: List of the SharedMemory blocks; the caller must close and
+      unlink them when the arrays are no longer needed.
+    """
+    handles, blocks = {}, []
+    for name, a in arrays.items():
+        a = np.ascontiguousarray(a)
+        block = shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+        np.ndarray(a.shape, dtype=a.dtype, buffer=block.buf)[...] = a
+        handles[name] = (block.name, a.shape, a.dtype.str)
+        blocks.append(block)
+    return handles, blocks
+
+
+def attach_arrays(handles):
+    """
+    Map arrays created by share_arrays in another process.
+
+    Returns a tuple of:
+    - arrays: Dictionary of arrays backed by the shared memory blocks.
+    - blocks: List of the SharedMemory blocks, which must be kept alive as long
+      as the arrays are used.
+    """
+    arrays, blocks = {}, []
+    for name, (block_name, shape, dtype) in handles.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        blocks.append(block)
+    return arrays, blocks
+
+
+# Data and shared memory blocks of a worker process, set by _init_worker
+_worker_data = None
+_worker_blocks = None
+
+
+def _init_worker(handles, policies, counter):
+    global _worker_data, _worker_blocks
+    # Each worker takes the next rank from the shared counter; replacements
+    # of exited workers reuse the policies in turn
+    with counter.get_lock():
+        rank = counter.value
+        counter.value += 1
+    apply_policy(policies[rank % len(policies)])
+    _worker_data, _worker_blocks = attach_arrays(handles)
+
+
+def _run_trial(args):
+    """
+    Run one trial in a worker process on the shared data.
+    """
+    trial, config, budget, seed = args
+    return _call_trial(trial, config, _worker_data, budget, seed)
+
+
+def _call_trial(trial, config, data, budget, seed):
+    np.random.seed(seed)
+    history = [float(acc) for acc in trial(dict(config), data, budget)]
+    score = max(history) if history else 0.0
+    return score, history
+
+
+class _TrialRunner(object):
+    """
+    Runs batches of trials, in a process pool over shared memory, or in this
+    process if num_workers is 0.
+    """
+
+    def __init__(self, data, num_workers=None, policies=None):
+        self.data = data
+        self.num_workers = num_workers
+        self.policies = policies
+        self.pool = None
+        self.blocks = []
+
+
+    def __enter__(self):
+        if self.num_workers != 0:
+            num_workers = self.num_workers or os.cpu_count() or 1
+            policies = self.policies or worker_policies(num_workers)
+            handles, self.blocks = share_arrays(self.data)
+            # The workers start together, so they share one environment
+            ctx = worker_context()
+            counter = ctx.Value('i', 0)
+            with thread_environment(policies[0].get('blas_threads')):
+                self.pool = ctx.Pool(num_workers, initializer=_init_worker,
+                                     initargs=(handles, policies, counter))
+        return self
+
+
+    def __exit__(self, *args):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+    def map(self, trial, configs, budget, seeds):
+        if self.pool is None:
+            return [_call_trial(trial, config, self.data, budget, seed)
+                    for config, seed in zip(configs, seeds)]
+        jobs = [(trial, config, budget, seed) for config, seed in zip(configs, seeds)]
+        return self.pool.map(_run_trial, jobs, chunksize=1)
+
+
+def _successive_halving(runner, trial, configs, min_budget, max_budget, eta,
+                        seed, results, bracket=0):
+    """
+    Run successive halving with an existing runner, appending a result for
+    every trial to results.
+    """
+    trial_ids = list(range(len(configs)))
+    budget = min_budget
+    while trial_ids:
+        budget = min(budget, max_budget)
+        rung_budget = int(round(budget))
+        seeds = [seed + i for i in trial_ids]
+        outcomes = runner.map(trial, [configs[i] for i in trial_ids], rung_budget, seeds)
+        scores = []
+        for i, (score, history) in zip(trial_ids, outcomes):
+            results.append({'config': configs[i], 'trial': i, 'bracket': bracket,
+                            'budget': rung_budget, 'score': score,
+                            'val_acc_history': history})
+            scores.append(score)
+        if budget >= max_budget:
+            break
+        num_keep = max(len(trial_ids) // eta, 1)
+        order = np.argsort(scores, kind='stable')[::-1][:num_keep]
+        trial_ids = [trial_ids[j] for j in sorted(order)]
+        budget *= eta
+    return results
+
+
+def _best(results, max_budget):
+    """
+    Return the best result among the trials trained with the full budget.
+    """
+    full = [r for r in results if r['budget'] >= int(round(max_budget))]
+    return max(full or results, key=lambda r: r['score'])
+
+
+def successive_halving(trial, configs, data, min_budget, max_budget, eta=3,
+                       num_workers=None, seed=0, policies=None):
+    """
+    Search over a list of configurations with successive halving.
+
+    Inputs:
+    - trial: Picklable callable trial(config, data, budget) returning a list of
+      validation accuracies; its score is the best of them.
+    - configs: List of hyperparameter dictionaries.
+    - data: Dictionary of arrays passed to every trial, such as X_train,
+      y_train, X_val and y_val.
+    - min_budget: Budget of the first rung.
+    - max_budget: Budget the surviving configurations are trained with.
+    - eta: After each rung the best 1 / eta of the configurations are kept and
+      the budget is multiplied by eta.
+    - num_workers: Number of worker processes; None uses one per CPU and 0
+      runs the trials in this process.
+    - seed: Trial i runs with np.random.seed(seed + i).
+    - policies: Optional list of the threading policies of the workers (see
+      threading_policy.py); by default worker_policies(num_workers).
+
+    Returns a tuple of:
+    - best: The result of the best configuration trained with max_budget.
+    - results: List with a result for every trial, a dictionary with keys
+      'config', 'trial', 'bracket', 'budget', 'score' and 'val_acc_history'.
+    """
+    with _TrialRunner(data, num_workers, policies) as runner:
+        results = _successive_halving(runner, trial, configs, min_budget,
+                                      max_budget, eta, seed, [])
+    return _best(results, max_budget), results
+
+
+def hyperband(trial, sample_config, data, max_budget, min_budget=1, eta=3,
+              num_workers=None, seed=0, policies=None):
+    """
+    Search with Hyperband: several brackets of successive halving, from many
+    configurations with budget min_budget to few with budget max_budget.
+
+    Inputs:
+    - trial: Picklable callable trial(config, data, budget), as for
+      successive_halving.
+    - sample_config: Function that takes a numpy RandomState and returns a
+      random hyperparameter dictionary.
+    - data: Dictionary of arrays passed to every trial.
+    - max_budget: Largest budget a trial is trained with.
+    - min_budget: Smallest budget a trial is trained with.
+    - eta: Reduction factor of successive halving.
+    - num_workers: Number of worker processes; None uses one per CPU and 0
+      runs the trials in this process.
+    - seed: Seed for sampling configurations and for the trials.
+    - policies: Optional list of the threading policies of the workers, as
+      for successive_halving.
+
+    Returns a tuple of:
+    - best: The result of the best configuration trained with max_budget.
+    - results: List of the results of all trials, as for successive_halving.
+    """
+    rng = np.random.RandomState(seed)
+    s_max = int(math.floor(math.log(max_budget / min_budget, eta) + 1e-9))
+    results = []
+    with _TrialRunner(data, num_workers, policies) as runner:
+        for bracket, s in enumerate(range(s_max, -1, -1)):
+            n = int(math.ceil((s_max + 1) / (s + 1) * eta ** s))
+            configs = [sample_config(rng) for _ in range(n)]
+            _successive_halving(runner, trial, configs, max_budget / eta ** s,
+                                max_budget, eta, seed + 1000 * bracket, results,
+                                bracket=bracket)
+    return _best(results, max_budget), results
+
+
+def _split_kwargs(func, kwargs):
+    """
+    Split a dictionary into the keyword arguments func accepts and the rest.
+    """
+    names = inspect.signature(func).parameters
+    accepted = {k: v for k, v in kwargs.items() if k in names}
+    rest = {k: v for k, v in kwargs.items() if k not in names}
+    return accepted, rest
+
+
+class ClassifierTrial(object):
+    """
+    A trial that builds a classifier such as LinearSVM, Softmax or TwoLayerNet
+    and calls its train method with num_iters=budget.
+
+    Hyperparameters in the config that the constructor accepts (such as
+    hidden_size) are passed to it, and the rest (such as learning_rate and
+    reg) to train. Classifiers whose train method takes validation data and
+    returns a val_acc_history, like TwoLayerNet, are scored on that history;
+    the others on their final validation accuracy.
+    """
+
+    def __init__(self, classifier_class, init_kwargs=None, train_kwargs=None):
+        """
+        Inputs:
+        - classifier_class: The classifier class, such as Softmax.
+        - init_kwargs: Fixed keyword arguments for the constructor, such as
+          input_size and output_size for TwoLayerNet.
+        - train_kwargs: Fixed keyword arguments for train, such as batch_size.
+        """
+        self.classifier_class = classifier_class
+        self.init_kwargs = init_kwargs or {}
+        self.train_kwargs = train_kwargs or {}
+
+
+    def __call__(self, config, data, budget):
+        init_config, train_config = _split_kwargs(self.classifier_class.__init__, config)
+        classifier = self.classifier_class(**dict(self.init_kwargs, **init_config))
+
+        train_kwargs = dict(self.train_kwargs, **train_config)
+        train_kwargs['num_iters'] = budget
+        train_kwargs.setdefault('verbose', False)
+        X_val, y_val = data['X_val'], data['y_val']
+        if 'X_val' in inspect.signature(classifier.train).parameters:
+            stats = classifier.train(data['X_train'], data['y_train'], X_val, y_val,
+                                     **train_kwargs)
+            return stats['val_acc_history'] + [np.mean(classifier.predict(X_val) == y_val)]
+        classifier.train(data['X_train'], data['y_train'], **train_kwargs)
+        return [np.mean(classifier.predict(X_val) == y_val)]
@@ -0,0 +1,276 @@
+from __future__ import division
+from builtins import range
+from builtins import object
+import multiprocessing
+import os
+import warnings
+
+
+"""
+This file implements the threading policy of the training process and the
+worker processes that the library starts.
+
+NumPy's BLAS library (and any OpenMP runtime) starts one thread per core in
+every process by default. When several processes run at once, as in a
+hyperparameter search, each of them runs a full thread pool on the same cores,
+and the oversubscription can make the whole run slower than a single process.
+
+A policy is a dictionary with the following optional keys:
+- blas_threads: Number of threads of the BLAS and OpenMP libraries
+- cores: List of the CPU cores the process is pinned to
+
+apply_policy applies a policy to the calling process. The process pool of
+hyperparameter_search.py applies one policy per worker when it starts. By
+default these come from worker_policies, which splits the cores available to
+the calling process evenly between the workers and gives each worker an equal
+share of BLAS threads, without pinning:
+
+    policies = worker_policies(4, pin=True)
+    best, results = hyperband(trial, sample_config, data, max_budget=1500,
+                              num_workers=4, policies=policies)
+
+The thread counts of libraries that are already loaded can only be changed
+through the optional threadpoolctl package. Without it, BLAS and OpenMP
+libraries take their thread counts from environment variables when they are
+loaded. The pool therefore starts its workers from worker_context, which
+forks them when threadpoolctl is installed and spawns them otherwise, inside
+a thread_environment with the workers' thread count. Spawned
+workers import the main module again, so scripts that train with worker
+processes must guard their code with if __name__ == '__main__', and models or
+trials must be defined in modules rather than in a notebook. A notebook that
+defines its own can go back to forking the workers, at the cost of their BLAS
+thread counts:
+
+    set_worker_start_method('fork')
+
+In the calling process, set_blas_threads warns when it cannot change the
+libraries already loaded.
+"""
+
+
+# Environment variables read by OpenMP, OpenBLAS, MKL, BLIS and Accelerate
+_THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                    'BLIS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS')
+
+# The environment the process started with, which its libraries were loaded
+# with
+_STARTUP_ENV = {var: os.environ.get(var) for var in _THREAD_ENV_VARS}
+
+# Start method of the worker processes set by set_worker_start_method
+_worker_start_method = None
+
+
+def available_cores():
+    """
+    Return the sorted list of the CPU cores the calling process may run on.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def pin_to_cores(cores):
+    """
+    Restrict the calling process to a set of CPU cores.
+
+    Returns:
+    - pinned: False if the platform does not support CPU affinity, in which
+      case nothing is changed.
+    """
+    if not hasattr(os, 'sched_setaffinity'):
+        return False
+    os.sched_setaffinity(0, cores)
+    return True
+
+
+def get_blas_threads():
+    """
+    Return the thread counts of the BLAS and OpenMP libraries.
+
+    Returns:
+    - threads: Dictionary mapping the file name prefixes of the libraries
+      (such as 'libopenblas' or 'libgomp') to their number of threads if
+      threadpoolctl is installed; otherwise a dictionary mapping the thread
+      environment variables that are set to their values.
+    """
+    try:
+        from threadpoolctl import threadpool_info
+    except ImportError:
+        return {var: int(os.environ[var]) for var in _THREAD_ENV_VARS
+                if os.environ.get(var, '').isdigit()}
+    return {info['prefix']: info['num_threads'] for info in threadpool_info()}
+
+
+def blas_control_available():
+    """
+    Return True if threadpoolctl is installed, so that the thread counts of
+    libraries that are already loaded can be changed.
+    """
+    try:
+        import threadpoolctl
+    except ImportError:
+        return False
+    return True
+
+
+def set_blas_threads(n):
+    """
+    Set the number of threads of the BLAS and OpenMP libraries of the calling
+    process, and of the processes it starts later.
+
+    Without threadpoolctl, the libraries already loaded keep the thread count
+    they were loaded with. That is fine if the process was started with n
+    threads in its environment, as the workers of the pool are;
+    otherwise a RuntimeWarning is issued.
+
+    Returns:
+    - applied: True if the libraries of this process use n threads.
+    """
+    n = max(int(n), 1)
+    for var in _THREAD_ENV_VARS:
+        os.environ[var] = str(n)
+    if blas_control_available():
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=n)
+        return True
+    if all(_STARTUP_ENV[var] == str(n) for var in _THREAD_ENV_VARS):
+        return True
+    warnings.warn('threadpoolctl is not installed, so the BLAS and OpenMP libraries '
+                  'already loaded keep their thread count; only processes started '
+                  'later use %d threads' % n, RuntimeWarning)
+    return False
+
+
+class thread_environment(object):
+    """
+    Context manager setting the thread environment variables of the BLAS and
+    OpenMP libraries for a block and restoring them afterwards, so that
+    processes started by the 'spawn' method in the block load their libraries
+    with blas_threads threads. None leaves the environment unchanged.
+    """
+
+    def __init__(self, blas_threads):
+        self.blas_threads = blas_threads
+        self.previous = {}
+
+
+    def __enter__(self):
+        if self.blas_threads is not None:
+            self.previous = {var: os.environ.get(var) for var in _THREAD_ENV_VARS}
+            for var in _THREAD_ENV_VARS:
+                os.environ[var] = str(max(int(self.blas_threads), 1))
+        return self
+
+
+    def __exit__(self, *args):
+        for var, value in self.previous.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+        self.previous = {}
+
+
+def set_worker_start_method(method):
+    """
+    Set the multiprocessing start method ('fork', 'spawn' or 'forkserver') of
+    the worker processes of the pool; None restores the default chosen by
+    worker_context.
+    """
+    global _worker_start_method
+    _worker_start_method = method
+
+
+def worker_context():
+    """
+    Return the multiprocessing context that the pool starts its workers
+    from: the one set by set_worker_start_method if any, otherwise the default
+    one (fork on Linux) if threadpoolctl can set the thread counts of a worker
+    after it starts, and 'spawn' otherwise, so that every worker loads its
+    libraries with the environment set by thread_environment.
+    """
+    if _worker_start_method is not None:
+        return multiprocessing.get_context(_worker_start_method)
+    if blas_control_available():
+        return multiprocessing.get_context()
+    return multiprocessing.get_context('spawn')
+
+
+def get_policy():
+    """
+    Return the threading policy of the calling process.
+
+    Returns:
+    - policy: Dictionary with 'blas_threads' (see get_blas_threads) and
+      'cores'
+    """
+    return {'blas_threads': get_blas_threads(),
+            'cores': available_cores()}
+
+
+def apply_policy(policy):
+    """
+    Apply a threading policy to the calling process. Missing or None entries
+    are left unchanged.
+
+    Inputs:
+    - policy: Dictionary with the optional keys 'blas_threads' and 'cores';
+      None does nothing.
+    """
+    if not policy:
+        return
+    if policy.get('cores') is not None:
+        pin_to_cores(policy['cores'])
+    if policy.get('blas_threads') is not None:
+        set_blas_threads(policy['blas_threads'])
+
+
+def split_cores(num_groups, cores=None):
+    """
+    Split cores into num_groups contiguous, disjoint sets of nearly equal
+    size. If there are fewer cores than groups, the groups get one core each
+    and share them in turn.
+
+    Inputs:
+    - num_groups: Number of sets
+    - cores: List of cores to split; by default available_cores()
+
+    Returns:
+    - groups: List of num_groups lists of cores
+    """
+    if cores is None:
+        cores = available_cores()
+    if len(cores) < num_groups:
+        return [[cores[i % len(cores)]] for i in range(num_groups)]
+    bounds = [len(cores) * i // num_groups for i in range(num_groups + 1)]
+    return [list(cores[bounds[i]:bounds[i + 1]]) for i in range(num_groups)]
+
+
+def worker_policies(num_workers, blas_threads=None, pin=False, cores=None):
+    """
+    Build the threading policies of a group of worker processes that run at
+    the same time, so that their threads together do not outnumber the cores.
+
+    Inputs:
+    - num_workers: Number of worker processes
+    - blas_threads: Number of BLAS threads of each worker; by default the
+      number of cores divided by the number of workers, at least 1.
+    - pin: If True, pin each worker to its share of the cores.
+    - cores: List of cores to split between the workers; by default
+      available_cores()
+
+    Returns:
+    - policies: List of num_workers policy dictionaries
+    """
+    if cores is None:
+        cores = available_cores()
+    if blas_threads is None:
+        blas_threads = max(len(cores) // num_workers, 1)
+    policies = []
+    for group in split_cores(num_workers, cores):
+        policies.append({
+            'blas_threads': blas_threads,
+            'cores': group if pin else None,
+        })
+    return policies
+
@@ -0,0 +1,209 @@
+from builtins import range
+from builtins import object
+import pickle
+from queue import Empty
+
+import numpy as np
+
+from cs231n.bn_utils import batchnorm_params, running_stats
+from cs231n.inference import compile_inference_plan
+from cs231n.threading_policy import (apply_policy, start_worker, worker_context,
+                                     worker_policies)
+
+
+"""
+This file implements evaluation of training and validation accuracy in a
+separate worker process, so that training does not stop while it runs.
+
+Solver.check_accuracy scores the data with model.loss(X) in the training
+process, in batches of 100, and every call builds the caches a backward pass
+would need. An AsyncEvaluator instead hands a copy of the model to a worker
+process once, when it starts, together with the training and validation
+data. Each snapshot then only sends the parameters and the batch
+normalization running averages, which the worker loads into its copy before
+it compiles a forward-only inference plan (see inference.py) with a large
+batch size and scores the data with it.
+Results come back in the order the snapshots were submitted, tagged with the
+iteration and epoch they belong to.
+
+The worker runs alongside the training process, so by default it is limited
+to the BLAS threads of half of the cores (see threading_policy.py).
+"""
+
+
+def forward_accuracy(model, X, y, batch_size=1000):
+    """
+    Compute the classification accuracy of a model without building caches.
+
+    Models that compile_inference_plan supports are scored with an inference
+    plan; any other model falls back to model.loss(X).
+
+    Inputs:
+    - model: A model object
+    - X: Array of data, of shape (N, d_1, ..., d_k)
+    - y: Array of labels, of shape (N,)
+    - batch_size: Number of examples scored at a time
+
+    Returns:
+    - acc: Fraction of examples classified correctly
+    """
+    N = X.shape[0]
+    if N == 0:
+        return 0.0
+    input_dim = X.shape[1:] if X.ndim == 4 else None
+    plans = {}
+    num_correct = 0
+    for start in range(0, N, batch_size):
+        X_batch = X[start:start + batch_size]
+        n = X_batch.shape[0]
+        if n not in plans:
+            try:
+                plans[n] = compile_inference_plan(model, n, input_dim)
+            except ValueError:
+                plans[n] = model.loss
+        scores = plans[n](X_batch)
+        num_correct += np.sum(np.argmax(scores, axis=1) == y[start:start + n])
+    return num_correct / float(N)
+
+
+def _eval_worker(tasks, results, model, X_train, y_train, X_val, y_val, batch_size, policy):
+    """
+    Loop of the worker process: apply the threading policy, then load each
+    snapshot of the parameters and running averages that arrives on tasks
+    into model, score it and put (iteration, epoch, train_acc, val_acc) on
+    results. A None task ends the loop.
+    """
+    apply_policy(policy)
+    bn_params = batchnorm_params(model)
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        iteration, epoch, snapshot_bytes, train_idx, val_idx = task
+        try:
+            model.params, stats = pickle.loads(snapshot_bytes)
+            for bn_param, s in zip(bn_params, stats):
+                bn_param.update(s)
+            X, y = X_train, y_train
+            if train_idx is not None:
+                X, y = X_train[train_idx], y_train[train_idx]
+            train_acc = forward_accuracy(model, X, y, batch_size)
+            X, y = X_val, y_val
+            if val_idx is not None:
+                X, y = X_val[val_idx], y_val[val_idx]
+            val_acc = forward_accuracy(model, X, y, batch_size)
+            results.put((iteration, epoch, train_acc, val_acc))
+        except Exception as e:
+            results.put(e)
+
+
+class AsyncEvaluator(object):
+    """
+    Scores model snapshots in a worker process while training continues.
+
+    Example usage:
+
+    evaluator = AsyncEvaluator(X_train, y_train, X_val, y_val)
+    evaluator.start(model)
+    for t in range(num_iterations):
+        ...
+        if epoch_end:
+            evaluator.submit(model, t + 1, epoch)
+        for iteration, epoch, train_acc, val_acc in evaluator.poll():
+            ...
+    results = evaluator.close()
+    """
+
+    def __init__(self, X_train, y_train, X_val, y_val, batch_size=1000, policy=None):
+        """
+        Inputs:
+        - X_train, y_train, X_val, y_val: The data to evaluate on; it is passed
+          to the worker once, when it starts.
+        - batch_size: Number of examples the worker scores at a time.
+        - policy: Threading policy of the worker (see threading_policy.py); by
+          default the second of worker_policies(2), leaving the other half of
+          the cores to the training process.
+        """
+        self.data = (X_train, y_train, X_val, y_val)
+        self.batch_size = batch_size
+        self.policy = worker_policies(2)[1] if policy is None else policy
+        self.num_pending = 0
+        self._process = None
+
+
+    def start(self, model):
+        """
+        Start the worker process with a copy of the model. Later snapshots only
+        carry the parameters and running averages, so every model submitted
+        afterwards must have the same architecture.
+        """
+        if self._process is not None:
+            return
+        ctx = worker_context()
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        args = (self._tasks, self._results, model) + self.data + (self.batch_size, self.policy)
+        self._process = ctx.Process(target=_eval_worker, args=args)
+        self._process.daemon = True
+        start_worker(self._process, self.policy)
+
+
+    def submit(self, model, iteration, epoch, train_idx=None, val_idx=None):
+        """
+        Queue a snapshot of a model for evaluation. Its parameters and batch
+        normalization running averages are pickled before this returns, so
+        training may go on to modify them.
+
+        Inputs:
+        - model: The model to evaluate; the worker is started with it on the
+          first call.
+        - iteration, epoch: Tags returned with the result
+        - train_idx, val_idx: Optional indices of the subsets of the training
+          and validation data to evaluate on; None evaluates on all of it.
+        """
+        if self._process is None:
+            self.start(model)
+        snapshot = (dict(model.params), running_stats(batchnorm_params(model)))
+        snapshot_bytes = pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL)
+        self._tasks.put((iteration, epoch, snapshot_bytes, train_idx, val_idx))
+        self.num_pending += 1
+
+
+    def poll(self, block=False):
+        """
+        Collect finished evaluations.
+
+        Inputs:
+        - block: If True, wait until every submitted snapshot is evaluated.
+
+        Returns:
+        - results: List of (iteration, epoch, train_acc, val_acc) tuples in
+          the order the snapshots were submitted.
+        """
+        results = []
+        while self.num_pending > 0:
+            try:
+                result = self._results.get(block=block)
+            except Empty:
+                break
+            self.num_pending -= 1
+            if isinstance(result, Exception):
+                raise result
+            results.append(result)
+        return results
+
+
+    def close(self):
+        """
+        Wait for all pending evaluations and stop the worker process.
+
+        Returns:
+        - results: The evaluations that had not been collected yet.
+        """
+        if self._process is None:
+            return []
+        results = self.poll(block=True)
+        self._tasks.put(None)
+        self._process.join()
+        self._process = None
+        return results
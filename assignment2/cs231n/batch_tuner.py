@@ -0,0 +1,177 @@
+from __future__ import print_function, division
+import time
+
+import numpy as np
+
+from cs231n.memory_profiler import MemoryProfiler, format_bytes
+
+
+"""
+This file implements a search for the batch size to train a model with under
+a memory budget.
+
+autotune_batch_size runs a short probe for each of a geometric sequence of
+batch sizes (8, 16, 32, ... by default) on a synthetic minibatch of the given
+input shape. Each probe measures the peak activation memory of one training
+step of model.loss with a MemoryProfiler (see memory_profiler.py), adds the
+memory that does not depend on the activations (the minibatch itself, the
+parameters, their gradients and the state of the update rule), and then times
+a few more steps without the profiler to measure samples per second. The
+search stops at the first batch size over budget, since memory only grows with
+the batch size. Of the batch sizes that fit, it recommends the largest whose
+throughput is within tolerance of the best one:
+
+    result = autotune_batch_size(model, (3, 32, 32), 512 * 1024 ** 2)
+    solver = Solver(model, data, batch_size=result['batch_size'], ...)
+
+Passing batch_size='auto' and memory_budget to a Solver or CaptioningSolver
+runs the search on its model and training data before training. For a
+captioning model (one with a word_to_idx vocabulary), input_shape is the shape
+of the image features and the synthetic captions have caption_length words.
+
+The activation memory does not include the temporaries of the backward pass,
+so leave some headroom in the budget.
+"""
+
+
+# Number of arrays of the size of the parameters that each update rule in
+# optim.py keeps in its config
+OPTIMIZER_SLOTS = {'sgd': 0, 'sgd_momentum': 1, 'rmsprop': 1, 'adam': 2}
+
+
+def synthetic_batch(model, input_shape, batch_size, caption_length=17, seed=0):
+    """
+    Build a random minibatch for model.loss.
+
+    Inputs:
+    - model: A classifier whose loss takes (X, y), or a captioning model whose
+      loss takes (features, captions)
+    - input_shape: Shape of one input (or of the features of one image)
+    - batch_size: Number of examples
+    - caption_length: Length of the captions for a captioning model
+    - seed: Seed of the random data
+
+    Returns:
+    - args: Tuple of the arguments for model.loss
+    """
+    rng = np.random.RandomState(seed)
+    dtype = getattr(model, 'dtype', np.float32)
+    X = rng.randn(batch_size, *input_shape).astype(dtype)
+    word_to_idx = getattr(model, 'word_to_idx', None)
+    if word_to_idx is not None:
+        captions = rng.randint(len(word_to_idx), size=(batch_size, caption_length))
+        return X, captions
+    return X, np.zeros(batch_size, dtype=int)
+
+
+def _update_rule_name(update_rule):
+    return update_rule if isinstance(update_rule, str) else update_rule.__name__
+
+
+def probe_batch_size(model, input_shape, batch_size, update_rule='sgd',
+                     num_steps=3, caption_length=17):
+    """
+    Measure the memory and throughput of training steps with one batch size.
+
+    Inputs:
+    - model: The model to probe; its parameters, batch normalization running
+      averages and the global numpy random state are left unchanged
+    - input_shape: Shape of one input
+    - batch_size: The batch size to probe
+    - update_rule: Name of the update rule (or the function from optim.py),
+      to account for its state
+    - num_steps: Number of timed steps
+    - caption_length: Length of the captions for a captioning model
+
+    Returns:
+    - probe: Dictionary with 'batch_size', 'activation_bytes' (peak activation
+      memory of a step), 'total_bytes' (activations plus the minibatch, the
+      parameters, their gradients and the update rule state) and
+      'samples_per_sec'.
+    """
+    args = synthetic_batch(model, input_shape, batch_size, caption_length)
+    slots = OPTIMIZER_SLOTS.get(_update_rule_name(update_rule), 2)
+    param_bytes = sum(p.nbytes for p in model.params.values())
+
+    # Training steps update the running averages of batch normalization and
+    # draw dropout masks, so both are put back afterwards
+    random_state = np.random.get_state()
+    bn_stats = [{k: v.copy() for k, v in bn_param.items() if isinstance(v, np.ndarray)}
+                for bn_param in getattr(model, 'bn_params', [])]
+    try:
+        profiler = MemoryProfiler(model)
+        with profiler:
+            model.loss(*args)
+        activation_bytes = profiler.peak_bytes()
+
+        start = time.perf_counter()
+        for _ in range(num_steps):
+            model.loss(*args)
+        elapsed = time.perf_counter() - start
+    finally:
+        np.random.set_state(random_state)
+        for bn_param, stats in zip(getattr(model, 'bn_params', []), bn_stats):
+            bn_param.update(stats)
+
+    return {
+        'batch_size': batch_size,
+        'activation_bytes': activation_bytes,
+        'total_bytes': (activation_bytes + sum(a.nbytes for a in args) +
+                        (2 + slots) * param_bytes),
+        'samples_per_sec': num_steps * batch_size / elapsed if elapsed > 0 else float('inf'),
+    }
+
+
+def autotune_batch_size(model, input_shape, memory_budget, min_batch_size=8,
+                        max_batch_size=4096, growth=2, update_rule='sgd',
+                        num_steps=3, tolerance=0.05, caption_length=17,
+                        verbose=False):
+    """
+    Find the batch size with the best training throughput under a memory
+    budget.
+
+    Inputs:
+    - model: The model to train
+    - input_shape: Shape of one input, such as (3, 32, 32)
+    - memory_budget: Memory budget of a training step in bytes
+    - min_batch_size: First batch size probed
+    - max_batch_size: No larger batch size is probed
+    - growth: Factor between successive batch sizes
+    - update_rule: Name of the update rule that will train the model
+    - num_steps: Number of timed steps per probe
+    - tolerance: Batch sizes whose throughput is within this fraction of the
+      best one count as equally fast, and the largest of them is chosen
+    - caption_length: Length of the captions for a captioning model
+    - verbose: If True, print every probe
+
+    Returns:
+    - result: Dictionary with the recommended 'batch_size' and 'probes', the
+      list of probe_batch_size results with 'fits' set on each.
+    """
+    if growth <= 1:
+        raise ValueError('growth must be greater than 1')
+    probes = []
+    batch_size = min_batch_size
+    while batch_size <= max_batch_size:
+        probe = probe_batch_size(model, input_shape, batch_size, update_rule,
+                                 num_steps, caption_length)
+        probe['fits'] = probe['total_bytes'] <= memory_budget
+        probes.append(probe)
+        if verbose:
+            print('batch size %5d: %s, %.1f samples / sec%s' % (
+                  batch_size, format_bytes(probe['total_bytes']),
+                  probe['samples_per_sec'], '' if probe['fits'] else ' (over budget)'))
+        if not probe['fits']:
+            break
+        if batch_size == max_batch_size:
+            break
+        batch_size = min(max(int(batch_size * growth), batch_size + 1), max_batch_size)
+
+    fitting = [p for p in probes if p['fits']]
+    if not fitting:
+        raise ValueError('A batch size of %d needs %s, over the budget of %s' % (
+                         min_batch_size, format_bytes(probes[0]['total_bytes']),
+                         format_bytes(memory_budget)))
+    best = max(p['samples_per_sec'] for p in fitting)
+    fast = [p for p in fitting if p['samples_per_sec'] >= (1 - tolerance) * best]
+    return {'batch_size': max(p['batch_size'] for p in fast), 'probes': probes}
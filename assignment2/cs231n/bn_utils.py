@@ -0,0 +1,73 @@
+"""
+This file implements helpers for the running averages of the batch
+normalization layers of a model, which the Solver and the worker processes
+(async_eval.py, data_parallel.py, pipeline.py and parameter_server.py) copy,
+send between processes and combine.
+
+A model keeps one bn_param dictionary per batch normalization layer, either
+in model.bn_params (FullyConnectedNet) or on its layers (Sequential); the
+running averages are the RUNNING_STATS entries of these dictionaries.
+"""
+
+
+# Entries of a bn_param dictionary that hold running averages
+RUNNING_STATS = ('running_mean', 'running_var')
+
+
+def batchnorm_params(model):
+    """
+    Return the bn_param dictionaries of all batch normalization layers of a
+    model, whether it keeps them in model.bn_params (FullyConnectedNet) or on
+    its layers (Sequential).
+    """
+    bn_params = list(getattr(model, 'bn_params', []))
+    for layer in getattr(model, 'layers', []):
+        if hasattr(layer, 'bn_param'):
+            bn_params.append(layer.bn_param)
+    return bn_params
+
+
+def running_stats(bn_params):
+    """
+    Copy the running averages of a list of bn_param dictionaries.
+    """
+    return [{name: bn_param[name].copy() for name in RUNNING_STATS if name in bn_param}
+            for bn_param in bn_params]
+
+
+def accumulate_batch_stats(bn_params, prev_stats, totals, weight=1.0):
+    """
+    Recover the statistics of the batch behind the latest momentum update of
+    the running averages, and add them to totals.
+
+    A batch normalization layer in train mode sets each running average to
+    momentum * previous + (1 - momentum) * batch statistic, so the batch
+    statistic follows from the running average before and after the update.
+
+    Inputs:
+    - bn_params: List of bn_param dictionaries, after the update
+    - prev_stats: The running averages before the update, as returned by
+      running_stats(bn_params)
+    - totals: List of dictionaries, one per bn_param, to which weight times
+      the batch statistics are added
+    - weight: Weight of the batch
+    """
+    for bn_param, prev, total in zip(bn_params, prev_stats, totals):
+        momentum = bn_param.get('momentum', 0.9)
+        for name in RUNNING_STATS:
+            if name in bn_param:
+                sample = (bn_param[name] - momentum * prev.get(name, 0.0)) / (1 - momentum)
+                total[name] = total.get(name, 0.0) + weight * sample
+
+
+def apply_batch_stats(bn_params, start_stats, totals):
+    """
+    Set the running averages as if a single momentum update had been made
+    from start_stats with the batch statistics in totals, such as the
+    weighted mean built by accumulate_batch_stats.
+    """
+    for bn_param, start, total in zip(bn_params, start_stats, totals):
+        momentum = bn_param.get('momentum', 0.9)
+        for name, value in total.items():
+            running = momentum * start.get(name, 0.0) + (1 - momentum) * value
+            bn_param[name] = running.astype(bn_param[name].dtype)
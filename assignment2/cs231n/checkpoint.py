@@ -0,0 +1,236 @@
+from builtins import object
+import os
+import threading
+from queue import Queue
+
+import numpy as np
+
+from cs231n.bn_utils import RUNNING_STATS
+
+
+"""
+This file implements compact checkpoints that are written on a background
+thread.
+
+Pickling the whole Solver state (the model object with its caches and
+configuration, and every history list) on every epoch stalls training for the
+time it takes to serialize and write it. A checkpoint here holds only arrays:
+the parameters, the optimizer state, the batch normalization running averages
+and a few counters, stored in one .npz file under flat names:
+
+    'param/W1'                 parameter W1
+    'param/__flat__'           all parameters of a flat buffer (flat_params.py)
+    'layout/W1'                offset and shape of W1 in 'param/__flat__'
+    'optim/W1/m'               entry 'm' of the update rule config of W1
+    'bn/0/running_mean'        running mean of the first batchnorm layer
+    'epoch', 'iteration', ...  counters, as 0-d arrays
+
+The training thread only copies the arrays (the update rules modify them in
+place) and hands them to a CheckpointWriter, whose thread writes each file
+under a temporary name and renames it into place, so a checkpoint on disk is
+never partially written. The writer keeps the last keep_last epoch checkpoints
+and a separate checkpoint of the best parameters.
+"""
+
+
+def checkpoint_arrays(params, optim_configs=None, bn_params=None, layout=None, **counters):
+    """
+    Copy the state of training into a flat dictionary of arrays.
+
+    Inputs:
+    - params: Dictionary mapping parameter names to arrays, or a 1-D flat
+      buffer of parameters if layout is given.
+    - optim_configs: Optional dictionary mapping parameter names to update
+      rule configs. Array and scalar entries are saved; other entries, and the
+      preallocated 'scratch' arrays of the update rules, are not.
+    - bn_params: Optional list of bn_param dictionaries whose running averages
+      are saved.
+    - layout: The layout of a flat buffer (FlatParams.layout), mapping
+      parameter names to (offset, shape). The buffer is then saved with a
+      single copy.
+    - counters: Scalars such as epoch and iteration.
+
+    Returns:
+    - arrays: Dictionary mapping names to copies of the arrays.
+    """
+    arrays = {}
+    if layout is not None:
+        arrays['param/__flat__'] = np.array(params)
+        for k, (offset, shape) in layout.items():
+            arrays['layout/%s' % k] = np.array((offset,) + tuple(shape), dtype=np.int64)
+    else:
+        for k, v in params.items():
+            arrays['param/%s' % k] = np.array(v)
+    for p, config in (optim_configs or {}).items():
+        for k, v in config.items():
+            if k == 'scratch' or not isinstance(v, (np.ndarray, int, float, np.number)):
+                continue
+            arrays['optim/%s/%s' % (p, k)] = np.array(v)
+    for i, bn_param in enumerate(bn_params or []):
+        for k in RUNNING_STATS:
+            if k in bn_param:
+                arrays['bn/%d/%s' % (i, k)] = np.array(bn_param[k])
+    for k, v in counters.items():
+        arrays[k] = np.array(v)
+    return arrays
+
+
+def load_checkpoint(filename):
+    """
+    Load a checkpoint written by a CheckpointWriter.
+
+    Returns a tuple of:
+    - params: Dictionary mapping parameter names to arrays; for a flat buffer
+      these are views into it.
+    - optim_configs: Dictionary mapping parameter names to the saved entries
+      of their update rule configs; 0-d entries are returned as scalars.
+    - bn_stats: List of dictionaries with the saved running averages
+    - counters: Dictionary of the remaining scalars
+    """
+    params, optim_configs, bn_stats, counters, layout = {}, {}, {}, {}, {}
+    with np.load(filename) as f:
+        for name in f.files:
+            value = f[name]
+            parts = name.split('/')
+            if parts[0] == 'param':
+                params['/'.join(parts[1:])] = value
+            elif parts[0] == 'layout':
+                layout['/'.join(parts[1:])] = value
+            elif parts[0] == 'optim':
+                p, k = '/'.join(parts[1:-1]), parts[-1]
+                optim_configs.setdefault(p, {})[k] = value if value.ndim else value.item()
+            elif parts[0] == 'bn':
+                bn_stats.setdefault(int(parts[1]), {})[parts[2]] = value
+            else:
+                counters[name] = value.item()
+    bn_stats = [bn_stats[i] for i in sorted(bn_stats)]
+    if layout:
+        flat = params.pop('__flat__')
+        for k, entry in layout.items():
+            offset, shape = int(entry[0]), tuple(int(d) for d in entry[1:])
+            params[k] = flat[offset:offset + int(np.prod(shape))].reshape(shape)
+    return params, optim_configs, bn_stats, counters
+
+
+def _write_atomic(filename, arrays):
+    """
+    Write arrays to filename as an .npz file under a temporary name, then
+    rename it into place.
+    """
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+
+
+class CheckpointWriter(object):
+    """
+    Writes checkpoints on a background thread.
+
+    Example usage:
+
+    writer = CheckpointWriter('model', keep_last=3)
+    for epoch in range(num_epochs):
+        ...
+        writer.save(checkpoint_arrays(model.params, epoch=epoch), epoch)
+    writer.close()
+    """
+
+    def __init__(self, checkpoint_name, keep_last=3):
+        """
+        Inputs:
+        - checkpoint_name: Prefix of the checkpoint files; checkpoints are
+          written to '<checkpoint_name>_epoch_<epoch>.npz' and the best one to
+          '<checkpoint_name>_best.npz'.
+        - keep_last: Number of epoch checkpoints kept on disk; older ones are
+          deleted. None keeps all of them.
+        """
+        self.checkpoint_name = checkpoint_name
+        self.keep_last = keep_last
+        self.written = []
+        self._queue = Queue()
+        self._error = None
+        self._thread = None
+
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            filename, arrays, is_epoch = job
+            try:
+                _write_atomic(filename, arrays)
+                if is_epoch:
+                    if filename in self.written:
+                        self.written.remove(filename)
+                    self.written.append(filename)
+                    while self.keep_last is not None and len(self.written) > self.keep_last:
+                        os.remove(self.written.pop(0))
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+
+    def _put(self, job):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        self._queue.put(job)
+
+
+    def save(self, arrays, epoch):
+        """
+        Queue an epoch checkpoint. arrays must not be modified afterwards; use
+        checkpoint_arrays to copy them.
+
+        Returns:
+        - filename: The file the checkpoint will be written to.
+        """
+        filename = '%s_epoch_%d.npz' % (self.checkpoint_name, epoch)
+        self._put((filename, arrays, True))
+        return filename
+
+
+    def save_best(self, arrays):
+        """
+        Queue a checkpoint of the best model, replacing the previous one.
+
+        Returns:
+        - filename: The file the checkpoint will be written to.
+        """
+        filename = '%s_best.npz' % self.checkpoint_name
+        self._put((filename, arrays, False))
+        return filename
+
+
+    def flush(self):
+        """
+        Wait until every queued checkpoint is written.
+        """
+        if self._thread is not None:
+            self._queue.join()
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+
+    def close(self):
+        """
+        Write the queued checkpoints and stop the background thread.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
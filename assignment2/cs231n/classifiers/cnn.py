@@ -32,11 +32,16 @@ class ThreeLayerConvNet(object):
         - weight_scale: Scalar giving standard deviation for random initialization
           of weights.
         - reg: Scalar giving L2 regularization strength
-        - dtype: numpy datatype to use for computation.
+        - dtype: numpy datatype to use for computation. With float16,
+          activations and parameters are stored in half precision while
+          matrix products accumulate in float32.
         """
         self.params = {}
         self.reg = reg
         self.dtype = dtype
+        # The gradient of the loss is multiplied by loss_scale before it is
+        # backpropagated; Solver sets it when training in mixed precision.
+        self.loss_scale = 1.0
 
         ############################################################################
         # TODO: Initialize weights and biases for the three-layer convolutional    #
@@ -79,6 +84,7 @@ class ThreeLayerConvNet(object):
 
         Input / output: Same API as TwoLayerNet in fc_net.py.
         """
+        X = X.astype(self.dtype, copy=False)
         W1, b1 = self.params['W1'], self.params['b1']
         W2, b2 = self.params['W2'], self.params['b2']
         W3, b3 = self.params['W3'], self.params['b3']
@@ -119,16 +125,20 @@ class ThreeLayerConvNet(object):
         # for self.params[k]. Don't forget to add L2 regularization!               #
         ############################################################################
         loss, grad_out = softmax_loss(scores, y)
+        reg = self.reg
+        if self.loss_scale != 1.0:
+            grad_out *= self.loss_scale
+            reg = self.reg * self.loss_scale
 
         grad_affine_out, grads['W3'], grads['b3'] = affine_backward(grad_out, affine_cache)
-        grads['W3'] += self.reg * W3
+        grads['W3'] += reg * W3
 
         grad_affine_relu_out, grads['W2'], grads['b2'] = affine_relu_backward(grad_affine_out, affine_relu_cache)
         grad_affine_relu_out = grad_affine_relu_out.reshape((N, num_filters, height, width))
-        grads['W2'] += self.reg * W2
+        grads['W2'] += reg * W2
 
         grad_conv_relu_pool_out, grads['W1'], grads['b1'] = conv_relu_pool_backward(grad_affine_relu_out, conv_relu_pool_cache)
-        grads['W1'] += self.reg * W1
+        grads['W1'] += reg * W1
 
         loss += self.reg * np.sum(W3 * W3)
         loss += self.reg * np.sum(W2 * W2)
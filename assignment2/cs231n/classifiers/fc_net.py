@@ -140,7 +140,8 @@ class FullyConnectedNet(object):
 
     def __init__(self, hidden_dims, input_dim=3*32*32, num_classes=10,
                  dropout=0, use_batchnorm=False, reg=0.0,
-                 weight_scale=1e-2, dtype=np.float32, seed=None):
+                 weight_scale=1e-2, dtype=np.float32, seed=None,
+                 sparse_layers=None, sparse_threshold=0.3, fuse=False):
         """
         Initialize a new FullyConnectedNet.
 
@@ -157,16 +158,31 @@ class FullyConnectedNet(object):
         - dtype: A numpy datatype object; all computations will be performed using
           this datatype. float32 is faster but less accurate, so you should use
           float64 for numeric gradient checking.
+          With float16, activations and parameters are stored in half precision
+          while matrix products accumulate in float32; train such a model with
+          Solver(..., mixed_precision=True).
         - seed: If not None, then pass this random seed to the dropout layers. This
           will make the dropout layers deteriminstic so we can gradient check the
           model.
+        - sparse_layers: If not None, an iterable of layer indices (1 for W1, 2
+          for W2, etc) whose affine transform should use affine_forward_sparse.
+          This only pays off for layers fed by a ReLU or dropout, so layer 1
+          should normally be left out.
+        - sparse_threshold: Input density below which the sparse layers switch
+          to a compressed representation.
+        - fuse: If True, hidden layers that are not sparse use the fused
+          sandwiches built by layer_utils.fuse_layers.
         """
         self.use_batchnorm = use_batchnorm
         self.use_dropout = dropout > 0
+        self.fuse = fuse
         self.reg = reg
         self.num_layers = 1 + len(hidden_dims)
         self.dtype = dtype
         self.params = {}
+        # The gradient of the loss is multiplied by loss_scale before it is
+        # backpropagated; Solver sets it when training in mixed precision.
+        self.loss_scale = 1.0
 
         ############################################################################
         # TODO: Initialize the parameters of the network, storing all values in    #
@@ -218,6 +234,13 @@ class FullyConnectedNet(object):
         if self.use_batchnorm:
             self.bn_params = [{'mode': 'train'} for i in range(self.num_layers - 1)]
 
+        # Each sparse layer gets its own sparse_param so that the measured input
+        # density can be inspected per layer after a forward pass.
+        self.sparse_params = {}
+        if sparse_layers is not None:
+            for l in sparse_layers:
+                self.sparse_params[l] = {'threshold': sparse_threshold}
+
         # Cast all parameters to the correct datatype
         for k, v in self.params.items():
             self.params[k] = v.astype(dtype)
@@ -229,7 +252,7 @@ class FullyConnectedNet(object):
 
         Input / output: Same as TwoLayerNet above.
         """
-        X = X.astype(self.dtype)
+        X = X.astype(self.dtype, copy=False)
         mode = 'test' if y is None else 'train'
 
         # Set train/test mode for batchnorm params and dropout param since they
@@ -257,18 +280,7 @@ class FullyConnectedNet(object):
         prev_output = X
         for n in range(self.num_layers):
             l = n + 1
-            weight = self.params['W' + str(l)]
-            bias = self.params['b' + str(l)]
-
-            if l == self.num_layers:
-                prev_output, cache_list[l] = affine_forward(prev_output, weight, bias)
-            else:
-                if self.use_batchnorm:
-                    prev_output, cache_list[l] = affine_batchnorm_relu_forward(prev_output, weight, bias, self.params['gamma'+ str(l)], self.params['beta'+ str(l)], self.bn_params[n])
-                elif self.use_dropout:
-                    prev_output, cache_list[l] = affine_relu_drop_forward(prev_output, weight, bias, self.dropout_param)
-                else:
-                    prev_output, cache_list[l] = affine_relu_forward(prev_output, weight, bias)
+            prev_output, cache_list[l] = self.layer_forward(l, prev_output)
 
         scores = prev_output
         ############################################################################
@@ -299,23 +311,91 @@ class FullyConnectedNet(object):
             l = n + 1
             loss += 0.5 * self.reg * np.sum(self.params['W' + str(l)] * self.params['W' + str(l)])
 
+        # Scale the gradients (including regularization) by loss_scale
+        reg = self.reg
+        if self.loss_scale != 1.0:
+            din *= self.loss_scale
+            reg = self.reg * self.loss_scale
+
         for n in reversed(range(self.num_layers)):
             l = n + 1
-            if l == self.num_layers:
-                din, grads['W' + str(l)], grads['b' + str(l)] = affine_backward(din, cache_list[l])
-                grads['W' + str(l)] += self.reg * self.params['W'+str(l)]
-            else:
-                if self.use_batchnorm:
-                    din, grads['W' + str(l)], grads['b' + str(l)], grads["gamma"+str(l)], grads["beta"+str(l)] = affine_batchnorm_relu_backward(din, cache_list[l])
-                    grads['W' + str(l)] += self.reg * self.params['W'+str(l)]
-                elif self.use_dropout:
-                    din, grads['W' + str(l)], grads['b' + str(l)] = affine_relu_drop_backward(din, cache_list[l])
-                    grads['W' + str(l)] += self.reg * self.params['W'+str(l)]
-                else:
-                    din, grads['W' + str(l)], grads['b' + str(l)] = affine_relu_backward(din, cache_list[l])
-                    grads['W' + str(l)] += self.reg * self.params['W' + str(l)]
+            din, layer_grads = self.layer_backward(l, din, cache_list[l])
+            grads.update(layer_grads)
+            grads['W' + str(l)] += reg * self.params['W' + str(l)]
         ############################################################################
         #                             END OF YOUR CODE                             #
         ############################################################################
 
         return loss, grads
+
+
+    def layer_forward(self, l, x):
+        """
+        Forward pass of one layer of the network: the affine transform,
+        followed for hidden layers by batch normalization, the ReLU and
+        dropout, as configured. The batchnorm and dropout modes are the ones
+        set by the last call of loss.
+
+        Inputs:
+        - l: Index of the layer, from 1 (W1) to num_layers
+        - x: Input of the layer
+
+        Returns a tuple of:
+        - out: Output of the layer
+        - cache: Cache for layer_backward
+        """
+        weight = self.params['W' + str(l)]
+        bias = self.params['b' + str(l)]
+        sparse_param = self.sparse_params.get(l)
+
+        if l == self.num_layers:
+            if sparse_param is not None:
+                return affine_forward_sparse(x, weight, bias, sparse_param)
+            return affine_forward(x, weight, bias)
+        if self.fuse and sparse_param is None:
+            if self.use_batchnorm:
+                return affine_batchnorm_relu_forward_fused(x, weight, bias, self.params['gamma'+ str(l)], self.params['beta'+ str(l)], self.bn_params[l - 1])
+            if self.use_dropout:
+                return affine_relu_drop_forward_fused(x, weight, bias, self.dropout_param)
+            return affine_relu_forward_fused(x, weight, bias)
+        if self.use_batchnorm:
+            return affine_batchnorm_relu_forward(x, weight, bias, self.params['gamma'+ str(l)], self.params['beta'+ str(l)], self.bn_params[l - 1], sparse_param)
+        if self.use_dropout:
+            return affine_relu_drop_forward(x, weight, bias, self.dropout_param, sparse_param)
+        return affine_relu_forward(x, weight, bias, sparse_param)
+
+
+    def layer_backward(self, l, dout, cache):
+        """
+        Backward pass of one layer of the network, without regularization.
+
+        Inputs:
+        - l: Index of the layer, from 1 (W1) to num_layers
+        - dout: Upstream derivative
+        - cache: Cache from layer_forward
+
+        Returns a tuple of:
+        - dx: Gradient with respect to the input of the layer
+        - grads: Dictionary of the gradients of the parameters of the layer
+        """
+        W, b, gamma, beta = 'W' + str(l), 'b' + str(l), 'gamma' + str(l), 'beta' + str(l)
+        grads = {}
+        if l == self.num_layers:
+            if l in self.sparse_params:
+                dx, grads[W], grads[b] = affine_backward_sparse(dout, cache)
+            else:
+                dx, grads[W], grads[b] = affine_backward(dout, cache)
+        elif self.fuse and l not in self.sparse_params:
+            if self.use_batchnorm:
+                dx, grads[W], grads[b], grads[gamma], grads[beta] = affine_batchnorm_relu_backward_fused(dout, cache)
+            elif self.use_dropout:
+                dx, grads[W], grads[b] = affine_relu_drop_backward_fused(dout, cache)
+            else:
+                dx, grads[W], grads[b] = affine_relu_backward_fused(dout, cache)
+        elif self.use_batchnorm:
+            dx, grads[W], grads[b], grads[gamma], grads[beta] = affine_batchnorm_relu_backward(dout, cache)
+        elif self.use_dropout:
+            dx, grads[W], grads[b] = affine_relu_drop_backward(dout, cache)
+        else:
+            dx, grads[W], grads[b] = affine_relu_backward(dout, cache)
+        return dx, grads
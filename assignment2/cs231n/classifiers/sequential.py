@@ -0,0 +1,538 @@
+from builtins import range
+from builtins import object
+import numpy as np
+
+from cs231n.layers import *
+from cs231n.fast_layers import *
+
+
+"""
+This file implements a Sequential model that chains layers from layers.py and
+fast_layers.py and runs them out of a single preallocated memory arena.
+
+For a given batch size and mode the model infers every activation, gradient and
+scratch shape once, works out when each buffer is first written and last read,
+and packs all of them into one flat array so that buffers whose lifetimes do
+not overlap share memory. Elementwise layers (ReLU, batch normalization and
+dropout) run in place on their input when nothing else needs it, and the same
+holds for their gradients. The plan is reused on every call with the same
+batch size, so a training step does not allocate any activation or gradient
+buffers.
+
+Layers come in two kinds:
+- Planned layers (Affine, ReLU, BatchNorm, Dropout) write their outputs into
+  arena buffers using out= kernels.
+- Wrapped layers (Conv, MaxPool, SpatialBatchNorm) call the corresponding
+  functions from fast_layers.py and layers.py unchanged and keep the arrays
+  those functions return; the planner treats their outputs as external.
+"""
+
+
+class Affine(object):
+    """
+    Affine layer with weights 'W%d' and biases 'b%d'; see affine_forward.
+    """
+    planned = True
+    elementwise = False
+    saves_input = True
+    saves_output = False
+
+    def __init__(self, hidden_dim):
+        self.hidden_dim = hidden_dim
+
+    def build(self, in_shape, idx, weight_scale):
+        self.w_name, self.b_name = 'W%d' % idx, 'b%d' % idx
+        D = int(np.prod(in_shape))
+        params = {
+            self.w_name: np.random.normal(0, scale=weight_scale, size=(D, self.hidden_dim)),
+            self.b_name: np.zeros(self.hidden_dim),
+        }
+        return params, (self.hidden_dim,)
+
+    def scratch(self, N, mode):
+        return {}
+
+    def forward(self, x, out, params, scratch, mode):
+        np.dot(x.reshape(x.shape[0], -1), params[self.w_name], out=out)
+        out += params[self.b_name]
+
+    def backward(self, dout, dx, x, out, params, grads, scratch):
+        x_rows = x.reshape(x.shape[0], -1)
+        np.dot(x_rows.T, dout, out=grads[self.w_name])
+        np.sum(dout, axis=0, out=grads[self.b_name])
+        if dx is not None:
+            np.dot(dout, params[self.w_name].T, out=dx.reshape(dx.shape[0], -1))
+
+
+class ReLU(object):
+    """
+    ReLU nonlinearity; see relu_forward. The backward pass reads the sign of
+    the output, so the input does not have to be kept around.
+    """
+    planned = True
+    elementwise = True
+    saves_input = False
+    saves_output = True
+
+    def build(self, in_shape, idx, weight_scale):
+        return {}, in_shape
+
+    def scratch(self, N, mode):
+        return {}
+
+    def forward(self, x, out, params, scratch, mode):
+        np.maximum(x, 0, out=out)
+
+    def backward(self, dout, dx, x, out, params, grads, scratch):
+        np.multiply(dout, out > 0, out=dx)
+
+
+class BatchNorm(object):
+    """
+    Batch normalization with scale 'gamma%d' and shift 'beta%d', numbered after
+    the preceding Affine layer; see batchnorm_forward. The normalized input is
+    kept in a scratch buffer for the backward pass.
+    """
+    planned = True
+    elementwise = True
+    saves_input = False
+    saves_output = False
+
+    def __init__(self, eps=1e-5, momentum=0.9):
+        self.bn_param = {'mode': 'train', 'eps': eps, 'momentum': momentum}
+
+    def build(self, in_shape, idx, weight_scale):
+        self.gamma_name, self.beta_name = 'gamma%d' % idx, 'beta%d' % idx
+        D = in_shape[0]
+        params = {self.gamma_name: np.ones(D), self.beta_name: np.zeros(D)}
+        return params, in_shape
+
+    def scratch(self, N, mode):
+        if mode == 'test':
+            return {}
+        D = self.bn_param['running_mean'].shape[0]
+        return {'x_norm': (N, D), 'std': (D,)}
+
+    def forward(self, x, out, params, scratch, mode):
+        eps, momentum = self.bn_param['eps'], self.bn_param['momentum']
+        running_mean = self.bn_param['running_mean']
+        running_var = self.bn_param['running_var']
+        gamma, beta = params[self.gamma_name], params[self.beta_name]
+
+        if mode == 'train':
+            x_norm, std = scratch['x_norm'], scratch['std']
+            sample_mean = x.mean(axis=0)
+            sample_var = x.var(axis=0)
+            np.add(sample_var, eps, out=std)
+            np.sqrt(std, out=std)
+            np.subtract(x, sample_mean, out=x_norm)
+            x_norm /= std
+
+            running_mean *= momentum
+            running_mean += (1 - momentum) * sample_mean
+            running_var *= momentum
+            running_var += (1 - momentum) * sample_var
+
+            np.multiply(x_norm, gamma, out=out)
+        else:
+            np.subtract(x, running_mean, out=out)
+            out /= np.sqrt(running_var + eps)
+            out *= gamma
+        out += beta
+
+    def backward(self, dout, dx, x, out, params, grads, scratch):
+        # Same expression as batchnorm_backward_alt, evaluated in place. dx may
+        # share memory with dout, so both parameter gradients are taken first.
+        x_norm, std = scratch['x_norm'], scratch['std']
+        N = dout.shape[0]
+        dbeta = np.sum(dout, axis=0, out=grads[self.beta_name])
+        dgamma = np.einsum('ij,ij->j', dout, x_norm, out=grads[self.gamma_name])
+
+        gamma = params[self.gamma_name]
+        np.multiply(dout, N, out=dx)
+        dx -= dbeta
+        x_norm *= dgamma
+        dx -= x_norm
+        dx *= gamma / (N * std)
+
+
+class Dropout(object):
+    """
+    Dropout with the same semantics as dropout_forward; the mask is kept in a
+    scratch buffer.
+    """
+    planned = True
+    elementwise = True
+    saves_input = False
+    saves_output = False
+
+    def __init__(self, p, seed=None):
+        self.dropout_param = {'mode': 'train', 'p': p}
+        if seed is not None:
+            self.dropout_param['seed'] = seed
+
+    def build(self, in_shape, idx, weight_scale):
+        self.in_shape = in_shape
+        return {}, in_shape
+
+    def scratch(self, N, mode):
+        if mode == 'test':
+            return {}
+        return {'mask': (N,) + tuple(self.in_shape)}
+
+    def forward(self, x, out, params, scratch, mode):
+        if mode == 'test':
+            if out is not x:
+                out[...] = x
+            return
+        if 'seed' in self.dropout_param:
+            np.random.seed(self.dropout_param['seed'])
+        mask = scratch['mask']
+        np.greater(np.random.random(mask.shape), self.dropout_param['p'], out=mask)
+        np.multiply(x, mask, out=out)
+
+    def backward(self, dout, dx, x, out, params, grads, scratch):
+        np.multiply(dout, scratch['mask'], out=dx)
+
+
+class Conv(object):
+    """
+    Convolutional layer with weights 'W%d' and biases 'b%d', run through
+    conv_forward_fast. By default the padding preserves the spatial size.
+    """
+    planned = False
+    elementwise = False
+    saves_input = True
+    saves_output = False
+
+    def __init__(self, num_filters, filter_size, stride=1, pad=None):
+        self.num_filters, self.filter_size = num_filters, filter_size
+        if pad is None:
+            pad = (filter_size - 1) // 2
+        self.conv_param = {'stride': stride, 'pad': pad}
+
+    def build(self, in_shape, idx, weight_scale):
+        self.w_name, self.b_name = 'W%d' % idx, 'b%d' % idx
+        C, H, W = in_shape
+        stride, pad = self.conv_param['stride'], self.conv_param['pad']
+        F, HH = self.num_filters, self.filter_size
+        params = {
+            self.w_name: np.random.normal(0, scale=weight_scale, size=(F, C, HH, HH)),
+            self.b_name: np.zeros(F),
+        }
+        out_shape = (F, 1 + (H + 2 * pad - HH) // stride, 1 + (W + 2 * pad - HH) // stride)
+        return params, out_shape
+
+    def forward(self, x, params, mode):
+        out, self.cache = conv_forward_fast(x, params[self.w_name], params[self.b_name], self.conv_param)
+        return out
+
+    def backward(self, dout, params, grads):
+        dx, grads[self.w_name], grads[self.b_name] = conv_backward_fast(dout, self.cache)
+        self.cache = None
+        return dx
+
+
+class MaxPool(object):
+    """
+    Max pooling layer run through max_pool_forward_fast.
+    """
+    planned = False
+    elementwise = False
+    saves_input = True
+    saves_output = False
+
+    def __init__(self, pool_size=2, stride=2):
+        self.pool_param = {'pool_height': pool_size, 'pool_width': pool_size, 'stride': stride}
+
+    def build(self, in_shape, idx, weight_scale):
+        C, H, W = in_shape
+        ph, stride = self.pool_param['pool_height'], self.pool_param['stride']
+        return {}, (C, 1 + (H - ph) // stride, 1 + (W - ph) // stride)
+
+    def forward(self, x, params, mode):
+        out, self.cache = max_pool_forward_fast(x, self.pool_param)
+        return out
+
+    def backward(self, dout, params, grads):
+        dx = max_pool_backward_fast(dout, self.cache)
+        self.cache = None
+        return dx
+
+
+class SpatialBatchNorm(object):
+    """
+    Spatial batch normalization with scale 'gamma%d' and shift 'beta%d',
+    numbered after the preceding Conv layer; see spatial_batchnorm_forward.
+    """
+    planned = False
+    elementwise = False
+    saves_input = True
+    saves_output = False
+
+    def __init__(self, eps=1e-5, momentum=0.9):
+        self.bn_param = {'mode': 'train', 'eps': eps, 'momentum': momentum}
+
+    def build(self, in_shape, idx, weight_scale):
+        self.gamma_name, self.beta_name = 'gamma%d' % idx, 'beta%d' % idx
+        C = in_shape[0]
+        return {self.gamma_name: np.ones(C), self.beta_name: np.zeros(C)}, in_shape
+
+    def forward(self, x, params, mode):
+        self.bn_param['mode'] = mode
+        out, self.cache = spatial_batchnorm_forward(x, params[self.gamma_name],
+                                                    params[self.beta_name], self.bn_param)
+        return out
+
+    def backward(self, dout, params, grads):
+        dx, grads[self.gamma_name], grads[self.beta_name] = spatial_batchnorm_backward(dout, self.cache)
+        self.cache = None
+        return dx
+
+
+def plan_memory(tensors, alignment=16):
+    """
+    Pack buffers with known lifetimes into a single flat arena.
+
+    Buffers are placed largest first at the lowest offset that does not collide
+    with an already placed buffer whose lifetime overlaps; buffers that are
+    never live at the same time may share memory.
+
+    Inputs:
+    - tensors: List of (size, start, end) tuples giving the number of elements
+      of each buffer and the first and last timestep (inclusive) it is live.
+    - alignment: Offsets are rounded up to a multiple of this many elements.
+
+    Returns a tuple of:
+    - offsets: List of element offsets, parallel to tensors
+    - total: Number of elements needed for the arena
+    """
+    order = sorted(range(len(tensors)), key=lambda i: -tensors[i][0])
+    offsets = [None] * len(tensors)
+    placed = []
+    total = 0
+    for i in order:
+        size, start, end = tensors[i]
+        conflicts = sorted((offsets[j], offsets[j] + tensors[j][0]) for j in placed
+                           if tensors[j][1] <= end and start <= tensors[j][2])
+        offset = 0
+        for lo, hi in conflicts:
+            if offset + size <= lo:
+                break
+            if hi > offset:
+                offset = -(-hi // alignment) * alignment
+        offsets[i] = offset
+        placed.append(i)
+        total = max(total, offset + size)
+    return offsets, total
+
+
+class MemoryPlan(object):
+    """
+    Buffers for one batch size and mode of a Sequential model.
+
+    Timesteps are numbered so that the input is copied in at 0, layer i runs
+    forward at i + 1, the loss is evaluated at L + 1 and layer i runs backward
+    at 2L + 1 - i.
+
+    Attributes:
+    - acts: List of L + 1 activation buffers; acts[i] is the input of layer i
+      and acts[L] holds the scores. Entries are None for the outputs of wrapped
+      layers, which are filled in during the forward pass.
+    - grads: List parallel to acts holding gradient buffers (train mode only).
+    - scratch: List of per-layer dictionaries of scratch buffers.
+    - arena: The flat array that every planned buffer is a view into.
+    - naive_size: Number of elements the planned buffers would need without
+      any memory sharing.
+    """
+
+    def __init__(self, layers, in_shapes, N, mode, dtype):
+        L = len(layers)
+        training = mode == 'train'
+        t_fwd = lambda i: i + 1
+        t_bwd = lambda i: 2 * L + 1 - i
+
+        # Last timestep at which each activation is read.
+        last_use = []
+        for j in range(L + 1):
+            uses = [t_fwd(j) if j < L else L + 1]
+            if training and j < L and layers[j].saves_input:
+                uses.append(t_bwd(j))
+            if training and j > 0 and layers[j - 1].saves_output:
+                uses.append(t_bwd(j - 1))
+            last_use.append(max(uses))
+
+        # Each buffer is [shape, start, end]; several activations or gradients
+        # may map to the same buffer when an elementwise layer runs in place.
+        buffers = []
+        act_buf = [None] * (L + 1)
+        buffers.append([(N,) + in_shapes[0], 0, last_use[0]])
+        act_buf[0] = 0
+        for i, layer in enumerate(layers):
+            if not layer.planned:
+                continue
+            src = act_buf[i]
+            if layer.elementwise and src is not None and buffers[src][2] <= t_fwd(i):
+                buffers[src][2] = max(buffers[src][2], last_use[i + 1])
+                act_buf[i + 1] = src
+            else:
+                buffers.append([(N,) + in_shapes[i + 1], t_fwd(i), last_use[i + 1]])
+                act_buf[i + 1] = len(buffers) - 1
+
+        grad_buf = [None] * (L + 1)
+        if training:
+            buffers.append([(N,) + in_shapes[L], L + 1, t_bwd(L - 1)])
+            grad_buf[L] = len(buffers) - 1
+            for i in reversed(range(1, L)):
+                layer, src = layers[i], grad_buf[i + 1]
+                if not layer.planned:
+                    continue
+                if layer.elementwise and src is not None:
+                    buffers[src][2] = t_bwd(i - 1)
+                    grad_buf[i] = src
+                else:
+                    buffers.append([(N,) + in_shapes[i], t_bwd(i), t_bwd(i - 1)])
+                    grad_buf[i] = len(buffers) - 1
+
+        scratch_buf = []
+        for i, layer in enumerate(layers):
+            names = {}
+            if layer.planned:
+                end = t_bwd(i) if training else t_fwd(i)
+                for name, shape in layer.scratch(N, mode).items():
+                    buffers.append([tuple(shape), t_fwd(i), end])
+                    names[name] = len(buffers) - 1
+            scratch_buf.append(names)
+
+        sizes = [int(np.prod(shape)) for shape, _, _ in buffers]
+        offsets, total = plan_memory([(sizes[k], b[1], b[2]) for k, b in enumerate(buffers)])
+        self.arena = np.empty(total, dtype=dtype)
+        self.naive_size = sum(sizes)
+        views = [self.arena[o:o + s].reshape(b[0]) for o, s, b in zip(offsets, sizes, buffers)]
+
+        self.acts = [views[k] if k is not None else None for k in act_buf]
+        self.grads = [views[k] if k is not None else None for k in grad_buf]
+        self.scratch = [{name: views[k] for name, k in names.items()} for names in scratch_buf]
+
+
+class Sequential(object):
+    """
+    A model built from a list of layers, trained with a softmax loss. For
+    example, the ThreeLayerConvNet architecture can be written as
+
+    model = Sequential([Conv(32, 7), ReLU(), MaxPool(2),
+                        Affine(100), ReLU(), Affine(10)],
+                       input_dim=(3, 32, 32))
+
+    and the FullyConnectedNet with batch normalization as
+
+    model = Sequential([Affine(100), BatchNorm(), ReLU(),
+                        Affine(100), BatchNorm(), ReLU(), Affine(10)])
+
+    Weights and biases are numbered per Affine/Conv layer ('W1', 'b1', 'W2',
+    ...) and batch normalization parameters share the number of the layer they
+    follow, so the parameter names match FullyConnectedNet and
+    ThreeLayerConvNet. The model exposes the same params / loss(X, y) API and
+    can be trained by Solver unchanged.
+
+    All activations, gradients and scratch buffers live in a MemoryPlan that is
+    built the first time a given batch size is seen and reused afterwards; see
+    self.plans. Note that the grads dictionary returned by loss() is also
+    reused between calls, so its arrays are only valid until the next call.
+    """
+
+    def __init__(self, layers, input_dim=3*32*32, reg=0.0, weight_scale=1e-2,
+                 dtype=np.float32):
+        """
+        Initialize a new Sequential model.
+
+        Inputs:
+        - layers: List of layer objects defined in this file.
+        - input_dim: An integer or a tuple giving the shape of a single input.
+        - reg: Scalar giving L2 regularization strength.
+        - weight_scale: Scalar giving the standard deviation for random
+          initialization of the weights.
+        - dtype: A numpy datatype object; all computations will be performed
+          using this datatype.
+        """
+        self.layers = layers
+        self.reg = reg
+        self.dtype = dtype
+        self.params = {}
+        self.plans = {}
+
+        if not isinstance(input_dim, tuple):
+            input_dim = (input_dim,)
+        self.in_shapes = [input_dim]
+
+        idx = 0
+        for layer in layers:
+            if isinstance(layer, (Affine, Conv)):
+                idx += 1
+            params, out_shape = layer.build(self.in_shapes[-1], idx, weight_scale)
+            self.params.update(params)
+            self.in_shapes.append(tuple(out_shape))
+            if isinstance(layer, BatchNorm):
+                D = out_shape[0]
+                layer.bn_param['running_mean'] = np.zeros(D, dtype=dtype)
+                layer.bn_param['running_var'] = np.zeros(D, dtype=dtype)
+
+        self.weight_names = [k for k in self.params if k.startswith('W')]
+
+        # Cast all parameters to the correct datatype
+        for k, v in self.params.items():
+            self.params[k] = v.astype(dtype)
+
+        # Gradients for planned layers are written into these arrays in place.
+        self.grads = {k: np.zeros_like(v) for k, v in self.params.items()}
+
+
+    def _get_plan(self, N, mode):
+        key = (N, mode)
+        if key not in self.plans:
+            self.plans[key] = MemoryPlan(self.layers, self.in_shapes, N, mode, self.dtype)
+        return self.plans[key]
+
+
+    def loss(self, X, y=None):
+        """
+        Compute loss and gradient for a minibatch of data.
+
+        Input / output: Same as TwoLayerNet in fc_net.py.
+        """
+        mode = 'test' if y is None else 'train'
+        N = X.shape[0]
+        plan = self._get_plan(N, mode)
+        acts, layers = list(plan.acts), self.layers
+
+        np.copyto(acts[0], X.reshape(acts[0].shape), casting='unsafe')
+        for i, layer in enumerate(layers):
+            if layer.planned:
+                layer.forward(acts[i], acts[i + 1], self.params, plan.scratch[i], mode)
+            else:
+                acts[i + 1] = layer.forward(acts[i], self.params, mode)
+        scores = acts[-1]
+
+        if mode == 'test':
+            return scores.copy()
+
+        grads = self.grads
+        douts = list(plan.grads)
+        loss, _ = softmax_loss_fast(scores, y, dx=douts[-1])
+
+        for i in reversed(range(len(layers))):
+            layer = layers[i]
+            if layer.planned:
+                dx = douts[i] if i > 0 else None
+                layer.backward(douts[i + 1], dx, acts[i], acts[i + 1],
+                               self.params, grads, plan.scratch[i])
+            else:
+                douts[i] = layer.backward(douts[i + 1], self.params, grads)
+
+        for k in self.weight_names:
+            w = self.params[k]
+            loss += 0.5 * self.reg * np.vdot(w, w)
+            if self.reg != 0:
+                grads[k] += self.reg * w
+
+        return loss, grads
@@ -0,0 +1,204 @@
+from __future__ import division
+from builtins import range
+from builtins import object
+import numpy as np
+
+from cs231n.bn_utils import batchnorm_params, running_stats
+from cs231n.flat_params import FlatParams
+from cs231n.hyperparameter_search import share_arrays, attach_arrays
+from cs231n.threading_policy import (apply_policy, start_worker, worker_context,
+                                     worker_policies)
+
+
+"""
+This file implements data-parallel computation of the loss and gradients of a
+model across several worker processes on one machine.
+
+A DataParallel copies the training data, the model parameters and one row of
+gradients per worker into shared memory (see share_arrays in
+hyperparameter_search.py), and starts worker processes holding a copy of the
+model whose params are views into the shared parameters. For every minibatch,
+the training process writes the current parameters into shared memory once
+and splits the minibatch indices into one shard per worker. Each worker
+gathers its rows of the shared data, runs model.loss on them and writes its
+gradients into its row of the shared gradient buffer. The training process
+then reduces the rows, weighted by the shard sizes, into the gradients of the
+whole minibatch with one matrix-vector product, and the update rule is applied
+once, as usual:
+
+    parallel = DataParallel(model, X_train, y_train, num_workers=4)
+    loss, grads = parallel.loss(idx)
+    ...
+    parallel.close()
+
+Batch normalization normalizes each shard with its own statistics, as if the
+shards were micro-batches (see accumulate_steps in solver.py). The running
+averages stay consistent across workers: every worker starts the step from the
+running averages of the training process, and these are then replaced by the
+weighted mean of the workers' updated averages, which is a single momentum
+update with the mean of the shard statistics.
+
+Passing data_parallel=N to a Solver trains with N worker processes. Each
+worker seeds its own random state for dropout, and applies a threading policy
+(see threading_policy.py) when it starts.
+"""
+
+
+def _worker(conn, model, flat, handles, rank, seed, policy):
+    """
+    Loop of a worker process: apply the threading policy, then compute the
+    loss and gradients of each shard of
+    indices that arrives on conn, and send back the loss and the updated
+    batch normalization running averages. None ends the loop.
+    """
+    apply_policy(policy)
+    arrays, blocks = attach_arrays(handles)
+    X, y = arrays['X'], arrays['y']
+    model.params = flat.unflatten(arrays['params'])
+    grad_views = flat.unflatten(arrays['grads'][rank])
+    bn_params = batchnorm_params(model)
+    dtype = getattr(model, 'dtype', X.dtype)
+    np.random.seed(seed)
+
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        idx, stats = task
+        try:
+            for bn_param, s in zip(bn_params, stats):
+                bn_param.update(s)
+            loss, grads = model.loss(X[idx].astype(dtype, copy=False), y[idx])
+            for k, view in grad_views.items():
+                view[...] = grads[k]
+            conn.send((loss, running_stats(bn_params)))
+        except Exception as e:
+            conn.send(e)
+
+    del X, y, model.params, grad_views, arrays
+    for block in blocks:
+        block.close()
+
+
+class DataParallel(object):
+    """
+    Computes the loss and gradients of minibatches of the training data in
+    worker processes that share the data and the parameters.
+    """
+
+    def __init__(self, model, X_train, y_train, num_workers, seed=None, policies=None):
+        """
+        Inputs:
+        - model: The model; its params may be replaced by new arrays between
+          calls of loss, as update rules do.
+        - X_train, y_train: The training data; it is copied into shared memory
+          once.
+        - num_workers: Number of worker processes.
+        - seed: Seed of the workers' random states, which are seeded with
+          seed + rank; if None it is drawn from the global numpy random state.
+        - policies: Optional list of the threading policies of the workers;
+          by default worker_policies(num_workers).
+        """
+        self.model = model
+        self.num_workers = num_workers
+        self.flat = FlatParams(model.params)
+        if seed is None:
+            seed = np.random.randint(2 ** 31 - num_workers)
+        if policies is None:
+            policies = worker_policies(num_workers)
+
+        grad_rows = np.zeros((num_workers, self.flat.size), dtype=self.flat.params.dtype)
+        handles, self.blocks = share_arrays({'X': X_train, 'y': y_train,
+                                             'params': self.flat.params,
+                                             'grads': grad_rows})
+        shared = {}
+        for (name, (_, shape, dtype)), block in zip(handles.items(), self.blocks):
+            shared[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        self.shared_params = shared['params']
+        self.shared_grads = shared['grads']
+        self.param_views = self.flat.unflatten(self.shared_params)
+        self.grad_views = self.flat.grad_views
+        self.weights = np.zeros(num_workers, dtype=self.flat.params.dtype)
+
+        ctx = worker_context()
+        self.connections = []
+        self.processes = []
+        for rank in range(num_workers):
+            parent, child = ctx.Pipe()
+            process = ctx.Process(
+                target=_worker,
+                args=(child, model, self.flat, handles, rank, seed + rank, policies[rank]))
+            process.daemon = True
+            start_worker(process, policies[rank])
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+
+    def loss(self, idx):
+        """
+        Compute the loss and gradients of the model on a minibatch of the
+        training data, and update its batch normalization running averages.
+
+        Inputs:
+        - idx: Integer array of the indices of the minibatch in X_train
+
+        Returns a tuple of:
+        - loss: Scalar giving the loss of the minibatch
+        - grads: Dictionary mapping parameter names to gradients. The arrays
+          are overwritten by the next call.
+        """
+        for k, view in self.param_views.items():
+            view[...] = self.model.params[k]
+        bn_params = batchnorm_params(self.model)
+        stats = running_stats(bn_params)
+
+        shards = np.array_split(idx, self.num_workers)
+        for conn, shard in zip(self.connections, shards):
+            if len(shard) > 0:
+                conn.send((shard, stats))
+
+        # Shard losses and gradients are means over their shards, so they are
+        # weighted by the fraction of the minibatch in each shard
+        results, errors = [], []
+        self.weights[...] = 0
+        for rank, (conn, shard) in enumerate(zip(self.connections, shards)):
+            if len(shard) == 0:
+                continue
+            result = conn.recv()
+            if isinstance(result, Exception):
+                errors.append(result)
+                continue
+            self.weights[rank] = len(shard) / len(idx)
+            results.append((len(shard) / len(idx),) + result)
+        if errors:
+            raise errors[0]
+        np.dot(self.weights, self.shared_grads, out=self.flat.grads)
+        loss = sum(w * shard_loss for w, shard_loss, _ in results)
+
+        for i, bn_param in enumerate(bn_params):
+            for name, value in results[0][2][i].items():
+                running = sum(w * shard_stats[i][name] for w, _, shard_stats in results)
+                bn_param[name] = running.astype(value.dtype)
+        return loss, self.grad_views
+
+
+    def close(self):
+        """
+        Stop the worker processes and release the shared memory.
+        """
+        for conn in self.connections:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join()
+        for conn in self.connections:
+            conn.close()
+        self.connections, self.processes = [], []
+        self.shared_params = self.shared_grads = self.param_views = None
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
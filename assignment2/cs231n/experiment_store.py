@@ -0,0 +1,269 @@
+from builtins import object
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from cs231n.bn_utils import batchnorm_params
+from cs231n.checkpoint import checkpoint_arrays, load_checkpoint, _write_atomic
+from cs231n.solver import Solver
+
+
+"""
+This file implements a local store of finished trainings, so that rerunning
+a Solver with a configuration that was already trained returns the stored
+result instead of training again.
+
+An experiment is identified by a hash of the model class, its constructor
+arguments, the Solver arguments, a fingerprint of the data and the random
+seed. The store is a directory with an SQLite index, which records the
+histories and bookkeeping of every experiment, and one .npz file per
+experiment with the final parameters and batch normalization running
+averages (in the format of checkpoint.py). When the payloads grow beyond
+max_bytes, the least recently used experiments are evicted:
+
+    store = ExperimentStore('experiments')
+    model, results = train_cached(store, FullyConnectedNet,
+                                  {'hidden_dims': [100, 100], 'reg': 1e-3},
+                                  data, {'update_rule': 'adam', 'num_epochs': 5},
+                                  seed=0)
+    results['val_acc_history'], results['cached']
+"""
+
+
+_HISTORIES = ('loss_history', 'train_acc_history', 'val_acc_history', 'acc_iterations')
+
+# Solver arguments that do not change the result of training
+_IGNORED_SOLVER_KWARGS = ('verbose', 'print_every', 'checkpoint_name',
+                          'compact_checkpoints', 'checkpoint_keep')
+
+
+def _canonical(obj):
+    """
+    Convert an object into a JSON-serializable form that is equal for equal
+    configurations. Arrays are replaced by a hash of their contents, and
+    classes and functions by their qualified names.
+    """
+    if isinstance(obj, dict):
+        return [[str(k), _canonical(v)] for k, v in sorted(obj.items(), key=lambda kv: str(kv[0]))]
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(v) for v in obj]
+    if isinstance(obj, np.ndarray):
+        return ['ndarray', array_fingerprint(obj)]
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (type, np.dtype)) or callable(obj):
+        if isinstance(obj, np.dtype) or obj in np.sctypeDict.values():
+            return np.dtype(obj).str
+        return '%s.%s' % (getattr(obj, '__module__', ''), getattr(obj, '__qualname__', repr(obj)))
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    return repr(obj)
+
+
+def array_fingerprint(a):
+    """
+    Hash the datatype, shape and contents of an array.
+    """
+    a = np.ascontiguousarray(a)
+    h = hashlib.sha1()
+    h.update(('%s%s' % (a.dtype.str, a.shape)).encode())
+    h.update(a.view(np.uint8).reshape(-1) if a.size else b'')
+    return h.hexdigest()
+
+
+def data_fingerprint(data):
+    """
+    Hash a dictionary of data arrays such as the one passed to Solver.
+    """
+    return hashlib.sha1(json.dumps(_canonical(data)).encode()).hexdigest()
+
+
+def experiment_key(model_class, model_kwargs, solver_kwargs, data, seed):
+    """
+    Compute the key identifying an experiment.
+
+    Inputs:
+    - model_class: The model class
+    - model_kwargs: Dictionary of keyword arguments for the model constructor
+    - solver_kwargs: Dictionary of keyword arguments for the Solver; the ones
+      that only affect output, such as verbose, are ignored
+    - data: Dictionary of data arrays, or its data_fingerprint
+    - seed: The random seed the experiment runs with
+
+    Returns:
+    - key: Hexadecimal string
+    """
+    if isinstance(data, dict):
+        data = data_fingerprint(data)
+    solver_kwargs = {k: v for k, v in solver_kwargs.items()
+                     if k not in _IGNORED_SOLVER_KWARGS}
+    description = [_canonical(model_class), _canonical(model_kwargs),
+                   _canonical(solver_kwargs), data, seed]
+    return hashlib.sha1(json.dumps(description).encode()).hexdigest()
+
+
+class ExperimentStore(object):
+    """
+    A directory of finished experiments with an SQLite index and least
+    recently used eviction.
+    """
+
+    def __init__(self, root, max_bytes=1 << 30):
+        """
+        Inputs:
+        - root: Directory of the store; it is created if needed.
+        - max_bytes: Maximum total size of the stored parameter files. None
+          disables eviction.
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        self.db = sqlite3.connect(os.path.join(root, 'index.sqlite'))
+        self.db.execute('CREATE TABLE IF NOT EXISTS experiments ('
+                        'key TEXT PRIMARY KEY, filename TEXT, size INTEGER, '
+                        'created REAL, last_used REAL, results TEXT)')
+        self.db.commit()
+
+
+    def get(self, key):
+        """
+        Look up an experiment and mark it as recently used.
+
+        Returns:
+        - None if the experiment is not stored, otherwise a tuple of:
+          - params: Dictionary of the final parameters
+          - bn_stats: List of batch normalization running averages
+          - results: Dictionary of the histories and other results
+        """
+        row = self.db.execute('SELECT filename, results FROM experiments WHERE key = ?',
+                              (key,)).fetchone()
+        if row is None:
+            return None
+        filename = os.path.join(self.root, row[0])
+        if not os.path.exists(filename):
+            self.delete(key)
+            return None
+        self.db.execute('UPDATE experiments SET last_used = ? WHERE key = ?', (time.time(), key))
+        self.db.commit()
+        params, _, bn_stats, _ = load_checkpoint(filename)
+        return params, bn_stats, json.loads(row[1])
+
+
+    def put(self, key, params, bn_params=None, results=None):
+        """
+        Store an experiment, replacing any experiment with the same key, and
+        evict old experiments if the store is too large.
+
+        Inputs:
+        - key: Key from experiment_key
+        - params: Dictionary of parameters
+        - bn_params: Optional list of bn_param dictionaries
+        - results: Dictionary of JSON-serializable results such as histories
+        """
+        filename = '%s.npz' % key
+        path = os.path.join(self.root, filename)
+        _write_atomic(path, checkpoint_arrays(params, bn_params=bn_params))
+        now = time.time()
+        self.db.execute('INSERT OR REPLACE INTO experiments VALUES (?, ?, ?, ?, ?, ?)',
+                        (key, filename, os.path.getsize(path), now, now,
+                         json.dumps(results or {})))
+        self.db.commit()
+        self.evict(keep=key)
+
+
+    def delete(self, key):
+        """
+        Remove an experiment from the store.
+        """
+        row = self.db.execute('SELECT filename FROM experiments WHERE key = ?',
+                              (key,)).fetchone()
+        if row is not None:
+            path = os.path.join(self.root, row[0])
+            if os.path.exists(path):
+                os.remove(path)
+        self.db.execute('DELETE FROM experiments WHERE key = ?', (key,))
+        self.db.commit()
+
+
+    def total_bytes(self):
+        """
+        Return the total size of the stored parameter files.
+        """
+        return self.db.execute('SELECT COALESCE(SUM(size), 0) FROM experiments').fetchone()[0]
+
+
+    def evict(self, keep=None):
+        """
+        Delete least recently used experiments until the store fits in
+        max_bytes. The experiment keep is never evicted.
+        """
+        if self.max_bytes is None:
+            return
+        total = self.total_bytes()
+        rows = self.db.execute('SELECT key, size FROM experiments ORDER BY last_used').fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self.delete(key)
+            total -= size
+
+
+    def close(self):
+        """
+        Close the index database.
+        """
+        self.db.close()
+
+
+def train_cached(store, model_class, model_kwargs, data, solver_kwargs=None, seed=None):
+    """
+    Build a model and train it with a Solver, or return the stored result of
+    an identical earlier run.
+
+    Inputs:
+    - store: An ExperimentStore
+    - model_class: The model class, such as FullyConnectedNet
+    - model_kwargs: Dictionary of keyword arguments for the model constructor
+    - data: Dictionary of data for the Solver
+    - solver_kwargs: Dictionary of keyword arguments for the Solver
+    - seed: If not None, np.random.seed(seed) is called before the model is
+      built, so the run is reproducible
+
+    Returns a tuple of:
+    - model: The trained model, with the parameters train() left in it
+    - results: Dictionary with the loss_history, train_acc_history,
+      val_acc_history and acc_iterations of the run, its best_val_acc, and
+      'cached', which is True if the result came from the store.
+    """
+    model_kwargs = model_kwargs or {}
+    solver_kwargs = solver_kwargs or {}
+    key = experiment_key(model_class, model_kwargs, solver_kwargs, data, seed)
+
+    if seed is not None:
+        np.random.seed(seed)
+    model = model_class(**model_kwargs)
+
+    stored = store.get(key)
+    if stored is not None:
+        params, bn_stats, results = stored
+        for k, v in params.items():
+            model.params[k] = v.astype(model.params[k].dtype, copy=False)
+        for bn_param, stats in zip(batchnorm_params(model), bn_stats):
+            bn_param.update(stats)
+        results['cached'] = True
+        return model, results
+
+    solver = Solver(model, data, **solver_kwargs)
+    solver.train()
+    results = {name: [float(v) for v in getattr(solver, name)] for name in _HISTORIES}
+    results['best_val_acc'] = float(solver.best_val_acc)
+    store.put(key, model.params, batchnorm_params(model), results)
+    results['cached'] = False
+    return model, results
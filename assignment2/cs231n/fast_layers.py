@@ -1,5 +1,6 @@
 from __future__ import print_function
 import numpy as np
+import scipy.sparse
 try:
     from cs231n.im2col_cython import col2im_cython, im2col_cython
     from cs231n.im2col_cython import col2im_6d_cython
@@ -9,6 +10,55 @@ except ImportError:
     print('You may also need to restart your iPython kernel')
 
 from cs231n.im2col import *
+from cs231n.intra_op import batch_chunks, parallel_for
+from cs231n.layers import mixed_dot
+
+
+def _cython_dtype(dtype):
+    """
+    The Cython im2col and col2im kernels only support float32 and float64, so
+    float16 arrays go through them in float32.
+    """
+    return np.promote_types(dtype, np.float32)
+
+
+def _im2col_batched(x, field_height, field_width, padding, stride):
+    """
+    im2col_cython over chunks of the batch in the intra-op threads. The
+    columns of an example are interleaved with those of the others (the batch
+    index varies fastest), so each chunk's columns are scattered into place.
+    """
+    N = x.shape[0]
+    if len(batch_chunks(N)) == 1:
+        return im2col_cython(x, field_height, field_width, padding, stride)
+    rows = x.shape[1] * field_height * field_width
+    out_h = (x.shape[2] + 2 * padding - field_height) // stride + 1
+    out_w = (x.shape[3] + 2 * padding - field_width) // stride + 1
+    cols = np.empty((rows, out_h * out_w * N), dtype=x.dtype)
+    cols_3d = cols.reshape(rows, out_h * out_w, N)
+
+    def chunk(s, e):
+        chunk_cols = im2col_cython(x[s:e], field_height, field_width, padding, stride)
+        cols_3d[:, :, s:e] = chunk_cols.reshape(rows, out_h * out_w, e - s)
+    parallel_for(N, chunk)
+    return cols
+
+
+def _col2im_batched(cols, N, C, H, W, field_height, field_width, padding, stride):
+    """
+    col2im_cython over chunks of the batch in the intra-op threads.
+    """
+    if len(batch_chunks(N)) == 1:
+        return col2im_cython(cols, N, C, H, W, field_height, field_width, padding, stride)
+    cols_3d = cols.reshape(cols.shape[0], -1, N)
+    x = np.empty((N, C, H, W), dtype=cols.dtype)
+
+    def chunk(s, e):
+        chunk_cols = np.ascontiguousarray(cols_3d[:, :, s:e]).reshape(cols.shape[0], -1)
+        x[s:e] = col2im_cython(chunk_cols, e - s, C, H, W, field_height, field_width,
+                               padding, stride)
+    parallel_for(N, chunk)
+    return x
 
 
 def conv_forward_im2col(x, w, b, conv_param):
@@ -30,8 +80,10 @@ def conv_forward_im2col(x, w, b, conv_param):
     out = np.zeros((N, num_filters, out_height, out_width), dtype=x.dtype)
 
     # x_cols = im2col_indices(x, w.shape[2], w.shape[3], pad, stride)
-    x_cols = im2col_cython(x, w.shape[2], w.shape[3], pad, stride)
-    res = w.reshape((w.shape[0], -1)).dot(x_cols) + b.reshape(-1, 1)
+    x_cols = _im2col_batched(x.astype(_cython_dtype(x.dtype), copy=False),
+                             w.shape[2], w.shape[3], pad, stride)
+    x_cols = x_cols.astype(x.dtype, copy=False)
+    res = mixed_dot(w.reshape((w.shape[0], -1)), x_cols) + b.reshape(-1, 1)
 
     out = res.reshape(w.shape[0], out.shape[2], out.shape[3], x.shape[0])
     out = out.transpose(3, 0, 1, 2)
@@ -49,27 +101,29 @@ def conv_forward_strides(x, w, b, conv_param):
     #assert (W + 2 * pad - WW) % stride == 0, 'width does not work'
     #assert (H + 2 * pad - HH) % stride == 0, 'height does not work'
 
-    # Pad the input
-    p = pad
-    x_padded = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
-
     # Figure out output dimensions
+    p = pad
     H += 2 * pad
     W += 2 * pad
     out_h = (H - HH) // stride + 1
     out_w = (W - WW) // stride + 1
 
-    # Perform an im2col operation by picking clever strides
-    shape = (C, HH, WW, N, out_h, out_w)
+    # Pad the input and perform an im2col operation by picking clever
+    # strides, on chunks of the batch in the intra-op threads
+    x_cols = np.empty((C, HH, WW, N, out_h, out_w), dtype=x.dtype)
     strides = (H * W, W, 1, C * H * W, stride * W, stride)
     strides = x.itemsize * np.array(strides)
-    x_stride = np.lib.stride_tricks.as_strided(x_padded,
-                  shape=shape, strides=strides)
-    x_cols = np.ascontiguousarray(x_stride)
+
+    def chunk(s, e):
+        x_padded = np.pad(x[s:e], ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
+        x_stride = np.lib.stride_tricks.as_strided(x_padded,
+                      shape=(C, HH, WW, e - s, out_h, out_w), strides=strides)
+        x_cols[:, :, :, s:e] = x_stride
+    parallel_for(N, chunk)
     x_cols.shape = (C * HH * WW, N * out_h * out_w)
 
     # Now all our convolutions are a big matrix multiply
-    res = w.reshape(F, -1).dot(x_cols) + b.reshape(-1, 1)
+    res = mixed_dot(w.reshape(F, -1), x_cols) + b.reshape(-1, 1)
 
     # Reshape the output
     res.shape = (F, N, out_h, out_w)
@@ -95,11 +149,21 @@ def conv_backward_strides(dout, cache):
     db = np.sum(dout, axis=(0, 2, 3))
 
     dout_reshaped = dout.transpose(1, 0, 2, 3).reshape(F, -1)
-    dw = dout_reshaped.dot(x_cols.T).reshape(w.shape)
+    dw = mixed_dot(dout_reshaped, x_cols.T).reshape(w.shape)
 
-    dx_cols = w.reshape(F, -1).T.dot(dout_reshaped)
+    dx_cols = mixed_dot(w.reshape(F, -1).T, dout_reshaped)
     dx_cols.shape = (C, HH, WW, N, out_h, out_w)
-    dx = col2im_6d_cython(dx_cols, N, C, H, W, HH, WW, pad, stride)
+    dx_cols = dx_cols.astype(_cython_dtype(x.dtype), copy=False)
+    if len(batch_chunks(N)) == 1:
+        dx = col2im_6d_cython(dx_cols, N, C, H, W, HH, WW, pad, stride)
+    else:
+        dx = np.empty((N, C, H, W), dtype=dx_cols.dtype)
+
+        def chunk(s, e):
+            chunk_cols = np.ascontiguousarray(dx_cols[:, :, :, s:e])
+            dx[s:e] = col2im_6d_cython(chunk_cols, e - s, C, H, W, HH, WW, pad, stride)
+        parallel_for(N, chunk)
+    dx = dx.astype(x.dtype, copy=False)
 
     return dx, dw, db
 
@@ -116,12 +180,14 @@ def conv_backward_im2col(dout, cache):
 
     num_filters, _, filter_height, filter_width = w.shape
     dout_reshaped = dout.transpose(1, 2, 3, 0).reshape(num_filters, -1)
-    dw = dout_reshaped.dot(x_cols.T).reshape(w.shape)
+    dw = mixed_dot(dout_reshaped, x_cols.T).reshape(w.shape)
 
-    dx_cols = w.reshape(num_filters, -1).T.dot(dout_reshaped)
+    dx_cols = mixed_dot(w.reshape(num_filters, -1).T, dout_reshaped)
+    dx_cols = dx_cols.astype(_cython_dtype(x.dtype), copy=False)
     # dx = col2im_indices(dx_cols, x.shape, filter_height, filter_width, pad, stride)
-    dx = col2im_cython(dx_cols, x.shape[0], x.shape[1], x.shape[2], x.shape[3],
-                       filter_height, filter_width, pad, stride)
+    dx = _col2im_batched(dx_cols, x.shape[0], x.shape[1], x.shape[2], x.shape[3],
+                         filter_height, filter_width, pad, stride)
+    dx = dx.astype(x.dtype, copy=False)
 
     return dx, dw, db
 
@@ -130,6 +196,80 @@ conv_forward_fast = conv_forward_strides
 conv_backward_fast = conv_backward_strides
 
 
+def affine_forward_sparse(x, w, b, sparse_param):
+    """
+    A sparsity-aware implementation of the forward pass for an affine layer.
+
+    Inputs that come out of a ReLU or dropout layer are mostly zeros. When the
+    measured fraction of nonzero entries in x falls below the threshold, x is
+    compressed to CSR and the product is computed as a sparse-dense multiply;
+    otherwise this behaves exactly like affine_forward.
+
+    Inputs:
+    - x, w, b: Same as affine_forward
+    - sparse_param: Dictionary with the following keys:
+      - threshold: Density below which the sparse path is used. Default 0.3.
+      The measured density of x is stored back into sparse_param['density'].
+
+    Returns a tuple of:
+    - out: output, of shape (N, M)
+    - cache: (x_shape, x_rows, w, b, sparse_param) where x_rows is either a
+      dense (N, D) array or a scipy.sparse CSR matrix
+    """
+    threshold = sparse_param.get('threshold', 0.3)
+
+    x_rows = x.reshape(x.shape[0], -1)
+    density = np.count_nonzero(x_rows) / float(x_rows.size)
+    sparse_param['density'] = density
+
+    if density < threshold:
+        x_rows = scipy.sparse.csr_matrix(x_rows)
+    out = x_rows.dot(w)
+    out += b
+
+    cache = (x.shape, x_rows, w, b, sparse_param)
+    return out, cache
+
+
+def affine_backward_sparse(dout, cache):
+    """
+    Backward pass for affine_forward_sparse.
+
+    The input kept in the cache is reused in whichever format the forward pass
+    chose. The upstream gradient is also compressed when it is sparse enough,
+    which is common behind relu_backward and dropout_backward.
+
+    Inputs:
+    - dout: Upstream derivative, of shape (N, M)
+    - cache: Tuple from affine_forward_sparse
+
+    Returns a tuple of:
+    - dx: Gradient with respect to x, of shape (N, d1, ..., d_k)
+    - dw: Gradient with respect to w, of shape (D, M)
+    - db: Gradient with respect to b, of shape (M,)
+    """
+    x_shape, x_rows, w, b, sparse_param = cache
+    threshold = sparse_param.get('threshold', 0.3)
+
+    db = np.sum(dout, axis=0)
+
+    dout_density = np.count_nonzero(dout) / float(dout.size)
+    if dout_density < threshold:
+        dout = scipy.sparse.csr_matrix(dout)
+    dx = dout.dot(w.T).reshape(x_shape)
+
+    if scipy.sparse.issparse(x_rows):
+        dw = x_rows.T.dot(dout)
+    elif scipy.sparse.issparse(dout):
+        dw = dout.T.dot(x_rows).T
+    else:
+        dw = x_rows.T.dot(dout)
+    if scipy.sparse.issparse(dw):
+        dw = dw.toarray()
+
+    return dx, dw, db
+
+
 def max_pool_forward_fast(x, pool_param):
     """
     A fast implementation of the forward pass for a max pooling layer.
@@ -185,7 +325,11 @@ def max_pool_forward_reshape(x, pool_param):
     assert W % pool_height == 0
     x_reshaped = x.reshape(N, C, H // pool_height, pool_height,
                            W // pool_width, pool_width)
-    out = x_reshaped.max(axis=3).max(axis=4)
+    out = np.empty((N, C, H // pool_height, W // pool_width), dtype=x.dtype)
+
+    def chunk(s, e):
+        out[s:e] = x_reshaped[s:e].max(axis=3).max(axis=4)
+    parallel_for(N, chunk)
 
     cache = (x, x_reshaped, out)
     return out, cache
@@ -210,13 +354,18 @@ def max_pool_backward_reshape(dout, cache):
     """
     x, x_reshaped, out = cache
 
-    dx_reshaped = np.zeros_like(x_reshaped)
-    out_newaxis = out[:, :, :, np.newaxis, :, np.newaxis]
-    mask = (x_reshaped == out_newaxis)
-    dout_newaxis = dout[:, :, :, np.newaxis, :, np.newaxis]
-    dout_broadcast, _ = np.broadcast_arrays(dout_newaxis, dx_reshaped)
-    dx_reshaped[mask] = dout_broadcast[mask]
-    dx_reshaped /= np.sum(mask, axis=(3, 5), keepdims=True)
+    dx_reshaped = np.empty_like(x_reshaped)
+
+    def chunk(s, e):
+        dx_chunk = dx_reshaped[s:e]
+        dx_chunk[...] = 0
+        out_newaxis = out[s:e, :, :, np.newaxis, :, np.newaxis]
+        mask = (x_reshaped[s:e] == out_newaxis)
+        dout_newaxis = dout[s:e, :, :, np.newaxis, :, np.newaxis]
+        dout_broadcast, _ = np.broadcast_arrays(dout_newaxis, dx_chunk)
+        dx_chunk[mask] = dout_broadcast[mask]
+        dx_chunk /= np.sum(mask, axis=(3, 5), keepdims=True)
+    parallel_for(x.shape[0], chunk)
     dx = dx_reshaped.reshape(x.shape)
 
     return dx
@@ -240,7 +389,7 @@ def max_pool_forward_im2col(x, pool_param):
     out_width = (W - pool_width) // stride + 1
 
     x_split = x.reshape(N * C, 1, H, W)
-    x_cols = im2col(x_split, pool_height, pool_width, padding=0, stride=stride)
+    x_cols = im2col_indices(x_split, pool_height, pool_width, padding=0, stride=stride)
     x_cols_argmax = np.argmax(x_cols, axis=0)
     x_cols_max = x_cols[x_cols_argmax, np.arange(x_cols.shape[1])]
     out = x_cols_max.reshape(out_height, out_width, N, C).transpose(2, 3, 0, 1)
@@ -269,3 +418,118 @@ def max_pool_backward_im2col(dout, cache):
     dx = dx.reshape(x.shape)
 
     return dx
+
+
+def softmax_loss_fast(x, y, dx=None):
+    """
+    A fused implementation of softmax_loss that computes the loss and the
+    gradient in a single sweep over the scores.
+
+    The exponentiated scores are written straight into the gradient buffer and
+    normalized in place, so apart from dx the only temporaries are a handful of
+    vectors of shape (N,). All arithmetic stays in the dtype of x.
+
+    Inputs:
+    - x: Input data, of shape (N, C) where x[i, j] is the score for the jth
+      class for the ith input.
+    - y: Vector of labels, of shape (N,) where y[i] is the label for x[i] and
+      0 <= y[i] < C
+    - dx: Optional array of shape (N, C) and the same dtype as x that the
+      gradient is written into. It may be x itself if the scores are no longer
+      needed.
+
+    Returns a tuple of:
+    - loss: Scalar giving the loss
+    - dx: Gradient of the loss with respect to x
+    """
+    N = x.shape[0]
+    rows = np.arange(N)
+    if dx is None:
+        dx = np.empty_like(x)
+
+    np.subtract(x, x.max(axis=1, keepdims=True), out=dx)
+    correct_class_scores = dx[rows, y]
+    np.exp(dx, out=dx)
+    Z = dx.sum(axis=1, keepdims=True)
+    loss = (np.log(Z).sum() - correct_class_scores.sum()) / N
+
+    Z *= N
+    dx /= Z
+    dx[rows, y] -= x.dtype.type(1.0 / N)
+    return float(loss), dx
+
+
+def svm_loss_fast(x, y, dx=None):
+    """
+    A fused implementation of svm_loss that reuses a single buffer for the
+    margins, the positive-margin mask and the gradient.
+
+    Inputs / outputs: Same as softmax_loss_fast.
+    """
+    N = x.shape[0]
+    rows = np.arange(N)
+    if dx is None:
+        dx = np.empty_like(x)
+
+    correct_class_scores = x[rows, y]
+    np.subtract(x, correct_class_scores[:, np.newaxis], out=dx)
+    dx += 1
+    np.maximum(dx, 0, out=dx)
+    dx[rows, y] = 0
+    loss = dx.sum() / N
+
+    # Margins are non-negative, so their sign is exactly the 0/1 mask of the
+    # classes that contribute to the loss.
+    np.sign(dx, out=dx)
+    dx[rows, y] = -dx.sum(axis=1)
+    dx /= N
+    return float(loss), dx
+
+
+def softmax_loss_chunked(x, y, chunk_size=256, dx=None):
+    """
+    Softmax loss for heads with many classes, processed chunk_size classes at a
+    time so that the working set of each pass stays small.
+
+    The first pass exponentiates each block of scores against its own running
+    maximum and stores the result in dx; the second pass rescales every block
+    to the global maximum and normalizes it, so no exponential is computed
+    twice.
+
+    Inputs:
+    - x, y, dx: Same as softmax_loss_fast
+    - chunk_size: Number of classes to process at a time.
+
+    Returns a tuple of:
+    - loss: Scalar giving the loss
+    - dx: Gradient of the loss with respect to x
+    """
+    N, C = x.shape
+    rows = np.arange(N)
+    if dx is None:
+        dx = np.empty_like(x)
+
+    correct_class_scores = x[rows, y]
+    row_max = np.full(N, -np.inf, dtype=x.dtype)
+    row_sum = np.zeros(N, dtype=x.dtype)
+    chunk_maxes = []
+    for start in range(0, C, chunk_size):
+        end = min(start + chunk_size, C)
+        chunk_max = x[:, start:end].max(axis=1)
+        new_max = np.maximum(row_max, chunk_max)
+        row_sum *= np.exp(row_max - new_max)
+        np.subtract(x[:, start:end], chunk_max[:, np.newaxis], out=dx[:, start:end])
+        np.exp(dx[:, start:end], out=dx[:, start:end])
+        row_sum += dx[:, start:end].sum(axis=1) * np.exp(chunk_max - new_max)
+        row_max = new_max
+        chunk_maxes.append(chunk_max)
+
+    loss = (np.log(row_sum).sum() + row_max.sum() - correct_class_scores.sum()) / N
+
+    row_sum *= N
+    for i, start in enumerate(range(0, C, chunk_size)):
+        end = min(start + chunk_size, C)
+        scale = np.exp(chunk_maxes[i] - row_max) / row_sum
+        dx[:, start:end] *= scale[:, np.newaxis]
+    dx[rows, y] -= x.dtype.type(1.0 / N)
+    return float(loss), dx
@@ -1,14 +1,16 @@
 from builtins import range
 import numpy as np
 
+from cs231n.intra_op import parallel_for
+
 
 def get_im2col_indices(x_shape, field_height, field_width, padding=1, stride=1):
     # First figure out what the size of the output should be
     N, C, H, W = x_shape
     assert (H + 2 * padding - field_height) % stride == 0
     assert (W + 2 * padding - field_height) % stride == 0
-    out_height = (H + 2 * padding - field_height) / stride + 1
-    out_width = (W + 2 * padding - field_width) / stride + 1
+    out_height = (H + 2 * padding - field_height) // stride + 1
+    out_width = (W + 2 * padding - field_width) // stride + 1
 
     i0 = np.repeat(np.arange(field_height), field_width)
     i0 = np.tile(i0, C)
@@ -25,14 +27,18 @@ def get_im2col_indices(x_shape, field_height, field_width, padding=1, stride=1):
 
 def im2col_indices(x, field_height, field_width, padding=1, stride=1):
     """ An implementation of im2col based on some fancy indexing """
-    # Zero-pad the input
-    p = padding
-    x_padded = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
-
     k, i, j = get_im2col_indices(x.shape, field_height, field_width, padding,
                                  stride)
 
-    cols = x_padded[:, k, i, j]
+    # Zero-pad the input and gather the columns, on chunks of the batch in the
+    # intra-op threads
+    p = padding
+    cols = np.empty((x.shape[0],) + k.shape[:1] + i.shape[1:], dtype=x.dtype)
+
+    def chunk(s, e):
+        x_padded = np.pad(x[s:e], ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
+        cols[s:e] = x_padded[:, k, i, j]
+    parallel_for(x.shape[0], chunk)
     C = x.shape[1]
     cols = cols.transpose(1, 2, 0).reshape(field_height * field_width * C, -1)
     return cols
@@ -48,7 +54,10 @@ def col2im_indices(cols, x_shape, field_height=3, field_width=3, padding=1,
                                  stride)
     cols_reshaped = cols.reshape(C * field_height * field_width, -1, N)
     cols_reshaped = cols_reshaped.transpose(2, 0, 1)
-    np.add.at(x_padded, (slice(None), k, i, j), cols_reshaped)
+
+    def chunk(s, e):
+        np.add.at(x_padded[s:e], (slice(None), k, i, j), cols_reshaped[s:e])
+    parallel_for(N, chunk)
     if padding == 0:
         return x_padded
     return x_padded[:, :, padding:-padding, padding:-padding]
@@ -0,0 +1,260 @@
+from __future__ import print_function, division
+from builtins import range
+from builtins import object
+import timeit
+
+import numpy as np
+
+from cs231n.classifiers.fc_net import FullyConnectedNet
+from cs231n.classifiers.cnn import ThreeLayerConvNet
+
+
+"""
+This file implements compiled inference plans for low-latency scoring of a
+fixed, small batch size (typically a single image).
+
+Calling model.loss(X) on one image spends most of its time in Python overhead
+rather than arithmetic: params dict lookups, conv_param parsing, np.pad, the
+stride-trick setup and building caches that are never used. An inference plan
+does all of that once, when it is compiled:
+
+- Geometry (padding, output sizes, strides) is computed up front.
+- Weights are copied, reshaped and transposed into the layout the GEMMs want,
+  and test-time batch normalization is folded into the affine weights.
+- Every intermediate buffer is preallocated, including a zero-padded input
+  buffer whose border is written only once and a stride-trick view over it.
+
+A plan snapshots the parameters it was compiled from; compile a new plan after
+the model is trained further.
+
+Run this file as a script to compare the p99 latency of both paths:
+
+python -m cs231n.inference
+"""
+
+
+class FullyConnectedInferencePlan(object):
+    """
+    Inference plan for a FullyConnectedNet.
+    """
+
+    def __init__(self, model, batch_size=1):
+        self.batch_size = batch_size
+        self.dtype = model.dtype
+        L = model.num_layers
+
+        self.weights, self.biases = [], []
+        for l in range(1, L + 1):
+            W = model.params['W%d' % l].astype(self.dtype)
+            b = model.params['b%d' % l].astype(self.dtype)
+            if model.use_batchnorm and l < L:
+                # Test-time batch normalization is an affine map, so it can be
+                # folded into the preceding affine layer.
+                bn_param = model.bn_params[l - 1]
+                eps = bn_param.get('eps', 1e-5)
+                running_mean = bn_param.get('running_mean', np.zeros(W.shape[1]))
+                running_var = bn_param.get('running_var', np.zeros(W.shape[1]))
+                scale = (model.params['gamma%d' % l] / np.sqrt(running_var + eps)).reshape(-1)
+                W = W * scale
+                b = (b - running_mean) * scale + model.params['beta%d' % l].reshape(-1)
+            self.weights.append(np.ascontiguousarray(W, dtype=self.dtype))
+            self.biases.append(np.asarray(b, dtype=self.dtype))
+
+        self.x = np.empty((batch_size, self.weights[0].shape[0]), dtype=self.dtype)
+        self.buffers = [np.empty((batch_size, W.shape[1]), dtype=self.dtype) for W in self.weights]
+
+
+    def __call__(self, X):
+        """
+        Compute scores for a batch of exactly batch_size inputs.
+
+        Inputs:
+        - X: Array of input data of shape (batch_size, d_1, ..., d_k)
+
+        Returns:
+        - scores: Array of shape (batch_size, C). This is a buffer owned by the
+          plan and is overwritten by the next call.
+        """
+        if X.shape[0] != self.batch_size:
+            raise ValueError('Plan was compiled for batch size %d, got %d' % (self.batch_size, X.shape[0]))
+        np.copyto(self.x, X.reshape(self.x.shape), casting='unsafe')
+
+        h = self.x
+        last = len(self.weights) - 1
+        for i, (W, b, out) in enumerate(zip(self.weights, self.biases, self.buffers)):
+            np.dot(h, W, out=out)
+            out += b
+            if i < last:
+                np.maximum(out, 0, out=out)
+            h = out
+        return h
+
+
+class ThreeLayerConvInferencePlan(object):
+    """
+    Inference plan for a ThreeLayerConvNet.
+
+    The convolution is computed as cols.dot(W1) with the im2col matrix laid out
+    as (N * H' * W', C * HH * WW), so its output is channels-last. Max pooling
+    runs directly on that output, and since adding a per-channel bias and
+    applying ReLU both commute with taking a maximum, they are applied after
+    pooling on a tensor four times smaller. W2 is permuted once so that it
+    accepts the channels-last pooled activations without a transpose.
+    """
+
+    def __init__(self, model, batch_size=1, input_dim=(3, 32, 32)):
+        self.batch_size = batch_size
+        self.dtype = dtype = model.dtype
+        N = batch_size
+        C, H, W = input_dim
+
+        W1 = model.params['W1']
+        F, _, HH, WW = W1.shape
+        stride, pad = 1, (HH - 1) // 2
+        Hp, Wp = H + 2 * pad, W + 2 * pad
+        out_h = (Hp - HH) // stride + 1
+        out_w = (Wp - WW) // stride + 1
+        assert out_h % 2 == 0 and out_w % 2 == 0, 'pooling regions must tile the conv output'
+        pool_h, pool_w = out_h // 2, out_w // 2
+        self.pad, self.H, self.W = pad, H, W
+
+        self.W1 = np.ascontiguousarray(W1.reshape(F, -1).T, dtype=dtype)
+        self.b1 = model.params['b1'].astype(dtype)
+        hidden_dim = model.params['W2'].shape[1]
+        W2 = model.params['W2'].reshape(F, pool_h, pool_w, hidden_dim)
+        self.W2 = np.ascontiguousarray(W2.transpose(1, 2, 0, 3).reshape(-1, hidden_dim), dtype=dtype)
+        self.b2 = model.params['b2'].astype(dtype)
+        self.W3 = np.ascontiguousarray(model.params['W3'], dtype=dtype)
+        self.b3 = model.params['b3'].astype(dtype)
+
+        # The border of the padded buffer stays zero; only the interior is
+        # overwritten on each call.
+        self.x_padded = np.zeros((N, C, Hp, Wp), dtype=dtype)
+        shape = (N, out_h, out_w, C, HH, WW)
+        strides = (C * Hp * Wp, stride * Wp, stride, Hp * Wp, Wp, 1)
+        strides = self.x_padded.itemsize * np.array(strides)
+        self.x_stride = np.lib.stride_tricks.as_strided(self.x_padded, shape=shape, strides=strides)
+        self.cols = np.empty((N * out_h * out_w, C * HH * WW), dtype=dtype)
+        self.conv_out = np.empty((N * out_h * out_w, F), dtype=dtype)
+        self.conv_out_6d = self.conv_out.reshape(N, pool_h, 2, pool_w, 2, F)
+        self.pool_out = np.empty((N, pool_h, pool_w, F), dtype=dtype)
+        self.pool_rows = self.pool_out.reshape(N, -1)
+        self.hidden = np.empty((N, hidden_dim), dtype=dtype)
+        self.scores = np.empty((N, self.W3.shape[1]), dtype=dtype)
+
+
+    def __call__(self, X):
+        """
+        Compute scores for a batch of exactly batch_size inputs.
+
+        Inputs:
+        - X: Array of input data of shape (batch_size, C, H, W)
+
+        Returns:
+        - scores: Array of shape (batch_size, C). This is a buffer owned by the
+          plan and is overwritten by the next call.
+        """
+        if X.shape[0] != self.batch_size:
+            raise ValueError('Plan was compiled for batch size %d, got %d' % (self.batch_size, X.shape[0]))
+        p = self.pad
+        self.x_padded[:, :, p:p + self.H, p:p + self.W] = X
+
+        np.copyto(self.cols.reshape(self.x_stride.shape), self.x_stride)
+        np.dot(self.cols, self.W1, out=self.conv_out)
+        np.max(self.conv_out_6d, axis=(2, 4), out=self.pool_out)
+        self.pool_out += self.b1
+        np.maximum(self.pool_out, 0, out=self.pool_out)
+
+        np.dot(self.pool_rows, self.W2, out=self.hidden)
+        self.hidden += self.b2
+        np.maximum(self.hidden, 0, out=self.hidden)
+
+        np.dot(self.hidden, self.W3, out=self.scores)
+        self.scores += self.b3
+        return self.scores
+
+
+def compile_inference_plan(model, batch_size=1, input_dim=None):
+    """
+    Compile an inference plan for a trained model.
+
+    Inputs:
+    - model: A FullyConnectedNet or ThreeLayerConvNet
+    - batch_size: The fixed number of inputs every call will score.
+    - input_dim: For ThreeLayerConvNet, the tuple (C, H, W) the model was built
+      with; defaults to (3, 32, 32).
+
+    Returns:
+    - plan: A callable mapping an input batch to scores, equivalent to
+      model.loss(X) in test mode.
+    """
+    if isinstance(model, FullyConnectedNet):
+        return FullyConnectedInferencePlan(model, batch_size)
+    if isinstance(model, ThreeLayerConvNet):
+        return ThreeLayerConvInferencePlan(model, batch_size, input_dim or (3, 32, 32))
+    raise ValueError('No inference plan for model type "%s"' % type(model).__name__)
+
+
+def latency_benchmark(fn, X, num_runs=1000, warmup=50):
+    """
+    Measure per-call latency of fn(X).
+
+    Inputs:
+    - fn: Function to time
+    - X: Input passed to fn on every call
+    - num_runs: Number of timed calls
+    - warmup: Number of untimed calls made first
+
+    Returns:
+    - stats: Dictionary giving the 'mean', 'p50', 'p90', 'p99' and 'max'
+      latency in microseconds.
+    """
+    for _ in range(warmup):
+        fn(X)
+    timer = timeit.default_timer
+    times = np.empty(num_runs)
+    for i in range(num_runs):
+        start = timer()
+        fn(X)
+        times[i] = timer() - start
+    times *= 1e6
+    return {
+        'mean': times.mean(),
+        'p50': np.percentile(times, 50),
+        'p90': np.percentile(times, 90),
+        'p99': np.percentile(times, 99),
+        'max': times.max(),
+    }
+
+
+def compare_latency(model, X, num_runs=1000, input_dim=None):
+    """
+    Check that a compiled plan agrees with model.loss(X) and benchmark both.
+
+    Returns a tuple of:
+    - loss_stats: Latency statistics for model.loss(X)
+    - plan_stats: Latency statistics for the compiled plan
+    - max_diff: Largest absolute difference between the scores of both paths
+    """
+    plan = compile_inference_plan(model, X.shape[0], input_dim)
+    max_diff = np.max(np.abs(plan(X) - model.loss(X)))
+    loss_stats = latency_benchmark(model.loss, X, num_runs)
+    plan_stats = latency_benchmark(plan, X, num_runs)
+    return loss_stats, plan_stats, max_diff
+
+
+if __name__ == '__main__':
+    np.random.seed(0)
+    X = np.random.randn(1, 3, 32, 32).astype(np.float32)
+    models = [
+        ('FullyConnectedNet', FullyConnectedNet([100, 100, 100], use_batchnorm=True)),
+        ('ThreeLayerConvNet', ThreeLayerConvNet()),
+    ]
+    for name, model in models:
+        # One training-mode pass populates the batch normalization statistics.
+        model.loss(np.random.randn(100, 3, 32, 32), np.random.randint(10, size=100))
+        loss_stats, plan_stats, max_diff = compare_latency(model, X)
+        print('%s (batch size 1, max abs diff %.2e)' % (name, max_diff))
+        for label, stats in (('loss(X)', loss_stats), ('plan(X)', plan_stats)):
+            print('  %-8s mean %8.1fus  p50 %8.1fus  p99 %8.1fus' % (
+                  label, stats['mean'], stats['p50'], stats['p99']))
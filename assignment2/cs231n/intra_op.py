@@ -0,0 +1,161 @@
+from builtins import range
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+"""
+This file implements intra-op parallelism for the layer functions: a single
+layer call splits its batch dimension into chunks that are processed by a
+pool of threads.
+
+Most of the work of a layer outside the matrix products runs on one core: the
+elementwise operations of ReLU, dropout and batch normalization, the
+reductions of max pooling, np.pad and the gathers of im2col. These all release
+the GIL on large arrays, as do the Cython im2col and col2im kernels, so
+threads working on different examples of the batch run in parallel:
+
+    from cs231n import intra_op
+    intra_op.set_num_threads(4)
+    loss, grads = model.loss(X, y)
+
+or, for a block of code only:
+
+    with intra_op.num_threads(4):
+        loss, grads = model.loss(X, y)
+
+The default is a single thread, which runs every layer exactly as before.
+Batches smaller than twice the minimum chunk size (see set_min_chunk_size)
+also run serially, because the overhead of dispatching them to threads would
+outweigh the gain. The layers produce the same results with any number of
+threads: each chunk computes the same operations on its own examples, and
+reductions over the batch stay serial.
+"""
+
+
+_num_threads = 1
+_min_chunk_size = 16
+_executor = None
+_executor_lock = threading.Lock()
+_local = threading.local()
+
+
+def set_num_threads(n):
+    """
+    Set the number of threads that layer functions split their batch across;
+    1 disables intra-op parallelism.
+    """
+    global _num_threads, _executor
+    n = max(int(n), 1)
+    with _executor_lock:
+        if n != _num_threads and _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+        _num_threads = n
+
+
+def get_num_threads():
+    """
+    Return the number of intra-op threads.
+    """
+    return _num_threads
+
+
+def set_min_chunk_size(rows):
+    """
+    Set the smallest number of examples given to a thread. A batch is split
+    into at most batch_size // rows chunks, so batches smaller than 2 * rows
+    run serially.
+    """
+    global _min_chunk_size
+    _min_chunk_size = max(int(rows), 1)
+
+
+def get_min_chunk_size():
+    """
+    Return the smallest number of examples given to a thread.
+    """
+    return _min_chunk_size
+
+
+class num_threads(object):
+    """
+    Context manager setting the number of intra-op threads for a block and
+    restoring the previous number afterwards.
+    """
+
+    def __init__(self, n):
+        self.n = n
+        self.previous = None
+
+
+    def __enter__(self):
+        self.previous = get_num_threads()
+        set_num_threads(self.n)
+        return self
+
+
+    def __exit__(self, *args):
+        set_num_threads(self.previous)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_num_threads,
+                                           initializer=_mark_worker)
+        return _executor
+
+
+def _mark_worker():
+    _local.worker = True
+
+
+def _reset_after_fork():
+    # The threads of the pool do not survive a fork, so a forked worker
+    # process starts a pool of its own
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def batch_chunks(N):
+    """
+    Split range(N) into the chunks that parallel_for would run.
+
+    Returns:
+    - chunks: List of (start, end) pairs covering range(N) in order
+    """
+    num_chunks = min(_num_threads, N // _min_chunk_size)
+    if num_chunks <= 1 or getattr(_local, 'worker', False):
+        return [(0, N)]
+    bounds = np.linspace(0, N, num_chunks + 1).astype(int)
+    return [(int(bounds[i]), int(bounds[i + 1])) for i in range(num_chunks)]
+
+
+def parallel_for(N, func):
+    """
+    Call func(start, end) for chunks of range(N), in the intra-op threads if
+    there is more than one chunk. Calls made from an intra-op thread run
+    serially, so layer functions that call each other do not wait on the
+    pool they are running in.
+
+    Inputs:
+    - N: Size of the batch dimension
+    - func: Function processing the examples start to end - 1; it must only
+      write to its own part of any output
+    """
+    chunks = batch_chunks(N)
+    if len(chunks) == 1:
+        func(0, N)
+        return
+    futures = [_get_executor().submit(func, start, end) for start, end in chunks]
+    for future in futures:
+        future.result()
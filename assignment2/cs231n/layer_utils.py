@@ -3,19 +3,45 @@ from cs231n.layers import *
 from cs231n.fast_layers import *
 
 
-def affine_relu_forward(x, w, b):
+def _affine_forward(x, w, b, sparse_param=None):
+    """
+    Runs affine_forward, or affine_forward_sparse if a sparse_param is given,
+    and tags the cache with the method that was used.
+    """
+    if sparse_param is None:
+        out, cache = affine_forward(x, w, b)
+        return out, ('dense', cache)
+    out, cache = affine_forward_sparse(x, w, b, sparse_param)
+    return out, ('sparse', cache)
+
+
+def _affine_backward(dout, cache):
+    """
+    Backward pass matching whichever method _affine_forward used.
+    """
+    method, real_cache = cache
+    if method == 'dense':
+        return affine_backward(dout, real_cache)
+    elif method == 'sparse':
+        return affine_backward_sparse(dout, real_cache)
+    else:
+        raise ValueError('Unrecognized method "%s"' % method)
+
+
+def affine_relu_forward(x, w, b, sparse_param=None):
     """
     Convenience layer that performs an affine transform followed by a ReLU
 
     Inputs:
     - x: Input to the affine layer
     - w, b: Weights for the affine layer
+    - sparse_param: If not None, use affine_forward_sparse with these params
 
     Returns a tuple of:
     - out: Output from the ReLU
     - cache: Object to give to the backward pass
     """
-    a, fc_cache = affine_forward(x, w, b)
+    a, fc_cache = _affine_forward(x, w, b, sparse_param)
     out, relu_cache = relu_forward(a)
     cache = (fc_cache, relu_cache)
     return out, cache
@@ -27,7 +53,7 @@ def affine_relu_backward(dout, cache):
     """
     fc_cache, relu_cache = cache
     da = relu_backward(dout, relu_cache)
-    dx, dw, db = affine_backward(da, fc_cache)
+    dx, dw, db = _affine_backward(da, fc_cache)
     return dx, dw, db
 
 
@@ -59,8 +85,8 @@ def conv_relu_backward(dout, cache):
     return dx, dw, db
 
     
-def affine_batchnorm_relu_forward(x, w, b, gamma, beta, bn_param):
-    affine_out, fc_cache = affine_forward(x, w, b)
+def affine_batchnorm_relu_forward(x, w, b, gamma, beta, bn_param, sparse_param=None):
+    affine_out, fc_cache = _affine_forward(x, w, b, sparse_param)
     bn_out, batch_cache = batchnorm_forward(affine_out, gamma, beta, bn_param)
     relu_out, relu_cache = relu_forward(bn_out)
     cache = (fc_cache, batch_cache, relu_cache)
@@ -71,12 +97,12 @@ def affine_batchnorm_relu_backward(dout, cache):
     fc_cache, batch_cache, relu_cache = cache
     drelu = relu_backward(dout, relu_cache)
     dbatch, dgamma, dbeta = batchnorm_backward_alt(drelu, batch_cache)
-    dx, dw, db = affine_backward(dbatch, fc_cache)
+    dx, dw, db = _affine_backward(dbatch, fc_cache)
     return dx, dw, db, np.sum(dgamma), np.sum(dbeta)
 
 
-def affine_relu_drop_forward(x, w, b, dropout_param):
-    affine_out, fc_cache = affine_forward(x, w, b)
+def affine_relu_drop_forward(x, w, b, dropout_param, sparse_param=None):
+    affine_out, fc_cache = _affine_forward(x, w, b, sparse_param)
     relu_out, relu_cache = relu_forward(affine_out)
     out, drop_cache = dropout_forward(relu_out, dropout_param)
     cache = (fc_cache, relu_cache, drop_cache)
@@ -87,7 +113,7 @@ def affine_relu_drop_backward(dout, cache):
     fc_cache, relu_cache, drop_cache = cache
     ddrop = dropout_backward(dout, drop_cache)
     drelu = relu_backward(ddrop, relu_cache)
-    dx, dw, db = affine_backward(drelu, fc_cache)
+    dx, dw, db = _affine_backward(drelu, fc_cache)
     return dx, dw, db
 
 
@@ -136,3 +162,162 @@ def conv_relu_pool_backward(dout, cache):
     da = relu_backward(ds, relu_cache)
     dx, dw, db = conv_backward_fast(da, conv_cache)
     return dx, dw, db
+
+
+def _reduce_to_shape(grad, shape):
+    """
+    Reduce a per-channel gradient to the shape of the parameter it belongs to.
+    A single-element parameter such as the (1, 1) gamma used by
+    FullyConnectedNet is broadcast over every channel, so its gradient is the
+    sum over channels.
+    """
+    if grad.shape == shape:
+        return grad
+    if np.prod(shape) == 1:
+        return grad.sum().reshape(shape)
+    return grad.reshape(shape)
+
+
+def fuse_layers(*ops):
+    """
+    Build a fused sandwich layer from a chain of ops.
+
+    The chain must start with 'affine' or 'conv', optionally followed by
+    'batchnorm', 'relu' and 'dropout' in that order. The returned forward pass
+    runs the GEMM (or convolution) once and then applies the bias, batch
+    normalization, ReLU and dropout mask in place on the GEMM output, so no
+    intermediate activation is allocated or cached. The backward pass folds the
+    dropout and ReLU masks into a single multiply, since the output is nonzero
+    exactly where both let the gradient through.
+
+    For 'conv' the batch normalization is spatial, with statistics taken over
+    the N, H and W axes.
+
+    The forward function takes its arguments in the same order as the
+    hand-written sandwiches: (x, w, b, [gamma, beta], [conv_param], [bn_param],
+    [dropout_param]); the backward function returns (dx, dw, db, [dgamma,
+    dbeta]). For example, fuse_layers('affine', 'batchnorm', 'relu') produces a
+    drop-in replacement for affine_batchnorm_relu_forward and
+    affine_batchnorm_relu_backward. The backward pass reuses the cached
+    normalized activations as scratch space, so each cache can only be passed
+    to backward once.
+
+    Inputs:
+    - ops: Strings naming the ops in the chain.
+
+    Returns a tuple of:
+    - forward: Forward function of the fused layer
+    - backward: Backward function of the fused layer
+    """
+    base, rest = ops[0], list(ops[1:])
+    if base not in ('affine', 'conv') or rest != [op for op in ('batchnorm', 'relu', 'dropout') if op in rest]:
+        raise ValueError('Cannot fuse ops %s' % (ops,))
+    use_bn, use_relu, use_dropout = 'batchnorm' in rest, 'relu' in rest, 'dropout' in rest
+    # Axes that batch normalization reduces over and the shape that broadcasts
+    # a per-channel vector against the GEMM output.
+    bn_axes = (0, 2, 3) if base == 'conv' else (0,)
+    channel_shape = (1, -1, 1, 1) if base == 'conv' else (1, -1)
+
+    def forward(x, w, b, *args):
+        args = list(args)
+        gamma, beta = (args.pop(0), args.pop(0)) if use_bn else (None, None)
+        conv_param = args.pop(0) if base == 'conv' else None
+        bn_param = args.pop(0) if use_bn else None
+        dropout_param = args.pop(0) if use_dropout else None
+
+        if base == 'conv':
+            # conv_forward_fast already adds the bias inside its GEMM.
+            out, fc_cache = conv_forward_fast(x, w, b, conv_param)
+        else:
+            out = mixed_dot(x.reshape(x.shape[0], -1), w)
+            out += b
+            fc_cache = (x, w, b)
+
+        bn_cache = None
+        if use_bn:
+            mode = bn_param['mode']
+            eps = bn_param.get('eps', 1e-5)
+            momentum = bn_param.get('momentum', 0.9)
+            C = out.shape[1]
+            running_mean = bn_param.get('running_mean', np.zeros(C, dtype=out.dtype))
+            running_var = bn_param.get('running_var', np.zeros(C, dtype=out.dtype))
+            g = np.reshape(gamma, channel_shape) if gamma.size == C else gamma
+            bt = np.reshape(beta, channel_shape) if beta.size == C else beta
+
+            if mode == 'train':
+                sample_mean = out.mean(axis=bn_axes)
+                sample_var = out.var(axis=bn_axes)
+                std = np.sqrt(sample_var + eps)
+                out -= sample_mean.reshape(channel_shape)
+                out /= std.reshape(channel_shape)
+                x_norm = out.copy()
+                running_mean = momentum * running_mean + (1 - momentum) * sample_mean
+                running_var = momentum * running_var + (1 - momentum) * sample_var
+                bn_cache = (x_norm, std, gamma)
+            elif mode == 'test':
+                out -= running_mean.reshape(channel_shape)
+                out /= np.sqrt(running_var + eps).reshape(channel_shape)
+            else:
+                raise ValueError('Invalid forward batchnorm mode "%s"' % mode)
+            out *= g
+            out += bt
+
+            bn_param['running_mean'] = running_mean
+            bn_param['running_var'] = running_var
+
+        if use_relu:
+            np.maximum(out, 0, out=out)
+
+        drop_mode = None
+        if use_dropout:
+            drop_mode = dropout_param['mode']
+            if drop_mode == 'train':
+                if 'seed' in dropout_param:
+                    np.random.seed(dropout_param['seed'])
+                out *= np.random.random(out.shape) > dropout_param['p']
+
+        # After ReLU and dropout the output is nonzero exactly where gradient
+        # flows back, so it doubles as the mask for the backward pass.
+        mask = out if (use_relu or drop_mode == 'train') else None
+        cache = (fc_cache, bn_cache, mask)
+        return out, cache
+
+    def backward(dout, cache):
+        fc_cache, bn_cache, mask = cache
+        if mask is not None:
+            da = dout * (mask != 0)
+        elif bn_cache is not None:
+            da = dout.copy()
+        else:
+            da = dout
+
+        grads_bn = ()
+        if bn_cache is not None:
+            x_norm, std, gamma = bn_cache
+            C = da.shape[1]
+            M = da.size // C
+            g = np.reshape(gamma, channel_shape) if gamma.size == C else gamma
+            dbeta = da.sum(axis=bn_axes)
+            dgamma = (da * x_norm).sum(axis=bn_axes)
+            # Same expression as batchnorm_backward_alt, evaluated in place.
+            da *= M
+            da -= dbeta.reshape(channel_shape)
+            x_norm *= dgamma.reshape(channel_shape)
+            da -= x_norm
+            da *= g / (M * std.reshape(channel_shape))
+            grads_bn = (_reduce_to_shape(dgamma, gamma.shape),
+                        _reduce_to_shape(dbeta, gamma.shape))
+
+        if base == 'conv':
+            dx, dw, db = conv_backward_fast(da, fc_cache)
+        else:
+            dx, dw, db = affine_backward(da, fc_cache)
+        return (dx, dw, db) + grads_bn
+
+    return forward, backward
+
+
+affine_relu_forward_fused, affine_relu_backward_fused = fuse_layers('affine', 'relu')
+affine_batchnorm_relu_forward_fused, affine_batchnorm_relu_backward_fused = fuse_layers('affine', 'batchnorm', 'relu')
+affine_relu_drop_forward_fused, affine_relu_drop_backward_fused = fuse_layers('affine', 'relu', 'dropout')
+conv_bn_relu_forward_fused, conv_bn_relu_backward_fused = fuse_layers('conv', 'batchnorm', 'relu')
@@ -1,6 +1,22 @@
 from builtins import range
 import numpy as np
 
+from cs231n.intra_op import parallel_for
+
+
+def mixed_dot(a, b):
+    """
+    Matrix product that keeps float16 storage but accumulates in float32.
+
+    numpy has no fast float16 matrix multiply, so if either operand is float16
+    both are converted to float32 for the product and the result is converted
+    back to float16. For any other datatypes this is just np.dot(a, b).
+    """
+    if a.dtype != np.float16 and b.dtype != np.float16:
+        return np.dot(a, b)
+    out = np.dot(a.astype(np.float32), b.astype(np.float32))
+    return out.astype(np.float16)
+
 
 def affine_forward(x, w, b):
     """
@@ -30,7 +46,7 @@ def affine_forward(x, w, b):
     D = np.prod(x.shape[1:])
     x_tf = x.reshape(x.shape[0], D) # (N x D)
     # Think of M as the hidden layer dimension. We have M biaes which makes sense.
-    out = np.dot(x_tf, w) # (N x M)
+    out = mixed_dot(x_tf, w) # (N x M)
     out += b
     ###########################################################################
     #                             END OF YOUR CODE                            #
@@ -61,8 +77,8 @@ def affine_backward(dout, cache):
     ###########################################################################
     D = np.prod(x.shape[1:]) # As usual, squash everything into D dimension
     x_tf = x.reshape(x.shape[0], D) # (N x D)
-    dw = np.dot(x_tf.T, dout) # (D x N)(N x M) => (D x M)
-    dx = np.dot(dout, w.T).reshape(x.shape) # (N x M)(M x D) => (N x D) then reshape => (N x d_1 x d_2 x d_3 x ... x d_k)
+    dw = mixed_dot(x_tf.T, dout) # (D x N)(N x M) => (D x M)
+    dx = mixed_dot(dout, w.T).reshape(x.shape) # (N x M)(M x D) => (N x D) then reshape => (N x d_1 x d_2 x d_3 x ... x d_k)
 
     # Take a careful look at biases, it's actually very easy. If we keep (N x M) as our biaes, we wouldn't need to perform
     # the squashing. db is simply dout. However, we want biases to be just M and use array broadcasting to apply to N
@@ -89,7 +105,11 @@ def relu_forward(x):
     ###########################################################################
     # TODO: Implement the ReLU forward pass.                                  #
     ###########################################################################
-    out = np.maximum(0, x)
+    out = np.empty_like(x)
+
+    def chunk(s, e):
+        np.maximum(x[s:e], 0, out=out[s:e])
+    parallel_for(x.shape[0], chunk)
     ###########################################################################
     #                             END OF YOUR CODE                            #
     ###########################################################################
@@ -115,7 +135,10 @@ def relu_backward(dout, cache):
     # If the forward value is 0 or less, ReLU squashes it and thus there isn't any gradient otherwise it's 1. A ReLu gate,
     # a.k.a. max gate, routes gradient. The gradient for a max gate is 1 for the highest value, and 0 for all other values.
     dx = dout
-    dx[x <= 0] = 0
+
+    def chunk(s, e):
+        dx[s:e][x[s:e] <= 0] = 0
+    parallel_for(x.shape[0], chunk)
     ###########################################################################
     #                             END OF YOUR CODE                            #
     ###########################################################################
@@ -187,8 +210,16 @@ def batchnorm_forward(x, gamma, beta, bn_param):
         #######################################################################
         sample_mean = x.mean(axis=0)
         sample_var = x.var(axis=0)
-        x_norm = (x - sample_mean) / np.sqrt(sample_var + eps)
-        out = x_norm * gamma + beta
+        std = np.sqrt(sample_var + eps)
+        x_norm = np.empty_like(x, dtype=np.result_type(x, std))
+        out = np.empty_like(x_norm, dtype=np.result_type(x_norm, gamma, beta))
+
+        def chunk(s, e):
+            np.subtract(x[s:e], sample_mean, out=x_norm[s:e])
+            x_norm[s:e] /= std
+            np.multiply(x_norm[s:e], gamma, out=out[s:e])
+            out[s:e] += beta
+        parallel_for(N, chunk)
 
         # This is the formula for exponential moving average
         running_mean = momentum * running_mean + (1 - momentum) * sample_mean
@@ -204,8 +235,15 @@ def batchnorm_forward(x, gamma, beta, bn_param):
         # then scale and shift the normalized data using gamma and beta.      #
         # Store the result in the out variable.                               #
         #######################################################################
-        x_norm_test = (x - running_mean) / np.sqrt(running_var + eps)
-        out = x_norm_test * gamma + beta
+        std = np.sqrt(running_var + eps)
+        out = np.empty_like(x, dtype=np.result_type(x, running_mean, std, gamma, beta))
+
+        def chunk(s, e):
+            np.subtract(x[s:e], running_mean, out=out[s:e])
+            out[s:e] /= std
+            out[s:e] *= gamma
+            out[s:e] += beta
+        parallel_for(N, chunk)
         #######################################################################
         #                          END OF YOUR CODE                           #
         #######################################################################
@@ -288,7 +326,13 @@ def batchnorm_backward_alt(dout, cache):
     N = dout.shape[0]
     dx_norm = dout * gamma
 
-    dx = (1. / N) * (1 / np.sqrt(var + eps)) * (N * dx_norm - np.sum(dx_norm, axis=0) - x_norm * np.sum(dx_norm * x_norm, axis=0))
+    dx_norm_sum = np.sum(dx_norm, axis=0)
+    dx_norm_dot = np.sum(dx_norm * x_norm, axis=0)
+    dx = np.empty_like(dx_norm, dtype=np.result_type(dx_norm, x_norm, var))
+
+    def chunk(s, e):
+        dx[s:e] = (1. / N) * (1 / np.sqrt(var + eps)) * (N * dx_norm[s:e] - dx_norm_sum - x_norm[s:e] * dx_norm_dot)
+    parallel_for(N, chunk)
     dgamma = (dout * x_norm).sum(axis=0) # Sum over N, such that (N, D) => (D,)
     dbeta = dout.sum(axis=0) # Sum over N, such that (N, D) => (D,)
     ###########################################################################
@@ -329,10 +373,16 @@ def dropout_forward(x, dropout_param):
         # TODO: Implement training phase forward pass for inverted dropout.   #
         # Store the dropout mask in the mask variable.                        #
         #######################################################################
-        mask = np.ones(x.shape)
+        # The mask is drawn serially so that it does not depend on the
+        # number of intra-op threads
+        mask = np.ones(x.shape, dtype=x.dtype)
         probability = np.random.random(x.shape)
         mask[probability <= p] = 0
-        out = mask * x
+        out = np.empty_like(mask)
+
+        def chunk(s, e):
+            np.multiply(mask[s:e], x[s:e], out=out[s:e])
+        parallel_for(x.shape[0], chunk)
         #######################################################################
         #                           END OF YOUR CODE                          #
         #######################################################################
@@ -367,7 +417,9 @@ def dropout_backward(dout, cache):
         #######################################################################
         # TODO: Implement training phase backward pass for inverted dropout   #
         #######################################################################
-        dout[mask ==0] = 0
+        def chunk(s, e):
+            dout[s:e][mask[s:e] == 0] = 0
+        parallel_for(dout.shape[0], chunk)
         dx = dout
         #######################################################################
         #                          END OF YOUR CODE                           #
@@ -421,7 +473,7 @@ def conv_forward_naive(x, w, b, conv_param):
 
     output_height = int(1 + (input_height + 2 * pad - filter_height) / stride)
     output_width = int(1 + (input_width + 2 * pad - filter_width) / stride)
-    output = np.zeros((N, num_filter, output_height, output_width))
+    output = np.zeros((N, num_filter, output_height, output_width), dtype=x.dtype)
 
     for n in range(N):
         for f in range(num_filter):
@@ -466,9 +518,9 @@ def conv_backward_naive(dout, cache):
     #
     # If you have N examples, then just sum across N examples
     x, w, b, conv_param = cache
-    dw = np.zeros(w.shape)
-    dx = np.zeros(x.shape)
-    db = np.zeros(b.shape)
+    dw = np.zeros(w.shape, dtype=w.dtype)
+    dx = np.zeros(x.shape, dtype=x.dtype)
+    db = np.zeros(b.shape, dtype=b.dtype)
 
     N = x.shape[0]
     num_filter = w.shape[0]
@@ -478,7 +530,7 @@ def conv_backward_naive(dout, cache):
     # API for pad_width is ((before_1, after_1), ..., (before_N, afterN))
     pad_width = ((0, 0,), (0, 0), (pad, pad), (pad, pad))
     padded_x = np.pad(x, pad_width=pad_width, mode='constant', constant_values=0)
-    padded_dx = np.zeros(padded_x.shape)
+    padded_dx = np.zeros(padded_x.shape, dtype=x.dtype)
 
     input_height = x.shape[2]
     input_width = x.shape[3]
@@ -538,7 +590,7 @@ def max_pool_forward_naive(x, pool_param):
     pool_width = pool_param['pool_width']
     output_width = int(1 + (input_width - pool_width) / stride)
 
-    output = np.zeros((N, C, output_height, output_width))
+    output = np.zeros((N, C, output_height, output_width), dtype=x.dtype)
     for n in range(N):
         for c in range(C):
             for h in range(output_height):
@@ -581,7 +633,7 @@ def max_pool_backward_naive(dout, cache):
     pool_width = pool_param['pool_width']
     output_width = int(1 + (input_width - pool_width) / stride)
 
-    dx = np.zeros(x.shape)
+    dx = np.zeros(x.shape, dtype=x.dtype)
     for n in range(N):
         for c in range(C):
             for h in range(output_height):
@@ -718,8 +770,11 @@ def softmax_loss(x, y):
 
     Returns a tuple of:
     - loss: Scalar giving the loss
-    - dx: Gradient of the loss with respect to x
+    - dx: Gradient of the loss with respect to x, with the datatype of x
     """
+    # float16 scores are upcast so that the exponentials stay accurate.
+    dtype = x.dtype
+    x = x.astype(np.promote_types(dtype, np.float32), copy=False)
     shifted_logits = x - np.max(x, axis=1, keepdims=True)
     Z = np.sum(np.exp(shifted_logits), axis=1, keepdims=True)
     log_probs = shifted_logits - np.log(Z)
@@ -729,4 +784,4 @@ def softmax_loss(x, y):
     dx = probs.copy()
     dx[np.arange(N), y] -= 1
     dx /= N
-    return loss, dx
+    return loss, dx.astype(dtype, copy=False)
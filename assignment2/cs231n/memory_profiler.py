@@ -0,0 +1,307 @@
+from __future__ import division
+from builtins import object
+import functools
+
+import numpy as np
+
+from cs231n.profiler import patch_layer_functions, restore_layer_functions
+
+
+"""
+This file implements accounting of the activation memory that a model holds
+during model.loss.
+
+The forward pass of every layer returns its output and a cache for the
+backward pass, and the model keeps them until the backward pass has used them:
+x_cols in the caches of the fast convolutions, the list of per-timestep cache
+dicts that lstm_forward builds, the cache_list of FullyConnectedNet, and so on.
+A MemoryProfiler wraps the layer functions (like LayerProfiler in profiler.py)
+and the loss method of one model. Every call of model.loss is a step. During a
+step it adds up the bytes of the arrays held by the outputs and caches of all
+layer calls whose backward pass has not run yet, and it records the peak of
+that total and which layer call reached it:
+
+    profiler = MemoryProfiler(model)
+    with profiler:
+        model.loss(X, y)
+    profiler.print_report()
+
+Arrays are counted by the memory they are views of, so an array that appears
+in several caches, or a view of another array, is counted once; the model
+parameters, batch normalization running averages and the input data passed to
+model.loss are not counted. Layer functions called by other layer functions
+(such as rnn_step_forward inside rnn_forward) are accounted for as part of the
+outer call. Gradients and other temporaries of the backward pass are not
+counted.
+
+A MemoryProfiler can be passed to a Solver or CaptioningSolver as profiler,
+which then records a step for every minibatch it trains on.
+"""
+
+
+def format_bytes(num_bytes):
+    """
+    Format a number of bytes with a binary unit, such as '1.5 MiB'.
+    """
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if abs(num_bytes) < 1024 or unit == 'GiB':
+            return '%.1f %s' % (num_bytes, unit) if unit != 'B' else '%d B' % num_bytes
+        num_bytes /= 1024.0
+
+
+def _root(a):
+    """
+    Return the array that owns the memory of an array.
+    """
+    while isinstance(a.base, np.ndarray):
+        a = a.base
+    return a
+
+
+def _collect_arrays(obj, arrays):
+    """
+    Append every array found in nested tuples, lists and dicts to arrays.
+    """
+    if isinstance(obj, np.ndarray):
+        arrays.append(obj)
+    elif isinstance(obj, (tuple, list)):
+        for v in obj:
+            _collect_arrays(v, arrays)
+    elif isinstance(obj, dict):
+        for v in obj.values():
+            _collect_arrays(v, arrays)
+    return arrays
+
+
+def _cache_of(result):
+    """
+    Return the cache in the result of a forward function, or None if it does
+    not return one. Forward functions return (out, cache), or several outputs
+    followed by the cache, like lstm_step_forward.
+    """
+    if isinstance(result, tuple) and len(result) >= 2:
+        cache = result[-1]
+        if not isinstance(cache, (np.ndarray, np.generic, float, int)):
+            return cache
+    return None
+
+
+class MemoryProfiler(object):
+    """
+    Records the peak activation memory of every call of model.loss.
+
+    Attributes:
+    - steps: List with one dictionary per call of model.loss, with keys
+      'mode' ('train' or 'test'), 'peak_bytes', 'peak_layer' (the layer
+      call that reached the peak, such as 'affine_forward#2' for the second
+      call of affine_forward in the step) and 'layers', a list of
+      (layer call, bytes) pairs giving what each layer call held at the peak,
+      largest first.
+    - runs: List of the solver runs recorded with record_run.
+    """
+
+    def __init__(self, model):
+        """
+        Inputs:
+        - model: The model whose loss calls are profiled.
+        """
+        self.model = model
+        self.steps = []
+        self.runs = []
+        self._patches = None
+        self._depth = 0
+        self._start_step()
+
+
+    def _start_step(self):
+        self._entries = {}      # id(cache) -> (label, root ids, cache)
+        self._roots = {}        # id(root) -> [nbytes, refcount, label, root]
+        self._live = 0
+        self._calls = {}
+        self._peak = 0
+        self._peak_layer = None
+        self._peak_layers = []
+        self._anonymous = []
+        self._excluded = set()
+        for p in self.model.params.values():
+            self._excluded.add(id(_root(p)))
+        for bn_param in getattr(self.model, 'bn_params', []):
+            for v in bn_param.values():
+                if isinstance(v, np.ndarray):
+                    self._excluded.add(id(_root(v)))
+
+
+    def _hold(self, label, result):
+        """
+        Account for the output and cache of a layer call.
+        """
+        root_ids = []
+        for a in _collect_arrays(result, []):
+            root = _root(a)
+            key = id(root)
+            if key in self._excluded or key in root_ids:
+                continue
+            root_ids.append(key)
+            held = self._roots.get(key)
+            if held is None:
+                self._roots[key] = [root.nbytes, 1, label, root]
+                self._live += root.nbytes
+            else:
+                held[1] += 1
+
+        cache = _cache_of(result)
+        if cache is not None:
+            self._entries[id(cache)] = (label, root_ids, cache)
+        else:
+            self._anonymous.append((label, root_ids, result))
+
+        if self._live > self._peak:
+            self._peak = self._live
+            self._peak_layer = label
+            by_layer = {}
+            for nbytes, _, owner, _ in self._roots.values():
+                by_layer[owner] = by_layer.get(owner, 0) + nbytes
+            self._peak_layers = sorted(by_layer.items(), key=lambda kv: -kv[1])
+
+
+    def _release(self, args):
+        """
+        Stop accounting for the cache passed to a backward call.
+        """
+        for arg in args:
+            entry = self._entries.pop(id(arg), None)
+            if entry is None:
+                continue
+            for key in entry[1]:
+                held = self._roots[key]
+                held[1] -= 1
+                if held[1] == 0:
+                    self._live -= held[0]
+                    del self._roots[key]
+
+
+    def _wrap(self, name, func):
+        profiler = self
+        backward = 'backward' in name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if profiler._depth > 0:
+                return func(*args, **kwargs)
+            profiler._depth += 1
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                profiler._depth -= 1
+            if backward:
+                profiler._release(args)
+            else:
+                count = profiler._calls.get(name, 0) + 1
+                profiler._calls[name] = count
+                profiler._hold('%s#%d' % (name, count), result)
+            return result
+        return wrapper
+
+
+    def _wrap_loss(self, loss):
+        profiler = self
+
+        @functools.wraps(loss)
+        def wrapper(*args, **kwargs):
+            profiler._start_step()
+            for a in _collect_arrays(args, []):
+                profiler._excluded.add(id(_root(a)))
+            result = loss(*args, **kwargs)
+            train = isinstance(result, tuple)
+            profiler.steps.append({
+                'mode': 'train' if train else 'test',
+                'peak_bytes': profiler._peak,
+                'peak_layer': profiler._peak_layer,
+                'layers': profiler._peak_layers,
+            })
+            profiler._start_step()
+            return result
+        return wrapper
+
+
+    def start(self):
+        """
+        Start accounting for the layer functions and model.loss.
+        """
+        if self._patches is not None:
+            return
+        self._patches = patch_layer_functions(self._wrap)
+        self.model.loss = self._wrap_loss(self.model.loss)
+
+
+    def stop(self):
+        """
+        Put the original layer functions and model.loss back.
+        """
+        if self._patches is None:
+            return
+        restore_layer_functions(self._patches)
+        self._patches = None
+        del self.model.loss
+
+
+    def __enter__(self):
+        self.start()
+        return self
+
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+    def record_run(self, name, num_examples, elapsed, **info):
+        """
+        Record a training run, with the largest peak of its steps.
+        """
+        run = dict(info, name=name, examples=num_examples, time=elapsed,
+                   peak_bytes=self.peak_bytes())
+        self.runs.append(run)
+        return run
+
+
+    def peak_bytes(self, mode=None):
+        """
+        Return the largest peak over the recorded steps, optionally only over
+        the steps of one mode ('train' or 'test').
+        """
+        peaks = [s['peak_bytes'] for s in self.steps if mode is None or s['mode'] == mode]
+        return max(peaks) if peaks else 0
+
+
+    def report(self):
+        """
+        Summarize the recorded steps.
+
+        Returns:
+        - summary: Dictionary mapping each mode to a dictionary with the number
+          of 'steps', the largest 'peak_bytes', the 'peak_layer' of the step
+          with that peak, and its 'layers' breakdown.
+        """
+        summary = {}
+        for step in self.steps:
+            mode = summary.get(step['mode'])
+            if mode is None:
+                mode = summary[step['mode']] = {'steps': 0, 'peak_bytes': -1}
+            mode['steps'] += 1
+            if step['peak_bytes'] > mode['peak_bytes']:
+                mode.update(peak_bytes=step['peak_bytes'], peak_layer=step['peak_layer'],
+                            layers=step['layers'])
+        return summary
+
+
+    def print_report(self, top=5):
+        """
+        Print the peak of each mode and the layer calls holding the most memory
+        at that peak.
+        """
+        for mode, stats in sorted(self.report().items()):
+            print('%s: %d steps, peak %s reached at %s' % (
+                  mode, stats['steps'], format_bytes(stats['peak_bytes']),
+                  stats['peak_layer']))
+            for label, nbytes in stats['layers'][:top]:
+                print('  %-32s %s' % (label, format_bytes(nbytes)))
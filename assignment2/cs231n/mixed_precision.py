@@ -0,0 +1,123 @@
+from builtins import object
+import numpy as np
+
+
+"""
+This file implements the pieces of mixed-precision training that live outside
+the layers.
+
+A model built with dtype=np.float16 stores its parameters and activations in
+half precision, which halves the memory traffic of every layer; the matrix
+products still accumulate in float32 (see layers.mixed_dot). Two things are
+needed to train such a model without losing accuracy, and Solver provides both
+when it is constructed with mixed_precision=True:
+
+- Master weights: the update rule runs on float32 copies of the parameters,
+  since float16 cannot represent small updates to large weights. After each
+  step the master weights are rounded into model.params.
+- Dynamic loss scaling: small gradients underflow to zero in float16, so the
+  gradient of the loss is multiplied by model.loss_scale before it is
+  backpropagated. The gradients are divided by the same factor in float32
+  before the update. If any gradient overflows the step is skipped and the
+  scale is reduced; after a run of good steps it is increased again.
+
+audit_dtypes checks that a model really keeps every activation, gradient and
+parameter in its requested dtype instead of silently upcasting to float64.
+"""
+
+
+class DynamicLossScaler(object):
+    """
+    Tracks the loss scale for mixed-precision training.
+
+    Attributes:
+    - scale: The current loss scale.
+    - num_skipped: Number of steps skipped because a gradient overflowed.
+    """
+
+    def __init__(self, init_scale=2.0 ** 16, growth_factor=2.0,
+                 backoff_factor=0.5, growth_interval=1000):
+        """
+        Inputs:
+        - init_scale: Initial loss scale.
+        - growth_factor: Factor the scale is multiplied by after growth_interval
+          consecutive steps without overflow.
+        - backoff_factor: Factor the scale is multiplied by when a gradient
+          overflows.
+        - growth_interval: Number of consecutive good steps before the scale
+          grows.
+        """
+        self.scale = float(init_scale)
+        self.growth_factor = growth_factor
+        self.backoff_factor = backoff_factor
+        self.growth_interval = growth_interval
+        self.num_skipped = 0
+        self._good_steps = 0
+
+
+    def unscale(self, grads, out=None):
+        """
+        Divide scaled gradients by the loss scale in float32.
+
+        Inputs:
+        - grads: Dictionary mapping parameter names to scaled gradients.
+        - out: Optional dictionary of float32 arrays with the same keys and
+          shapes that receive the unscaled gradients.
+
+        Returns a tuple of:
+        - grads: Dictionary of unscaled float32 gradients (out if it was given)
+        - finite: False if any gradient contains an inf or nan.
+        """
+        if out is None:
+            out = {k: np.empty(g.shape, dtype=np.float32) for k, g in grads.items()}
+        inv_scale = 1.0 / self.scale
+        finite = True
+        for k, g in grads.items():
+            np.multiply(g, inv_scale, out=out[k])
+            finite = finite and bool(np.isfinite(out[k]).all())
+        return out, finite
+
+
+    def update(self, finite):
+        """
+        Adjust the loss scale after a step.
+
+        Inputs:
+        - finite: Whether all gradients of the step were finite.
+        """
+        if not finite:
+            self.scale *= self.backoff_factor
+            self.num_skipped += 1
+            self._good_steps = 0
+            return
+        self._good_steps += 1
+        if self._good_steps >= self.growth_interval:
+            self.scale *= self.growth_factor
+            self._good_steps = 0
+
+
+def audit_dtypes(model, X, y):
+    """
+    Run a model in test and training mode and report every array that is not
+    in the datatype the model was built with.
+
+    Inputs:
+    - model: A model with params, dtype and the usual loss(X, y) method.
+    - X: A minibatch of input data.
+    - y: Labels for X.
+
+    Returns:
+    - mismatches: List of (name, dtype) pairs for the scores, gradients,
+      parameters and batch normalization statistics whose datatype differs
+      from model.dtype; empty if the model is consistent.
+    """
+    dtype = np.dtype(model.dtype)
+    arrays = [('scores', model.loss(X))]
+    loss, grads = model.loss(X, y)
+    arrays += [('grads[%s]' % k, v) for k, v in sorted(grads.items())]
+    arrays += [('params[%s]' % k, v) for k, v in sorted(model.params.items())]
+    for i, bn_param in enumerate(getattr(model, 'bn_params', [])):
+        for k in ('running_mean', 'running_var'):
+            if k in bn_param:
+                arrays.append(('bn_params[%d][%s]' % (i, k), bn_param[k]))
+    return [(name, a.dtype) for name, a in arrays if np.asarray(a).dtype != dtype]
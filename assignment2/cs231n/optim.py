@@ -1,5 +1,7 @@
 import numpy as np
 
+from cs231n.flat_params import FlatParams
+
 """
 This file implements various first-order update rules that are commonly used
 for training neural networks. Each update rule accepts current weights and the
@@ -26,10 +28,28 @@ perform well; however the default values of the other hyperparameters should
 work well for a variety of different problems.
 
 For efficiency, update rules may perform in-place updates, mutating w and
-setting next_w equal to w.
+setting next_w equal to w. sgd_momentum, rmsprop and adam do so: w and the
+state arrays in config are updated in place, and every intermediate result is
+written into a scratch array stored in config['scratch'], so that after the
+first call an update allocates no memory.
+
+To update all parameters of a model with one call to an update rule, use
+multi_tensor_update.
 """
 
 
+def _scratch(x, config):
+    """
+    Return a preallocated array with the shape and datatype of x, stored in
+    config['scratch'] and reused across calls.
+    """
+    scratch = config.get('scratch')
+    if scratch is None or scratch.shape != x.shape or scratch.dtype != x.dtype:
+        scratch = np.empty_like(x)
+        config['scratch'] = scratch
+    return scratch
+
+
 def sgd(w, dw, config=None):
     """
     Performs vanilla stochastic gradient descent.
@@ -58,20 +78,23 @@ def sgd_momentum(w, dw, config=None):
     if config is None: config = {}
     config.setdefault('learning_rate', 1e-2)
     config.setdefault('momentum', 0.9)
-    v = config.get('velocity', np.zeros_like(w))
+    if 'velocity' not in config: config['velocity'] = np.zeros_like(w)
 
     next_w = None
     ###########################################################################
     # TODO: Implement the momentum update formula. Store the updated value in #
     # the next_w variable. You should also use and update the velocity v.     #
     ###########################################################################
-    # Note that dw is a direction, and this is Nesterov Momentum
-    v = config['momentum'] * v - config['learning_rate'] * dw
-    next_w = w + v
+    # v = momentum * v - learning_rate * dw; w += v
+    v, scratch = config['velocity'], _scratch(w, config)
+    v *= config['momentum']
+    np.multiply(dw, config['learning_rate'], out=scratch)
+    v -= scratch
+    w += v
+    next_w = w
     ###########################################################################
     #                             END OF YOUR CODE                            #
     ###########################################################################
-    config['velocity'] = v
 
     return next_w, config
 
@@ -93,7 +116,7 @@ def rmsprop(x, dx, config=None):
     config.setdefault('learning_rate', 1e-2)
     config.setdefault('decay_rate', 0.99)
     config.setdefault('epsilon', 1e-8)
-    config.setdefault('cache', np.zeros_like(x))
+    if 'cache' not in config: config['cache'] = np.zeros_like(x)
 
     next_x = None
     ###########################################################################
@@ -101,11 +124,21 @@ def rmsprop(x, dx, config=None):
     # in the next_x variable. Don't forget to update cache value stored in    #
     # config['cache'].                                                        #
     ###########################################################################
-    grad_squared = config['cache']
-    grad_squared = config['decay_rate'] * grad_squared + (1 - config['decay_rate']) * dx * dx
-    next_x = x - config['learning_rate'] * dx / (np.sqrt(grad_squared) + config['epsilon'])
-
-    config['cache'] = grad_squared
+    # cache = decay_rate * cache + (1 - decay_rate) * dx * dx
+    decay_rate = config['decay_rate']
+    cache, scratch = config['cache'], _scratch(x, config)
+    cache *= decay_rate
+    np.multiply(dx, dx, out=scratch)
+    scratch *= 1 - decay_rate
+    cache += scratch
+
+    # x -= learning_rate * dx / (sqrt(cache) + epsilon)
+    np.sqrt(cache, out=scratch)
+    scratch += config['epsilon']
+    np.divide(dx, scratch, out=scratch)
+    scratch *= config['learning_rate']
+    x -= scratch
+    next_x = x
     ###########################################################################
     #                             END OF YOUR CODE                            #
     ###########################################################################
@@ -132,9 +165,9 @@ def adam(x, dx, config=None):
     config.setdefault('beta1', 0.9)
     config.setdefault('beta2', 0.999)
     config.setdefault('epsilon', 1e-8)
-    config.setdefault('m', np.zeros_like(x))
-    config.setdefault('v', np.zeros_like(x))
-    config.setdefault('t', 1)
+    if 'm' not in config: config['m'] = np.zeros_like(x)
+    if 'v' not in config: config['v'] = np.zeros_like(x)
+    config.setdefault('t', 0)
 
     next_x = None
     ###########################################################################
@@ -142,14 +175,77 @@ def adam(x, dx, config=None):
     # the next_x variable. Don't forget to update the m, v, and t variables   #
     # stored in config.                                                       #
     ###########################################################################
-    first_moment = config['beta1'] * config['m'] + (1 - config['beta1']) * dx
-    sec_moment = config['beta2'] * config['v'] + (1 - config['beta2']) * dx * dx
-    next_x = x - config['learning_rate'] * first_moment / (np.sqrt(sec_moment) + config['epsilon'])
-
-    config['m'] = first_moment
-    config['v'] = sec_moment
+    beta1, beta2 = config['beta1'], config['beta2']
+    m, v, scratch = config['m'], config['v'], _scratch(x, config)
+    config['t'] += 1
+    t = config['t']
+
+    # m = beta1 * m + (1 - beta1) * dx
+    m *= beta1
+    np.multiply(dx, 1 - beta1, out=scratch)
+    m += scratch
+
+    # v = beta2 * v + (1 - beta2) * dx * dx
+    v *= beta2
+    np.multiply(dx, dx, out=scratch)
+    scratch *= 1 - beta2
+    v += scratch
+
+    # x -= learning_rate * mt / (sqrt(vt) + epsilon) with the bias-corrected
+    # moments mt = m / (1 - beta1 ** t) and vt = v / (1 - beta2 ** t)
+    np.divide(v, 1 - beta2 ** t, out=scratch)
+    np.sqrt(scratch, out=scratch)
+    scratch += config['epsilon']
+    np.divide(m, scratch, out=scratch)
+    scratch *= config['learning_rate'] / (1 - beta1 ** t)
+    x -= scratch
+    next_x = x
     ###########################################################################
     #                             END OF YOUR CODE                            #
     ###########################################################################
 
     return next_x, config
+
+
+def multi_tensor_update(update_rule, params, grads, config=None):
+    """
+    Updates every parameter of a model with a single call to an update rule.
+
+    On the first call the parameters are copied into one flat buffer (see
+    flat_params.py), so that the update rule and all of its state (velocity,
+    cache, m, v) operate on one contiguous array rather than one array per
+    parameter. Gradients are gathered into the flat gradient buffer before each
+    update and the new values are written back into the arrays of params in
+    place. If params already holds views into the flat buffer, for example
+    after model.params = config['flat'].param_views, no copies are made at all.
+
+    Inputs:
+    - update_rule: One of the update rules above, such as adam.
+    - params: Dictionary mapping parameter names to numpy arrays.
+    - grads: Dictionary with the same keys as params mapping parameter names
+      to gradients.
+    - config: Configuration for update_rule shared by all parameters. The
+      flat buffers are stored in config['flat'].
+
+    Returns a tuple of:
+    - params: The updated params dictionary.
+    - config: The config dictionary to be passed to the next iteration.
+    """
+    if config is None: config = {}
+    flat = config.get('flat')
+    if flat is None or set(flat.layout) != set(params):
+        flat = FlatParams(params)
+        config['flat'] = flat
+    else:
+        for k, view in flat.param_views.items():
+            if params[k] is not view:
+                view[...] = params[k]
+
+    flat.gather_grads(grads)
+    next_w, config = update_rule(flat.params, flat.grads, config)
+    flat.load(next_w)
+
+    for k, view in flat.param_views.items():
+        if params[k] is not view:
+            params[k][...] = view
+    return params, config
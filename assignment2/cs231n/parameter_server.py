@@ -0,0 +1,516 @@
+from __future__ import print_function, division
+from builtins import range
+from builtins import object
+from multiprocessing.connection import Client, Listener
+import os
+from queue import Empty
+import threading
+import time
+
+import numpy as np
+
+from cs231n import optim
+from cs231n.async_eval import forward_accuracy
+from cs231n.bn_utils import batchnorm_params, running_stats
+from cs231n.flat_params import FlatParams
+from cs231n.hyperparameter_search import share_arrays, attach_arrays
+from cs231n.threading_policy import (apply_policy, start_worker, worker_context,
+                                     worker_policies)
+
+
+"""
+This file implements asynchronous training with a parameter server. The
+workers are local processes, and the server talks to them over sockets.
+
+The parameter server is a process that owns a flat copy of the parameters
+(see flat_params.py) and the state of the update rule. Workers connect to it
+through a multiprocessing.connection socket on the loopback interface, which
+stands in for a real parameter service. Each worker repeatedly:
+
+- pulls the current parameters every pull_every steps;
+- computes the loss and gradients of a minibatch of the shared training data;
+- compresses the flattened gradient and pushes it to the server, which
+  applies the update rule to it at once.
+
+There are two compressors. TopKCompressor sends the largest fraction of
+gradient entries with their indices. QuantizeCompressor sends every entry
+rounded to a few bits. With error feedback, each worker adds what compression
+left out of its previous gradients to the next gradient before compressing
+it, so that no part of the gradient is lost for good.
+
+Every update moves the server's version forward. A push computed from
+parameters that are more than max_staleness versions old is rejected, its
+gradient goes back into the error feedback, and the worker pulls the current
+parameters before its next step. max_staleness=None gives fully asynchronous
+training, and max_staleness=0 makes every step synchronous with the server.
+
+The server and the workers each apply a threading policy when they start
+(see threading_policy.py); by default the cores are split evenly between
+them.
+
+    trainer = ParameterServerTrainer(model, data, num_workers=4,
+                                     update_rule='sgd_momentum',
+                                     compression='topk', compression_ratio=0.01,
+                                     pull_every=4, max_staleness=16)
+    trainer.train()
+    trainer.stats['compression'], trainer.examples_per_sec
+"""
+
+
+class TopKCompressor(object):
+    """
+    Keeps the largest entries of a gradient by magnitude.
+    """
+
+    def __init__(self, ratio=0.01):
+        """
+        Inputs:
+        - ratio: Fraction of the entries that are sent
+        """
+        self.ratio = ratio
+
+
+    def compress(self, g):
+        k = min(max(int(self.ratio * g.size), 1), g.size)
+        idx = np.argpartition(np.abs(g), g.size - k)[g.size - k:]
+        return idx.astype(np.int32), g[idx]
+
+
+    def decompress(self, payload, out):
+        idx, values = payload
+        out[...] = 0
+        out[idx] = values
+        return out
+
+
+class QuantizeCompressor(object):
+    """
+    Rounds every entry of a gradient to one of 2 ** bits - 1 evenly spaced
+    levels between -max|g| and max|g|.
+    """
+
+    def __init__(self, bits=8):
+        """
+        Inputs:
+        - bits: Bits per entry, at most 16
+        """
+        if not 2 <= bits <= 16:
+            raise ValueError('bits must be between 2 and 16')
+        self.bits = bits
+        self.levels = 2 ** (bits - 1) - 1
+
+
+    def compress(self, g):
+        scale = float(np.max(np.abs(g))) if g.size else 0.0
+        dtype = np.int8 if self.bits <= 8 else np.int16
+        if scale == 0.0:
+            return scale, np.zeros(g.shape, dtype=dtype)
+        q = np.rint(g * (self.levels / scale)).astype(dtype)
+        return scale, q
+
+
+    def decompress(self, payload, out):
+        scale, q = payload
+        np.multiply(q, scale / self.levels, out=out)
+        return out
+
+
+class _IdentityCompressor(object):
+
+    def compress(self, g):
+        return g.copy()
+
+
+    def decompress(self, payload, out):
+        out[...] = payload
+        return out
+
+
+def make_compressor(compression=None, ratio=0.01, bits=8):
+    """
+    Build a compressor from its name: None, 'topk' or 'quantize'.
+    """
+    if compression is None:
+        return _IdentityCompressor()
+    if compression == 'topk':
+        return TopKCompressor(ratio)
+    if compression == 'quantize':
+        return QuantizeCompressor(bits)
+    raise ValueError('Invalid compression "%s"' % compression)
+
+
+def compress_with_feedback(compressor, g, residual, sent):
+    """
+    Compress a gradient with error feedback.
+
+    Inputs:
+    - compressor: A compressor, such as a TopKCompressor
+    - g: Gradient; residual is added to it in place before it is compressed
+    - residual: What compression left out of the previous gradients, or None
+      for no error feedback. It is overwritten with what it leaves out of g.
+    - sent: Array of the shape of g that receives the decompressed payload
+
+    Returns:
+    - payload: The compressed gradient
+    """
+    if residual is not None:
+        g += residual
+    payload = compressor.compress(g)
+    compressor.decompress(payload, sent)
+    if residual is not None:
+        np.subtract(g, sent, out=residual)
+    return payload
+
+
+def payload_bytes(payload):
+    """
+    Return the number of bytes of the arrays in a compressed gradient.
+    """
+    if isinstance(payload, np.ndarray):
+        return payload.nbytes
+    return sum(payload_bytes(p) for p in payload if isinstance(p, (np.ndarray, tuple)))
+
+
+class _ServerState(object):
+    """
+    The parameters, update rule state and counters of a parameter server,
+    shared by its connection threads.
+    """
+
+    def __init__(self, params, update_rule, optim_config, compressor, max_staleness):
+        self.params = params
+        self.grad = np.zeros_like(params)
+        self.update_rule = getattr(optim, update_rule)
+        self.config = dict(optim_config)
+        self.compressor = compressor
+        self.max_staleness = max_staleness
+        self.version = 0
+        self.lock = threading.Lock()
+        self.stats = {'pushes': 0, 'rejected': 0, 'bytes': 0, 'dense_bytes': 0,
+                      'loss_history': [], 'staleness': []}
+
+
+    def push(self, version, payload, loss):
+        with self.lock:
+            staleness = self.version - version
+            self.stats['bytes'] += payload_bytes(payload)
+            self.stats['dense_bytes'] += self.params.nbytes
+            if self.max_staleness is not None and staleness > self.max_staleness:
+                self.stats['rejected'] += 1
+                return False, self.version
+            self.compressor.decompress(payload, self.grad)
+            next_w, self.config = self.update_rule(self.params, self.grad, self.config)
+            if next_w is not self.params:
+                self.params[...] = next_w
+            self.version += 1
+            self.stats['pushes'] += 1
+            self.stats['loss_history'].append(float(loss))
+            self.stats['staleness'].append(staleness)
+            return True, self.version
+
+
+    def pull(self):
+        with self.lock:
+            return self.version, self.params.copy()
+
+
+def _serve_connection(conn, state):
+    """
+    Answer the requests of one client until it disconnects or says 'done'.
+    """
+    try:
+        while True:
+            request = conn.recv()
+            kind = request[0]
+            if kind == 'pull':
+                conn.send(state.pull())
+            elif kind == 'push':
+                conn.send(state.push(*request[1:]))
+            elif kind == 'stats':
+                with state.lock:
+                    conn.send((state.version, state.params.copy(), dict(state.stats)))
+            elif kind == 'done':
+                return
+    except EOFError:
+        return
+    finally:
+        conn.close()
+
+
+def _server_main(ready, authkey, num_clients, params, update_rule, optim_config,
+                 compressor, max_staleness, policy):
+    """
+    Main function of the parameter server process. It listens on a free port
+    of the loopback interface, reports the address on ready, and serves
+    num_clients connections, each on its own thread.
+    """
+    apply_policy(policy)
+    state = _ServerState(params, update_rule, optim_config, compressor, max_staleness)
+    listener = Listener(('127.0.0.1', 0), authkey=authkey)
+    ready.send(listener.address)
+    threads = []
+    for _ in range(num_clients):
+        conn = listener.accept()
+        thread = threading.Thread(target=_serve_connection, args=(conn, state))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    listener.close()
+    for thread in threads:
+        thread.join()
+
+
+def _worker_steps(address, authkey, model, flat, X, y, num_steps, batch_size,
+                  pull_every, compressor, error_feedback, seed):
+    """
+    Run the steps of a worker against the server.
+
+    Returns:
+    - compute_time: Seconds spent computing and compressing gradients
+    """
+    rng = np.random.RandomState(seed)
+    np.random.seed(seed)
+    dtype = getattr(model, 'dtype', X.dtype)
+    # A worker started by 'spawn' unpickles its own copies of model and flat,
+    # so the model is pointed at the views of its flat buffer here
+    local = flat.params
+    model.params = dict(flat.param_views)
+    residual = np.zeros_like(flat.grads) if error_feedback else None
+    sent = np.zeros_like(flat.grads)
+
+    conn = Client(address, authkey=authkey)
+    try:
+        version, stale = 0, True
+        compute_time = 0.0
+        for t in range(num_steps):
+            if stale or t % pull_every == 0:
+                conn.send(('pull',))
+                version, params = conn.recv()
+                local[...] = params
+                stale = False
+
+            start = time.perf_counter()
+            idx = rng.randint(X.shape[0], size=batch_size)
+            loss, grads = model.loss(X[idx].astype(dtype, copy=False), y[idx])
+            g = flat.gather_grads(grads)
+            payload = compress_with_feedback(compressor, g, residual, sent)
+            compute_time += time.perf_counter() - start
+
+            conn.send(('push', version, payload, loss))
+            accepted, server_version = conn.recv()
+            if not accepted:
+                # Keep the rejected gradient for the next push
+                if residual is not None:
+                    residual += sent
+                stale = True
+        conn.send(('done',))
+    finally:
+        conn.close()
+    return compute_time
+
+
+def _worker_main(rank, address, authkey, model, flat, handles, num_steps, batch_size,
+                 pull_every, compressor, error_feedback, seed, results, policy):
+    """
+    Main function of a worker process. It puts (rank, (running averages,
+    compute time)) on results, or (rank, exception) if it fails.
+    """
+    apply_policy(policy)
+    arrays, blocks = attach_arrays(handles)
+    try:
+        compute_time = _worker_steps(address, authkey, model, flat, arrays['X'], arrays['y'],
+                                     num_steps, batch_size, pull_every, compressor,
+                                     error_feedback, seed)
+        results.put((rank, (running_stats(batchnorm_params(model)), compute_time)))
+    except Exception as e:
+        results.put((rank, e))
+    finally:
+        del arrays
+        for block in blocks:
+            block.close()
+
+
+def _collect_results(results, workers):
+    """
+    Wait for the result of every worker, raising the first error of a worker
+    or the exit code of a worker that died without reporting.
+    """
+    collected = {}
+    while len(collected) < len(workers):
+        try:
+            rank, result = results.get(timeout=0.1)
+        except Empty:
+            for rank, worker in enumerate(workers):
+                if rank not in collected and worker.exitcode not in (None, 0):
+                    raise RuntimeError('Worker %d exited with code %d' % (rank, worker.exitcode))
+            continue
+        if isinstance(result, Exception):
+            raise result
+        collected[rank] = result
+    return [collected[rank] for rank in range(len(workers))]
+
+
+class ParameterServerTrainer(object):
+    """
+    Trains a model with asynchronous workers and a parameter server, all on
+    this machine. The model follows the same API as for Solver.
+
+    After train() returns, model.params holds the final parameters of the
+    server, loss_history the minibatch loss of every update the server applied
+    (in the order it applied them), and val_acc the accuracy on the validation
+    set. stats has the number of 'pushes' applied and 'rejected', the
+    'staleness' of every applied push, and 'compression', the ratio of the
+    bytes sent to the bytes of dense float gradients.
+    """
+
+    def __init__(self, model, data, **kwargs):
+        """
+        Construct a new ParameterServerTrainer instance.
+
+        Required arguments:
+        - model: A model object conforming to the API described in solver.py
+        - data: A dictionary of training and validation data, as for Solver
+
+        Optional arguments:
+        - update_rule: Name of an update rule in optim.py, run by the server.
+          Default is 'sgd'.
+        - optim_config: A dictionary of hyperparameters for the update rule.
+        - batch_size: Size of the minibatches of each worker.
+        - num_epochs: Number of epochs over the training data, counting the
+          minibatches of all workers together.
+        - num_workers: Number of worker processes; default is 2.
+        - compression: None, 'topk' or 'quantize'.
+        - compression_ratio: Fraction of the gradient entries sent with 'topk'.
+        - quantize_bits: Bits per gradient entry with 'quantize'.
+        - error_feedback: If True (the default), add what compression left
+          out of the previous gradients of a worker to its next gradient.
+        - pull_every: Number of steps a worker takes between pulls of the
+          parameters.
+        - max_staleness: Number of updates that the parameters of a push may
+          be behind the server before the push is rejected; None accepts any
+          push.
+        - seed: Seed of the workers' random states; if None it is drawn from
+          the global numpy random state.
+        - policies: Optional list of num_workers + 1 threading policies (see
+          threading_policy.py), the first for the server and the others for
+          the workers; by default worker_policies(num_workers + 1).
+        - verbose: Boolean; if set to false then no output will be printed.
+        """
+        self.model = model
+        self.X_train = data['X_train']
+        self.y_train = data['y_train']
+        self.X_val = data['X_val']
+        self.y_val = data['y_val']
+
+        # Unpack keyword arguments
+        self.update_rule = kwargs.pop('update_rule', 'sgd')
+        self.optim_config = kwargs.pop('optim_config', {})
+        self.batch_size = kwargs.pop('batch_size', 100)
+        self.num_epochs = kwargs.pop('num_epochs', 10)
+        self.num_workers = kwargs.pop('num_workers', 2)
+        self.compression = kwargs.pop('compression', None)
+        self.compression_ratio = kwargs.pop('compression_ratio', 0.01)
+        self.quantize_bits = kwargs.pop('quantize_bits', 8)
+        self.error_feedback = kwargs.pop('error_feedback', True)
+        self.pull_every = kwargs.pop('pull_every', 1)
+        self.max_staleness = kwargs.pop('max_staleness', None)
+        self.seed = kwargs.pop('seed', None)
+        self.policies = kwargs.pop('policies', None)
+        self.verbose = kwargs.pop('verbose', True)
+
+        # Throw an error if there are extra keyword arguments
+        if len(kwargs) > 0:
+            extra = ', '.join('"%s"' % k for k in list(kwargs.keys()))
+            raise ValueError('Unrecognized arguments %s' % extra)
+
+        if not hasattr(optim, self.update_rule):
+            raise ValueError('Invalid update_rule "%s"' % self.update_rule)
+        self.compressor = make_compressor(self.compression, self.compression_ratio,
+                                          self.quantize_bits)
+
+        self.loss_history = []
+        self.stats = {}
+        self.val_acc = None
+
+
+    def train(self):
+        """
+        Run the server and the workers until every worker has taken its share
+        of the steps.
+        """
+        num_train = self.X_train.shape[0]
+        num_steps = self.num_epochs * max(num_train // self.batch_size, 1)
+        steps = [len(s) for s in np.array_split(np.arange(num_steps), self.num_workers)]
+        seed = self.seed if self.seed is not None else np.random.randint(2 ** 31 - self.num_workers)
+        flat = FlatParams(self.model.params)
+        authkey = os.urandom(16)
+        policies = self.policies or worker_policies(self.num_workers + 1)
+
+        # The server, the workers and the shared data are torn down even if a
+        # worker fails
+        server, workers, blocks = None, [], []
+        try:
+            ctx = worker_context()
+            ready, server_ready = ctx.Pipe()
+            server = ctx.Process(
+                target=_server_main,
+                args=(server_ready, authkey, self.num_workers + 1, flat.params.copy(),
+                      self.update_rule, self.optim_config, self.compressor,
+                      self.max_staleness, policies[0]))
+            server.daemon = True
+            start_worker(server, policies[0])
+            address = ready.recv()
+
+            handles, blocks = share_arrays({'X': self.X_train, 'y': self.y_train})
+            results = ctx.Queue()
+            start_time = time.perf_counter()
+            for rank in range(self.num_workers):
+                worker = ctx.Process(
+                    target=_worker_main,
+                    args=(rank, address, authkey, self.model, flat, handles, steps[rank],
+                          self.batch_size, self.pull_every, self.compressor,
+                          self.error_feedback, seed + rank, results, policies[rank + 1]))
+                worker.daemon = True
+                start_worker(worker, policies[rank + 1])
+                workers.append(worker)
+
+            worker_results = _collect_results(results, workers)
+            for worker in workers:
+                worker.join()
+            self.train_time = time.perf_counter() - start_time
+
+            conn = Client(address, authkey=authkey)
+            conn.send(('stats',))
+            version, params, stats = conn.recv()
+            conn.send(('done',))
+            conn.close()
+            server.join()
+        finally:
+            for process in workers + [server]:
+                if process is not None and process.is_alive():
+                    process.terminate()
+                    process.join()
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+        # Load the final parameters, and average the batch normalization
+        # running averages of the workers
+        flat.load(params)
+        for k, v in flat.param_views.items():
+            self.model.params[k] = v
+        for i, bn_param in enumerate(batchnorm_params(self.model)):
+            for name in worker_results[0][0][i]:
+                running = np.mean([r[0][i][name] for r in worker_results], axis=0)
+                bn_param[name] = running.astype(worker_results[0][0][i][name].dtype)
+
+        self.loss_history = stats.pop('loss_history')
+        stats['compression'] = stats['bytes'] / max(stats['dense_bytes'], 1)
+        stats['compute_time'] = sum(r[1] for r in worker_results)
+        self.stats = stats
+        self.examples_per_sec = num_steps * self.batch_size / max(self.train_time, 1e-12)
+        self.val_acc = forward_accuracy(self.model, self.X_val, self.y_val)
+        if self.verbose:
+            print('%d updates (%d rejected), %.1f examples / sec, compression %.4f, val_acc: %f' % (
+                  stats['pushes'], stats['rejected'], self.examples_per_sec,
+                  stats['compression'], self.val_acc))
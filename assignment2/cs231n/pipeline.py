@@ -0,0 +1,354 @@
+from __future__ import division
+from builtins import range
+from builtins import object
+import copy
+from multiprocessing.connection import wait
+import time
+
+import numpy as np
+
+from cs231n.bn_utils import accumulate_batch_stats, apply_batch_stats, running_stats
+from cs231n.layers import softmax_loss
+from cs231n.threading_policy import (apply_policy, start_worker, worker_context,
+                                     worker_policies)
+
+
+"""
+This file implements pipeline-parallel training of a FullyConnectedNet, in
+the style of GPipe.
+
+The layers of the network are split into contiguous stages, one per worker
+process. A stage holds only the parameters of its own layers, and only its
+own layers' caches. Each minibatch is cut into micro-batches that
+stream through the stages: stage 0 runs the forward pass of micro-batch 1
+while stage 1 runs micro-batch 0, and so on. The activations travel to the
+next stage over a pipe. Once a stage has forwarded every micro-batch, it runs
+their backward passes in reverse order. The gradients with respect to its
+inputs travel back to the previous stage, and the parameter gradients of the
+micro-batches are summed, weighted by their sizes. The last stage computes
+the softmax loss. At the end of the minibatch every stage sends its
+gradients to the training process, which applies a single update:
+
+    pipeline = PipelineParallel(model, num_stages=4, num_microbatches=8)
+    loss, grads = pipeline.loss(X_batch, y_batch)
+    ...
+    pipeline.close()
+
+The stages are chosen by partition_layers so that the largest stage cost is
+as small as possible. By default the cost of each layer is estimated from
+its size (see layer_costs). Passing a sample batch as profile_batch measures
+the cost of each layer instead.
+
+Batch normalization normalizes every micro-batch with its own statistics.
+The running averages get a single momentum update per minibatch, with the
+mean of the micro-batch statistics, as with accumulate_steps in solver.py.
+
+Every stage applies a threading policy when it starts (see
+threading_policy.py); by default the cores are split evenly between the
+stages.
+
+Passing pipeline_stages=N to a Solver trains with N stages.
+"""
+
+
+def _layer_param_names(model, l):
+    return [name + str(l) for name in ('W', 'b', 'gamma', 'beta')
+            if name + str(l) in model.params]
+
+
+def _set_train_mode(model):
+    if model.use_dropout:
+        model.dropout_param['mode'] = 'train'
+    for bn_param in model.bn_params:
+        bn_param['mode'] = 'train'
+
+
+def layer_costs(model, X=None, num_trials=3):
+    """
+    Estimate the cost of a training step of each layer of a FullyConnectedNet.
+
+    Inputs:
+    - model: A FullyConnectedNet
+    - X: Optional sample batch. If given, the costs are the measured times of
+      the forward and backward passes of each layer on X, the best of
+      num_trials; otherwise they are the estimated floating point operations
+      per example: six per weight for the matrix products of the forward and
+      backward passes, plus a few per output for the other layers.
+    - num_trials: Number of timed passes when X is given
+
+    Returns:
+    - costs: List of num_layers costs, the first for layer 1
+    """
+    L = model.num_layers
+    if X is None:
+        costs = []
+        for l in range(1, L + 1):
+            W = model.params['W' + str(l)]
+            costs.append(6 * W.size + (20 * W.shape[1] if l < L else 0))
+        return costs
+
+    # Measure on a copy so the running averages of the model are untouched
+    model = copy.deepcopy(model)
+    _set_train_mode(model)
+    costs = [float('inf')] * L
+    for _ in range(num_trials):
+        x, caches, elapsed = X.astype(model.dtype, copy=False), {}, {}
+        for l in range(1, L + 1):
+            start = time.perf_counter()
+            x, caches[l] = model.layer_forward(l, x)
+            elapsed[l] = time.perf_counter() - start
+        dout = np.ones_like(x) / x.shape[0]
+        for l in range(L, 0, -1):
+            start = time.perf_counter()
+            dout, _ = model.layer_backward(l, dout, caches[l])
+            elapsed[l] += time.perf_counter() - start
+        costs = [min(c, elapsed[l + 1]) for l, c in enumerate(costs)]
+    return costs
+
+
+def partition_layers(costs, num_stages):
+    """
+    Split a sequence of layers into contiguous stages so that the largest
+    total cost of a stage is as small as possible.
+
+    Inputs:
+    - costs: List of the costs of the layers
+    - num_stages: Number of stages; at most len(costs)
+
+    Returns:
+    - stages: List of num_stages lists of layer indices, counting from 1
+    """
+    L = len(costs)
+    if not 1 <= num_stages <= L:
+        raise ValueError('Cannot split %d layers into %d stages' % (L, num_stages))
+    prefix = np.concatenate([[0.0], np.cumsum(costs)])
+
+    # best[s, i]: smallest largest stage cost splitting the first i layers
+    # into s stages; split[s, i]: where the last of those stages starts
+    best = np.full((num_stages + 1, L + 1), np.inf)
+    split = np.zeros((num_stages + 1, L + 1), dtype=int)
+    best[0, 0] = 0.0
+    for s in range(1, num_stages + 1):
+        for i in range(s, L + 1):
+            for j in range(s - 1, i):
+                cost = max(best[s - 1, j], prefix[i] - prefix[j])
+                if cost < best[s, i]:
+                    best[s, i], split[s, i] = cost, j
+
+    stages, i = [], L
+    for s in range(num_stages, 0, -1):
+        j = split[s, i]
+        stages.append(list(range(j + 1, i + 1)))
+        i = j
+    return stages[::-1]
+
+
+def _stage_worker(model, layers, ctrl, prev_conn, next_conn, seed, policy):
+    """
+    Loop of a stage process. It applies the threading policy, then for every
+    minibatch it receives the parameters of its layers on ctrl, forwards the
+    micro-batches arriving on prev_conn to next_conn, backpropagates the
+    gradients arriving on next_conn to prev_conn, and sends the loss, the
+    gradients of its parameters and its batch normalization running averages
+    back on ctrl. None ends the loop.
+    """
+    apply_policy(policy)
+    np.random.seed(seed)
+    last = layers[-1] == model.num_layers
+    bn_params = [model.bn_params[l - 1] for l in layers if l < model.num_layers and model.use_batchnorm]
+
+    while True:
+        task = ctrl.recv()
+        if task is None:
+            break
+        params, stats, weights, y_chunks = task
+        try:
+            model.params = params
+            for bn_param, s in zip(bn_params, stats):
+                bn_param.update(s)
+            _set_train_mode(model)
+            start_stats = running_stats(bn_params)
+            batch_stats = [{} for _ in bn_params]
+
+            caches, douts, loss = [], [], 0.0
+            for m, w in enumerate(weights):
+                x = prev_conn.recv()
+                prev_stats = running_stats(bn_params)
+                cache = {}
+                for l in layers:
+                    x, cache[l] = model.layer_forward(l, x)
+                caches.append(cache)
+                accumulate_batch_stats(bn_params, prev_stats, batch_stats, w)
+                if last:
+                    data_loss, dout = softmax_loss(x, y_chunks[m])
+                    loss += w * data_loss
+                    douts.append(dout)
+                else:
+                    next_conn.send(x)
+
+            grads = {}
+            for m in reversed(range(len(weights))):
+                dout = douts[m] if last else next_conn.recv()
+                for l in reversed(layers):
+                    dout, layer_grads = model.layer_backward(l, dout, caches[m][l])
+                    for k, g in layer_grads.items():
+                        if k in grads:
+                            grads[k] += weights[m] * g
+                        else:
+                            grads[k] = weights[m] * g
+                caches[m] = None
+                if layers[0] > 1:
+                    prev_conn.send(dout)
+
+            for l in layers:
+                W = model.params['W' + str(l)]
+                loss += 0.5 * model.reg * np.sum(W * W)
+                grads['W' + str(l)] += model.reg * W
+
+            apply_batch_stats(bn_params, start_stats, batch_stats)
+            ctrl.send((loss, grads, running_stats(bn_params)))
+        except Exception as e:
+            ctrl.send(e)
+
+
+class PipelineParallel(object):
+    """
+    Computes the loss and gradients of a FullyConnectedNet on minibatches by
+    streaming micro-batches through stage processes.
+
+    Attributes:
+    - stages: List with the layer indices of each stage.
+    """
+
+    def __init__(self, model, num_stages, num_microbatches=4, costs=None,
+                 profile_batch=None, seed=None, policies=None):
+        """
+        Inputs:
+        - model: A FullyConnectedNet
+        - num_stages: Number of stage processes
+        - num_microbatches: Number of micro-batches each minibatch is cut into
+        - costs: Optional list of layer costs for partition_layers; by default
+          they come from layer_costs(model, profile_batch)
+        - profile_batch: Optional sample batch to measure the layer costs on
+        - seed: Seed of the stages' random states, which are seeded with
+          seed + stage; if None it is drawn from the global numpy random state.
+        - policies: Optional list of the threading policies of the stages;
+          by default worker_policies(num_stages).
+        """
+        if not hasattr(model, 'layer_forward'):
+            raise ValueError('PipelineParallel requires a FullyConnectedNet')
+        self.model = model
+        self.num_microbatches = num_microbatches
+        if costs is None:
+            costs = layer_costs(model, profile_batch)
+        self.stages = partition_layers(costs, num_stages)
+        if seed is None:
+            seed = np.random.randint(2 ** 31 - num_stages)
+        if policies is None:
+            policies = worker_policies(num_stages)
+
+        self.param_names = []
+        self.controls = []
+        self.processes = []
+        ctx = worker_context()
+        prev_pipe = ctx.Pipe()
+        self.feed = prev_pipe[0]
+        for s, layers in enumerate(self.stages):
+            names = [k for l in layers for k in _layer_param_names(model, l)]
+            self.param_names.append(names)
+
+            # The stage gets a copy of the model holding only its own
+            # parameters
+            stage_model = copy.copy(model)
+            stage_model.params = {k: model.params[k] for k in names}
+            stage_model.bn_params = copy.deepcopy(model.bn_params)
+            stage_model.dropout_param = copy.deepcopy(model.dropout_param)
+            stage_model.sparse_params = copy.deepcopy(model.sparse_params)
+
+            ctrl, child_ctrl = ctx.Pipe()
+            next_pipe = ctx.Pipe() if s < num_stages - 1 else (None, None)
+            process = ctx.Process(
+                target=_stage_worker,
+                args=(stage_model, layers, child_ctrl, prev_pipe[1], next_pipe[0], seed + s,
+                      policies[s]))
+            process.daemon = True
+            start_worker(process, policies[s])
+            self.controls.append(ctrl)
+            self.processes.append(process)
+            prev_pipe = (None, next_pipe[1])
+
+
+    def _stage_bn_params(self, layers):
+        model = self.model
+        if not model.use_batchnorm:
+            return []
+        return [model.bn_params[l - 1] for l in layers if l < model.num_layers]
+
+
+    def loss(self, X, y):
+        """
+        Compute the loss and gradients of the model on a minibatch, and update
+        its batch normalization running averages.
+
+        Inputs:
+        - X: Array of input data of shape (N, d_1, ..., d_k)
+        - y: Array of labels of shape (N,)
+
+        Returns a tuple of:
+        - loss: Scalar giving the loss
+        - grads: Dictionary mapping parameter names to gradients
+        """
+        N = X.shape[0]
+        num_microbatches = min(self.num_microbatches, N)
+        X_chunks = np.array_split(X.astype(self.model.dtype, copy=False), num_microbatches)
+        y_chunks = np.array_split(y, num_microbatches)
+        weights = [len(chunk) / N for chunk in y_chunks]
+
+        last = len(self.stages) - 1
+        for s, (ctrl, layers) in enumerate(zip(self.controls, self.stages)):
+            params = {k: self.model.params[k] for k in self.param_names[s]}
+            stats = running_stats(self._stage_bn_params(layers))
+            ctrl.send((params, stats, weights, y_chunks if s == last else None))
+        for chunk in X_chunks:
+            self.feed.send(chunk)
+
+        # A stage that fails leaves its neighbours waiting on their pipes, so
+        # the first error stops the whole pipeline
+        loss, grads = 0.0, {}
+        pending = dict(zip(self.controls, self.stages))
+        while pending:
+            for ctrl in wait(list(pending)):
+                result = ctrl.recv()
+                if isinstance(result, Exception):
+                    self.terminate()
+                    raise result
+                stage_loss, stage_grads, stage_stats = result
+                loss += stage_loss
+                grads.update(stage_grads)
+                for bn_param, stats in zip(self._stage_bn_params(pending.pop(ctrl)), stage_stats):
+                    bn_param.update(stats)
+        return loss, grads
+
+
+    def close(self):
+        """
+        Stop the stage processes.
+        """
+        for ctrl in self.controls:
+            try:
+                ctrl.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join()
+        self.controls, self.processes = [], []
+
+
+    def terminate(self):
+        """
+        Kill the stage processes without waiting for them to finish.
+        """
+        for process in self.processes:
+            process.terminate()
+            process.join()
+        self.controls, self.processes = [], []
@@ -0,0 +1,378 @@
+from __future__ import division
+from builtins import object
+import functools
+import importlib
+import json
+import sys
+import threading
+import time
+
+
+"""
+This file implements opt-in instrumentation of the layer functions.
+
+A LayerProfiler records, for every forward and backward function in
+layers.py, fast_layers.py and rnn_layers.py, the number of calls, the wall
+time spent in it and an estimate of the floating point operations it
+performed, from which it reports the achieved GFLOP/s:
+
+    profiler = LayerProfiler(trace=True)
+    with profiler:
+        loss, grads = model.loss(X, y)
+    profiler.print_report()
+    profiler.save_chrome_trace('trace.json')
+
+While a profiler is active, every reference to a layer function held by a
+loaded cs231n module (including the names that the classifiers imported with
+"from cs231n.layers import *") is replaced by a timing wrapper; the original
+functions are put back when it stops. Nothing is wrapped while no profiler is
+active, so the layers run at full speed.
+
+Times are inclusive: a function that calls other layer functions, such as
+rnn_forward calling rnn_step_forward or max_pool_forward_fast calling
+max_pool_forward_reshape, includes their time, and both are reported. The
+Chrome trace (open it in chrome://tracing or Perfetto) shows the nesting.
+
+A Solver or CaptioningSolver constructed with profiler=LayerProfiler() runs
+train() under the profiler and records the number of examples it trained on
+per second of wall time.
+"""
+
+
+# Modules whose forward, backward and loss functions are instrumented; those
+# that do not exist in this package are skipped.
+_PROFILED_MODULES = ('cs231n.layers', 'cs231n.fast_layers', 'cs231n.rnn_layers')
+
+
+def _affine_forward_flops(args, out):
+    x, w = args[0], args[1]
+    return 2 * x.shape[0] * w.size
+
+
+def _affine_backward_flops(args, out):
+    dout, dw = args[0], out[1]
+    return 4 * dout.shape[0] * dw.size
+
+
+def _conv_forward_flops(args, out):
+    w = args[1]
+    return 2 * out[0].size * w[0].size
+
+
+def _conv_backward_flops(args, out):
+    dout, dw = args[0], out[1]
+    return 4 * dout.size * dw[0].size
+
+
+def _pool_forward_flops(args, out):
+    pool_param = args[1]
+    return out[0].size * pool_param['pool_height'] * pool_param['pool_width']
+
+
+def _pool_backward_flops(args, out):
+    return 2 * out.size
+
+
+def _recurrent_forward_flops(args, out):
+    # x is (N, D) for a single step or (N, T, D) for a sequence
+    x, Wx, Wh = args[0], args[-3], args[-2]
+    return 2 * (x.size // x.shape[-1]) * (Wx.size + Wh.size)
+
+
+def _recurrent_backward_flops(args, out):
+    dout, dWx, dWh = args[0], out[-3], out[-2]
+    return 4 * (dout.size // dout.shape[-1]) * (dWx.size + dWh.size)
+
+
+def _temporal_affine_forward_flops(args, out):
+    x, w = args[0], args[1]
+    return 2 * (x.size // x.shape[-1]) * w.size
+
+
+def _temporal_affine_backward_flops(args, out):
+    dout, dw = args[0], out[1]
+    return 4 * (dout.size // dout.shape[-1]) * dw.size
+
+
+def _elementwise_flops(k):
+    def flops(args, out):
+        return k * args[0].size
+    return flops
+
+
+# Estimated floating point operations of each layer function, computed from
+# its arguments and its return value. Matrix products count two operations per
+# multiply-add; the other layers a rough number of operations per element.
+FLOP_ESTIMATORS = {
+    'affine_forward': _affine_forward_flops,
+    'affine_backward': _affine_backward_flops,
+    'affine_forward_sparse': _affine_forward_flops,
+    'affine_backward_sparse': _affine_backward_flops,
+    'relu_forward': _elementwise_flops(1),
+    'relu_backward': _elementwise_flops(1),
+    'batchnorm_forward': _elementwise_flops(8),
+    'batchnorm_backward': _elementwise_flops(12),
+    'batchnorm_backward_alt': _elementwise_flops(10),
+    'spatial_batchnorm_forward': _elementwise_flops(8),
+    'spatial_batchnorm_backward': _elementwise_flops(12),
+    'dropout_forward': _elementwise_flops(2),
+    'dropout_backward': _elementwise_flops(1),
+    'conv_forward_naive': _conv_forward_flops,
+    'conv_backward_naive': _conv_backward_flops,
+    'conv_forward_im2col': _conv_forward_flops,
+    'conv_backward_im2col': _conv_backward_flops,
+    'conv_forward_strides': _conv_forward_flops,
+    'conv_backward_strides': _conv_backward_flops,
+    'max_pool_forward_naive': _pool_forward_flops,
+    'max_pool_backward_naive': _pool_backward_flops,
+    'max_pool_forward_fast': _pool_forward_flops,
+    'max_pool_backward_fast': _pool_backward_flops,
+    'max_pool_forward_reshape': _pool_forward_flops,
+    'max_pool_backward_reshape': _pool_backward_flops,
+    'max_pool_forward_im2col': _pool_forward_flops,
+    'max_pool_backward_im2col': _pool_backward_flops,
+    'svm_loss': _elementwise_flops(4),
+    'svm_loss_fast': _elementwise_flops(4),
+    'softmax_loss': _elementwise_flops(5),
+    'softmax_loss_fast': _elementwise_flops(5),
+    'softmax_loss_chunked': _elementwise_flops(5),
+    'rnn_step_forward': _recurrent_forward_flops,
+    'rnn_step_backward': _recurrent_backward_flops,
+    'rnn_forward': _recurrent_forward_flops,
+    'rnn_backward': _recurrent_backward_flops,
+    'lstm_step_forward': _recurrent_forward_flops,
+    'lstm_step_backward': _recurrent_backward_flops,
+    'lstm_forward': _recurrent_forward_flops,
+    'lstm_backward': _recurrent_backward_flops,
+    'word_embedding_forward': _elementwise_flops(0),
+    'word_embedding_backward': _elementwise_flops(1),
+    'temporal_affine_forward': _temporal_affine_forward_flops,
+    'temporal_affine_backward': _temporal_affine_backward_flops,
+    'temporal_softmax_loss': _elementwise_flops(5),
+}
+
+
+def _is_layer_function(name, value):
+    return (callable(value) and not name.startswith('_') and
+            (name.endswith('_forward') or name.endswith('_backward') or
+             '_forward_' in name or '_backward_' in name or '_loss' in name))
+
+
+def layer_functions():
+    """
+    Return a dictionary mapping the names of the instrumented layer functions
+    to the functions.
+    """
+    functions = {}
+    for module_name in _PROFILED_MODULES:
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError:
+            continue
+        for name, value in vars(module).items():
+            if _is_layer_function(name, value) and value.__module__ == module_name:
+                functions[value.__name__] = value
+    return functions
+
+
+def patch_layer_functions(make_wrapper):
+    """
+    Replace every reference that a loaded cs231n module holds to a layer
+    function with make_wrapper(name, function).
+
+    Returns:
+    - patches: List of (module, attribute, original) triples for
+      restore_layer_functions.
+    """
+    wrappers = {}
+    for name, func in layer_functions().items():
+        wrappers[func] = make_wrapper(name, func)
+    patches = []
+    for module_name, module in list(sys.modules.items()):
+        if module is None or not module_name.startswith('cs231n'):
+            continue
+        for attr, value in list(vars(module).items()):
+            try:
+                wrapper = wrappers.get(value)
+            except TypeError:
+                continue
+            if wrapper is not None:
+                setattr(module, attr, wrapper)
+                patches.append((module, attr, value))
+    return patches
+
+
+def restore_layer_functions(patches):
+    """
+    Undo patch_layer_functions.
+    """
+    for module, attr, value in reversed(patches):
+        setattr(module, attr, value)
+
+
+class LayerProfiler(object):
+    """
+    Records the calls, time and estimated FLOPs of the layer functions while
+    it is active.
+
+    Attributes:
+    - stats: Dictionary mapping function names to dictionaries with 'calls',
+      'time' (seconds) and 'flops'.
+    - runs: List of dictionaries describing the solver runs recorded with
+      record_run, with their 'examples_per_sec'.
+    - events: List of trace events, if trace is True.
+    """
+
+    def __init__(self, trace=False):
+        """
+        Inputs:
+        - trace: If True, keep a timestamped event for every call, for
+          save_chrome_trace.
+        """
+        self.trace = trace
+        self.stats = {}
+        self.runs = []
+        self.events = []
+        self._patches = None
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+
+
+    def _wrap(self, name, func):
+        estimate = FLOP_ESTIMATORS.get(name)
+        clock = time.perf_counter
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            out = func(*args, **kwargs)
+            elapsed = clock() - start
+            flops = 0
+            if estimate is not None:
+                try:
+                    flops = int(estimate(args, out))
+                except (AttributeError, IndexError, KeyError, TypeError):
+                    flops = 0
+            self._record(name, start, elapsed, flops)
+            return out
+        return wrapper
+
+
+    def _record(self, name, start, elapsed, flops):
+        with self._lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = {'calls': 0, 'time': 0.0, 'flops': 0}
+            stat['calls'] += 1
+            stat['time'] += elapsed
+            stat['flops'] += flops
+            if self.trace:
+                self.events.append({
+                    'name': name, 'ph': 'X', 'pid': 0,
+                    'cat': 'backward' if 'backward' in name else 'forward',
+                    'tid': threading.current_thread().ident,
+                    'ts': (start - self._t0) * 1e6, 'dur': elapsed * 1e6,
+                    'args': {'flops': flops},
+                })
+
+
+    def start(self):
+        """
+        Start instrumenting the layer functions.
+        """
+        if self._patches is None:
+            self._patches = patch_layer_functions(self._wrap)
+
+
+    def stop(self):
+        """
+        Put the original layer functions back.
+        """
+        if self._patches is not None:
+            restore_layer_functions(self._patches)
+            self._patches = None
+
+
+    def __enter__(self):
+        self.start()
+        return self
+
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+    def reset(self):
+        """
+        Clear the recorded statistics.
+        """
+        self.stats = {}
+        self.runs = []
+        self.events = []
+
+
+    def record_run(self, name, num_examples, elapsed, **info):
+        """
+        Record the throughput of a training run.
+
+        Inputs:
+        - name: Name of the run, such as the model class
+        - num_examples: Number of training examples processed
+        - elapsed: Wall time of the run in seconds
+        - info: Other values to store with the run
+        """
+        run = dict(info, name=name, examples=num_examples, time=elapsed,
+                   examples_per_sec=num_examples / elapsed if elapsed > 0 else 0.0)
+        self.runs.append(run)
+        return run
+
+
+    def report(self):
+        """
+        Summarize the recorded statistics.
+
+        Returns:
+        - rows: List of dictionaries, one per layer function and sorted by
+          decreasing time, with 'name', 'calls', 'time', 'time_per_call',
+          'flops' and 'gflops_per_sec'.
+        """
+        rows = []
+        for name, stat in self.stats.items():
+            t = stat['time']
+            rows.append({
+                'name': name, 'calls': stat['calls'], 'time': t,
+                'time_per_call': t / stat['calls'], 'flops': stat['flops'],
+                'gflops_per_sec': stat['flops'] / t / 1e9 if t > 0 else 0.0,
+            })
+        rows.sort(key=lambda row: -row['time'])
+        return rows
+
+
+    def print_report(self):
+        """
+        Print the report as a table.
+        """
+        print('%-28s %8s %10s %12s %10s' % ('layer', 'calls', 'time (s)', 'ms / call', 'GFLOP/s'))
+        for row in self.report():
+            print('%-28s %8d %10.4f %12.4f %10.2f' % (
+                  row['name'], row['calls'], row['time'],
+                  1000 * row['time_per_call'], row['gflops_per_sec']))
+        for run in self.runs:
+            print('%s: %.1f examples / sec' % (run['name'], run['examples_per_sec']))
+
+
+    def save_json(self, filename):
+        """
+        Write the report and the recorded runs to a JSON file.
+        """
+        with open(filename, 'w') as f:
+            json.dump({'layers': self.report(), 'runs': self.runs}, f, indent=2)
+
+
+    def save_chrome_trace(self, filename):
+        """
+        Write the trace events to a file in the Chrome trace event format.
+        Requires trace=True.
+        """
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
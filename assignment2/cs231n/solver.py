@@ -5,10 +5,29 @@ from builtins import range
 from builtins import object
 import os
 import pickle as pickle
+import time
 
 import numpy as np
 
 from cs231n import optim
+from cs231n.async_eval import AsyncEvaluator
+from cs231n.batch_tuner import autotune_batch_size
+from cs231n.bn_utils import (accumulate_batch_stats, apply_batch_stats, batchnorm_params,
+                             running_stats)
+from cs231n.checkpoint import CheckpointWriter, checkpoint_arrays
+from cs231n.data_parallel import DataParallel
+from cs231n.flat_params import FlatParams, flatten_model_params
+from cs231n.mixed_precision import DynamicLossScaler
+from cs231n.pipeline import PipelineParallel
+from cs231n.prefetch import MinibatchPrefetcher
+from cs231n.sampler import MinibatchSampler
+from cs231n.threading_policy import applied_policy, solver_worker_policies
+
+
+# Keys of the threading_policy of a Solver
+_THREADING_POLICY_KEYS = ('blas_threads', 'intra_op_threads', 'cores',
+                          'worker_blas_threads', 'worker_intra_op_threads',
+                          'pin_workers')
 
 
 class Solver(object):
@@ -31,7 +50,9 @@ class Solver(object):
     In addition, the instance variable solver.loss_history will contain a list
     of all losses encountered during training and the instance variables
     solver.train_acc_history and solver.val_acc_history will be lists of the
-    accuracies of the model on the training and validation set at each epoch.
+    accuracies of the model on the training and validation set at each epoch;
+    solver.acc_iterations gives the iteration each of those accuracies was
+    measured after.
 
     Example usage might look something like this:
 
@@ -101,7 +122,13 @@ class Solver(object):
         - lr_decay: A scalar for learning rate decay; after each epoch the
           learning rate is multiplied by this value.
         - batch_size: Size of minibatches used to compute loss and gradient
-          during training.
+          during training. If 'auto', the batch size with the best throughput
+          under memory_budget is found by probing the model (see
+          batch_tuner.py); the probes are kept in batch_size_probes.
+        - memory_budget: Memory budget in bytes of a training step, used with
+          batch_size='auto'.
+        - autotune_config: A dictionary of keyword arguments for
+          autotune_batch_size, such as 'max_batch_size' and 'num_steps'.
         - num_epochs: The number of epochs to run for during training.
         - print_every: Integer; training losses will be printed every
           print_every iterations.
@@ -113,6 +140,76 @@ class Solver(object):
           accuracy; default is None, which uses the entire validation set.
         - checkpoint_name: If not None, then save model checkpoints here every
           epoch.
+        - compact_checkpoints: If True, checkpoints hold only the parameters,
+          optimizer state, batch normalization running averages and counters,
+          and are written to .npz files on a background thread (see
+          checkpoint.py) instead of pickling the model synchronously. The
+          best parameters are also written to '<checkpoint_name>_best.npz'.
+        - checkpoint_keep: Number of compact epoch checkpoints kept on disk;
+          default is 3, None keeps all of them.
+        - flat_params: If True, move the model parameters into a single flat
+          buffer (see flat_params.py) so that each update is one call to the
+          update rule on one array, and best-parameter snapshots and compact
+          checkpoints are one copy of it. model.params keeps its names and
+          shapes but holds views into the buffer.
+        - mixed_precision: If True, train a model built with dtype=np.float16
+          in mixed precision (see mixed_precision.py): the update rule runs on
+          float32 master copies of the parameters, and the model's loss_scale
+          is adjusted dynamically, skipping steps whose gradients overflow.
+        - loss_scale_config: A dictionary of keyword arguments for the
+          DynamicLossScaler used with mixed_precision, such as 'init_scale'
+          and 'growth_interval'.
+        - accumulate_steps: Number of micro-batches of batch_size examples
+          whose gradients are averaged before each update, giving an effective
+          batch size of batch_size * accumulate_steps while only one
+          micro-batch is held in memory at a time. Batch normalization running
+          averages are updated once per update, with the mean of the
+          micro-batch statistics.
+        - sample_with_replacement: If True, draw every minibatch independently
+          with replacement. By default each epoch walks through a random
+          permutation of the training set (see sampler.py).
+        - sort_batches: If True, sort the indices within each minibatch so the
+          rows of X_train are read in order.
+        - prefetch: Number of minibatches to sample ahead on a background
+          thread (see prefetch.py), gathered into preallocated buffers and
+          converted to model.dtype while the current step computes. The
+          default of 0 samples each minibatch synchronously.
+        - prefetch_seed: Seed for the prefetching thread's sampler; if None it
+          is drawn from the global numpy random state.
+        - profiler: An optional LayerProfiler (see profiler.py) that train()
+          runs under, recording the time and estimated FLOPs of every layer
+          function and the throughput of the run.
+        - async_eval: If True, check accuracy in a worker process (see
+          async_eval.py) while training continues. A snapshot of the model is
+          sent to the worker at every check, and its accuracies are appended
+          to the histories when they arrive, tagged with their iteration in
+          acc_iterations. train() waits for the last results before returning.
+        - eval_batch_size: Number of examples scored at a time when checking
+          accuracy.
+        - data_parallel: Number of worker processes that split every minibatch
+          between them (see data_parallel.py), sharing the training data and
+          the parameters through shared memory. The workers run for the
+          duration of each call to train(). The default of 0 computes the
+          loss in this process. Cannot be combined with prefetch or
+          mixed_precision.
+        - data_parallel_seed: Seed of the workers' random states; if None it is
+          drawn from the global numpy random state.
+        - pipeline_stages: Number of processes that the layers of a
+          FullyConnectedNet are split across (see pipeline.py), each holding
+          only the parameters and caches of its own layers, with micro-batches
+          streaming through them. The stages run for the duration of each
+          call to train(). The default of 0 computes the loss in this
+          process. Cannot be combined with data_parallel or mixed_precision.
+        - pipeline_microbatches: Number of micro-batches each minibatch is cut
+          into for pipeline_stages; default is 4.
+        - threading_policy: An optional dictionary controlling threads (see
+          threading_policy.py). 'blas_threads', 'intra_op_threads' and 'cores'
+          are applied to this process while train() runs (and while the batch
+          size is autotuned), and the previous settings restored afterwards;
+          'worker_blas_threads', 'worker_intra_op_threads' and 'pin_workers'
+          set the policies of the processes started for async_eval,
+          data_parallel and pipeline_stages, whose cores are split evenly
+          between them.
         """
         self.model = model
         self.X_train = data['X_train']
@@ -125,13 +222,33 @@ class Solver(object):
         self.optim_config = kwargs.pop('optim_config', {})
         self.lr_decay = kwargs.pop('lr_decay', 1.0)
         self.batch_size = kwargs.pop('batch_size', 100)
+        self.memory_budget = kwargs.pop('memory_budget', None)
+        self.autotune_config = kwargs.pop('autotune_config', {})
         self.num_epochs = kwargs.pop('num_epochs', 10)
         self.num_train_samples = kwargs.pop('num_train_samples', 1000)
         self.num_val_samples = kwargs.pop('num_val_samples', None)
 
         self.checkpoint_name = kwargs.pop('checkpoint_name', None)
+        self.compact_checkpoints = kwargs.pop('compact_checkpoints', False)
+        self.checkpoint_keep = kwargs.pop('checkpoint_keep', 3)
         self.print_every = kwargs.pop('print_every', 10)
         self.verbose = kwargs.pop('verbose', True)
+        self.flat_params = kwargs.pop('flat_params', False)
+        self.mixed_precision = kwargs.pop('mixed_precision', False)
+        self.loss_scale_config = kwargs.pop('loss_scale_config', {})
+        self.accumulate_steps = kwargs.pop('accumulate_steps', 1)
+        self.sample_with_replacement = kwargs.pop('sample_with_replacement', False)
+        self.sort_batches = kwargs.pop('sort_batches', False)
+        self.prefetch = kwargs.pop('prefetch', 0)
+        self.prefetch_seed = kwargs.pop('prefetch_seed', None)
+        self.profiler = kwargs.pop('profiler', None)
+        self.async_eval = kwargs.pop('async_eval', False)
+        self.eval_batch_size = kwargs.pop('eval_batch_size', 1000)
+        self.data_parallel = kwargs.pop('data_parallel', 0)
+        self.data_parallel_seed = kwargs.pop('data_parallel_seed', None)
+        self.pipeline_stages = kwargs.pop('pipeline_stages', 0)
+        self.pipeline_microbatches = kwargs.pop('pipeline_microbatches', 4)
+        self.threading_policy = kwargs.pop('threading_policy', None)
 
         # Throw an error if there are extra keyword arguments
         if len(kwargs) > 0:
@@ -144,9 +261,43 @@ class Solver(object):
             raise ValueError('Invalid update_rule "%s"' % self.update_rule)
         self.update_rule = getattr(optim, self.update_rule)
 
+        if self.mixed_precision and not hasattr(self.model, 'loss_scale'):
+            raise ValueError('mixed_precision requires a model with a loss_scale attribute')
+        if self.data_parallel > 0 and (self.prefetch > 0 or self.mixed_precision):
+            raise ValueError('data_parallel cannot be combined with prefetch or mixed_precision')
+        if self.pipeline_stages > 0 and (self.data_parallel > 0 or self.mixed_precision):
+            raise ValueError('pipeline_stages cannot be combined with data_parallel or mixed_precision')
+        if self.threading_policy is not None:
+            extra = set(self.threading_policy) - set(_THREADING_POLICY_KEYS)
+            if extra:
+                raise ValueError('Unrecognized threading_policy keys %s' % ', '.join(
+                    '"%s"' % k for k in sorted(extra)))
+
+        self.batch_size_probes = None
+        if self.batch_size == 'auto':
+            with applied_policy(self.threading_policy):
+                self._autotune_batch_size()
+
         self._reset()
 
 
+    def _autotune_batch_size(self):
+        """
+        Set batch_size to the one recommended by autotune_batch_size.
+        """
+        if self.memory_budget is None:
+            raise ValueError('batch_size="auto" requires a memory_budget')
+        num_train = self.X_train.shape[0]
+        config = dict({'min_batch_size': min(8, num_train), 'max_batch_size': num_train,
+                       'update_rule': self.update_rule}, **self.autotune_config)
+        tuned = autotune_batch_size(self.model, self.X_train.shape[1:],
+                                    self.memory_budget, **config)
+        self.batch_size = tuned['batch_size']
+        self.batch_size_probes = tuned['probes']
+        if self.verbose:
+            print('Using batch size %d' % self.batch_size)
+
+
     def _reset(self):
         """
         Set up some book-keeping variables for optimization. Don't call this
@@ -159,6 +310,88 @@ class Solver(object):
         self.loss_history = []
         self.train_acc_history = []
         self.val_acc_history = []
+        self.acc_iterations = []
+
+        # Pending asynchronous evaluations keep a copy of the parameters they
+        # were taken from, in case they turn out to be the best
+        self.evaluator = None
+        self.eval_snapshots = {}
+        if self.async_eval:
+            self.evaluator = AsyncEvaluator(
+                self.X_train, self.y_train, self.X_val, self.y_val,
+                batch_size=self.eval_batch_size,
+                policy=solver_worker_policies(self.threading_policy, 2)[1])
+
+        self.checkpoint_writer = None
+        if self.checkpoint_name is not None and self.compact_checkpoints:
+            self.checkpoint_writer = CheckpointWriter(self.checkpoint_name,
+                                                      keep_last=self.checkpoint_keep)
+
+        # Minibatches are gathered by a sampler, or by a prefetching thread
+        # that is started by the first minibatch request; data-parallel
+        # workers gather their own shards, so only indices are sampled here.
+        # The workers themselves are started by train().
+        dtype = getattr(self.model, 'dtype', self.X_train.dtype)
+        self.sampler = None
+        self.prefetcher = None
+        self.parallel = None
+        if self.data_parallel > 0:
+            self.sampler = MinibatchSampler(
+                self.X_train.shape[0], self.batch_size,
+                replace=self.sample_with_replacement, sort=self.sort_batches)
+        elif self.prefetch > 0:
+            self.prefetcher = MinibatchPrefetcher(
+                {'X': self.X_train, 'y': self.y_train}, self.batch_size,
+                dtypes={'X': dtype}, depth=self.prefetch, seed=self.prefetch_seed,
+                replace=self.sample_with_replacement, sort=self.sort_batches)
+        else:
+            self.sampler = MinibatchSampler(
+                [self.X_train, self.y_train], self.batch_size,
+                replace=self.sample_with_replacement, sort=self.sort_batches,
+                dtypes=[dtype, None])
+
+        # In mixed precision the update rule works on float32 master copies of
+        # the parameters, and the unscaled gradients are written into
+        # master_grads.
+        self.flat = None
+        self.best_flat = None
+        self.master_params = None
+        self.master_grads = None
+        self.loss_scaler = None
+        if self.mixed_precision:
+            self.loss_scaler = DynamicLossScaler(**self.loss_scale_config)
+            self.model.loss_scale = self.loss_scaler.scale
+            if self.flat_params:
+                self.flat = FlatParams(self.model.params, dtype=np.float32)
+                self.master_params = self.flat.param_views
+                self.master_grads = self.flat.grad_views
+            else:
+                self.master_params = {}
+                self.master_grads = {}
+                for p, w in self.model.params.items():
+                    self.master_params[p] = w.astype(np.float32)
+                    self.master_grads[p] = np.zeros(w.shape, dtype=np.float32)
+        elif self.flat_params:
+            self.flat = flatten_model_params(self.model)
+
+        # The pipeline stages are started by train()
+        self.pipeline = None
+
+        # Buffers that sum the gradients of the micro-batches. They are never
+        # the flat gradient buffer: with flat_params a model such as
+        # Sequential writes each micro-batch's gradients straight into it,
+        # which would overwrite the running sum.
+        self.accum_grads = None
+        if self.accumulate_steps > 1:
+            self.accum_grads = {}
+            for p, w in self.model.params.items():
+                dtype = np.promote_types(w.dtype, np.float32)
+                self.accum_grads[p] = np.zeros(w.shape, dtype=dtype)
+
+        # With flat params a single optim_config covers the whole buffer
+        if self.flat is not None:
+            self.optim_configs = {'__flat__': dict(self.optim_config)}
+            return
 
         # Make a deep copy of the optim_config for each parameter
         self.optim_configs = {}
@@ -172,27 +405,130 @@ class Solver(object):
         Make a single gradient update. This is called by train() and should not
         be called manually.
         """
-        # Make a minibatch of training data
-        num_train = self.X_train.shape[0]
-        batch_mask = np.random.choice(num_train, self.batch_size)
-        X_batch = self.X_train[batch_mask]
-        y_batch = self.y_train[batch_mask]
-
-        # Compute loss and gradient
-        loss, grads = self.model.loss(X_batch, y_batch)
+        # Compute loss and gradient, over several micro-batches if needed
+        if self.accumulate_steps > 1:
+            loss, grads = self._accumulate_loss()
+        else:
+            loss, grads = self._minibatch_loss()
         self.loss_history.append(loss)
 
+        # In mixed precision, unscale the gradients into float32 and skip the
+        # update if any of them overflowed
+        params = self.model.params
+        if self.loss_scaler is not None:
+            grads, finite = self.loss_scaler.unscale(grads, out=self.master_grads)
+            self.loss_scaler.update(finite)
+            self.model.loss_scale = self.loss_scaler.scale
+            if not finite:
+                return
+            params = self.master_params
+
         # Perform a parameter update
-        for p, w in self.model.params.items():
-            dw = grads[p]
-            config = self.optim_configs[p]
-            next_w, next_config = self.update_rule(w, dw, config)
-            self.model.params[p] = next_w
-            self.optim_configs[p] = next_config
+        if self.flat is not None:
+            dw = self.flat.gather_grads(grads)
+            config = self.optim_configs['__flat__']
+            next_w, next_config = self.update_rule(self.flat.params, dw, config)
+            self.flat.load(next_w)
+            self.optim_configs['__flat__'] = next_config
+        else:
+            for p, w in params.items():
+                dw = grads[p]
+                config = self.optim_configs[p]
+                next_w, next_config = self.update_rule(w, dw, config)
+                params[p] = next_w
+                self.optim_configs[p] = next_config
+
+        if self.master_params is not None:
+            self._load_master_params()
+
+
+    def _minibatch_loss(self):
+        """
+        Sample a minibatch of training data and compute the loss and gradients
+        of the model on it.
+        """
+        if self.data_parallel > 0:
+            if self.parallel is None:
+                raise ValueError('data_parallel workers only run inside train()')
+            return self.parallel.loss(self.sampler.indices())
+        if self.prefetcher is not None:
+            batch = self.prefetcher.next()
+            X_batch, y_batch = batch['X'], batch['y']
+        else:
+            X_batch, y_batch = self.sampler.sample()
+
+        if self.pipeline_stages > 0:
+            if self.pipeline is None:
+                raise ValueError('pipeline_stages only run inside train()')
+            return self.pipeline.loss(X_batch, y_batch)
+        if self.loss_scaler is not None:
+            # Overflows are expected now and then; the loss scaler handles them
+            with np.errstate(over='ignore', invalid='ignore'):
+                return self.model.loss(X_batch, y_batch)
+        return self.model.loss(X_batch, y_batch)
+
+
+    def _accumulate_loss(self):
+        """
+        Average the loss and gradients over accumulate_steps micro-batches.
+
+        Each micro-batch moves the batch normalization running averages by one
+        momentum update. The statistics of every micro-batch are recovered from
+        those updates, and the running averages are then set as if a single
+        update had been made with their mean.
+        """
+        k = self.accumulate_steps
+        grads = self.accum_grads
+        bn_params = batchnorm_params(self.model)
+        start_stats = running_stats(bn_params)
+        batch_stats = [{} for _ in bn_params]
+
+        loss = 0.0
+        for i in range(k):
+            prev_stats = running_stats(bn_params)
+            micro_loss, micro_grads = self._minibatch_loss()
+            loss += micro_loss
+            for p, g in micro_grads.items():
+                if i == 0:
+                    np.copyto(grads[p], g)
+                else:
+                    grads[p] += g
+            accumulate_batch_stats(bn_params, prev_stats, batch_stats, 1.0 / k)
+        apply_batch_stats(bn_params, start_stats, batch_stats)
+
+        for g in grads.values():
+            g /= k
+        return loss / k, grads
+
+
+    def _load_master_params(self):
+        """
+        Round the float32 master parameters into model.params.
+        """
+        for p, w in self.master_params.items():
+            self.model.params[p][...] = w
 
 
     def _save_checkpoint(self):
         if self.checkpoint_name is None: return
+        if self.checkpoint_writer is not None:
+            params = self.model.params
+            if self.master_params is not None:
+                params = self.master_params
+            counters = {'epoch': self.epoch, 'iteration': len(self.loss_history),
+                        'best_val_acc': self.best_val_acc}
+            if self.loss_scaler is not None:
+                counters['loss_scale'] = self.loss_scaler.scale
+            layout = None
+            if self.flat is not None:
+                params, layout = self.flat.params, self.flat.layout
+            arrays = checkpoint_arrays(params, self.optim_configs,
+                                       batchnorm_params(self.model), layout=layout,
+                                       **counters)
+            filename = self.checkpoint_writer.save(arrays, self.epoch)
+            if self.verbose:
+                print('Saving checkpoint to "%s"' % filename)
+            return
         checkpoint = {
           'model': self.model,
           'update_rule': self.update_rule,
@@ -233,7 +569,7 @@ class Solver(object):
         # Maybe subsample the data
         N = X.shape[0]
         if num_samples is not None and N > num_samples:
-            mask = np.random.choice(N, num_samples)
+            mask = np.random.choice(N, num_samples, replace=False)
             N = num_samples
             X = X[mask]
             y = y[mask]
@@ -254,53 +590,193 @@ class Solver(object):
         return acc
 
 
+    def _snapshot_params(self, out=None):
+        """
+        Copy the current parameters; in flat mode this is a copy of the flat
+        buffer. If out is given, it is a previous snapshot that is overwritten
+        instead of allocating a new one.
+        """
+        if self.flat is not None:
+            if out is None:
+                return self.flat.params.copy()
+            np.copyto(out, self.flat.params)
+            return out
+        if not out:
+            return {k: v.copy() for k, v in self.model.params.items()}
+        for k, v in self.model.params.items():
+            np.copyto(out[k], v)
+        return out
+
+
+    def _record_accuracy(self, iteration, epoch, train_acc, val_acc, snapshot=None):
+        """
+        Append a pair of accuracies to the histories and keep track of the best
+        model. snapshot holds the parameters the accuracies were measured with;
+        if None, they are the current parameters.
+        """
+        self.train_acc_history.append(train_acc)
+        self.val_acc_history.append(val_acc)
+        self.acc_iterations.append(iteration)
+
+        if self.verbose:
+            print('(Epoch %d / %d) train acc: %f; val_acc: %f' % (
+                   epoch, self.num_epochs, train_acc, val_acc))
+
+        # Keep track of the best model
+        if val_acc > self.best_val_acc:
+            self.best_val_acc = val_acc
+            if snapshot is None:
+                best = self.best_flat if self.flat is not None else self.best_params
+                snapshot = self._snapshot_params(out=best)
+            if self.flat is not None:
+                if snapshot is not self.best_flat:
+                    self.best_flat = snapshot
+                    self.best_params = self.flat.unflatten(snapshot)
+            else:
+                self.best_params = snapshot
+            if self.checkpoint_writer is not None:
+                if self.flat is not None:
+                    best, layout = self.best_flat, self.flat.layout
+                else:
+                    best, layout = self.best_params, None
+                self.checkpoint_writer.save_best(checkpoint_arrays(
+                    best, layout=layout, epoch=epoch, iteration=iteration,
+                    val_acc=val_acc))
+
+
+    def _submit_accuracy(self, iteration):
+        """
+        Send a snapshot of the model to the evaluation worker, evaluating on the
+        same kind of subsets check_accuracy would use.
+        """
+        subsets = []
+        for X, num_samples in ((self.X_train, self.num_train_samples),
+                               (self.X_val, self.num_val_samples)):
+            N = X.shape[0]
+            idx = None
+            if num_samples is not None and N > num_samples:
+                idx = np.random.choice(N, num_samples, replace=False)
+            subsets.append(idx)
+        self.evaluator.submit(self.model, iteration, self.epoch, *subsets)
+        self.eval_snapshots[iteration] = self._snapshot_params()
+
+
+    def _collect_accuracy(self, block=False):
+        """
+        Record the results of finished asynchronous evaluations.
+        """
+        for iteration, epoch, train_acc, val_acc in self.evaluator.poll(block=block):
+            snapshot = self.eval_snapshots.pop(iteration)
+            self._record_accuracy(iteration, epoch, train_acc, val_acc, snapshot)
+
+
     def train(self):
         """
         Run optimization to train the model.
+
+        Afterwards examples_per_sec holds the number of training examples
+        processed per second of wall time, accuracy checks included. The
+        threading_policy only applies for the duration of the call.
         """
+        if self.profiler is None:
+            with applied_policy(self.threading_policy):
+                self._train()
+            return
+        with self.profiler, applied_policy(self.threading_policy):
+            self._train()
+        self.profiler.record_run(type(self.model).__name__, self.num_examples_trained,
+                                 self.train_time, batch_size=self.batch_size)
+        if self.verbose:
+            print('(Training) %.1f examples / sec' % self.examples_per_sec)
+
+
+    def _train(self):
         num_train = self.X_train.shape[0]
-        iterations_per_epoch = max(num_train // self.batch_size, 1)
+        examples_per_step = self.batch_size * self.accumulate_steps
+        iterations_per_epoch = max(num_train // examples_per_step, 1)
         num_iterations = self.num_epochs * iterations_per_epoch
 
-        for t in range(num_iterations):
-            self._step()
-
-            # Maybe print training loss
-            if self.verbose and t % self.print_every == 0:
-                print('(Iteration %d / %d) loss: %f' % (
-                       t + 1, num_iterations, self.loss_history[-1]))
-
-            # At the end of every epoch, increment the epoch counter and decay
-            # the learning rate.
-            epoch_end = (t + 1) % iterations_per_epoch == 0
-            if epoch_end:
-                self.epoch += 1
-                for k in self.optim_configs:
-                    self.optim_configs[k]['learning_rate'] *= self.lr_decay
-
-            # Check train and val accuracy on the first iteration, the last
-            # iteration, and at the end of each epoch.
-            first_it = (t == 0)
-            last_it = (t == num_iterations - 1)
-            if first_it or last_it or epoch_end:
-                train_acc = self.check_accuracy(self.X_train, self.y_train,
-                    num_samples=self.num_train_samples)
-                val_acc = self.check_accuracy(self.X_val, self.y_val,
-                    num_samples=self.num_val_samples)
-                self.train_acc_history.append(train_acc)
-                self.val_acc_history.append(val_acc)
-                self._save_checkpoint()
-
-                if self.verbose:
-                    print('(Epoch %d / %d) train acc: %f; val_acc: %f' % (
-                           self.epoch, self.num_epochs, train_acc, val_acc))
-
-                # Keep track of the best model
-                if val_acc > self.best_val_acc:
-                    self.best_val_acc = val_acc
-                    self.best_params = {}
-                    for k, v in self.model.params.items():
-                        self.best_params[k] = v.copy()
+        # The data-parallel workers and pipeline stages live for one call to
+        # train(), and are shut down even if training raises
+        if self.data_parallel > 0:
+            self.parallel = DataParallel(
+                self.model, self.X_train, self.y_train, self.data_parallel,
+                seed=self.data_parallel_seed,
+                policies=solver_worker_policies(self.threading_policy, self.data_parallel))
+        if self.pipeline_stages > 0:
+            self.pipeline = PipelineParallel(
+                self.model, self.pipeline_stages, self.pipeline_microbatches,
+                policies=solver_worker_policies(self.threading_policy, self.pipeline_stages))
+
+        start_time = time.perf_counter()
+        try:
+            for t in range(num_iterations):
+                self._step()
+
+                # Maybe print training loss
+                if self.verbose and t % self.print_every == 0:
+                    print('(Iteration %d / %d) loss: %f' % (
+                           t + 1, num_iterations, self.loss_history[-1]))
+
+                # At the end of every epoch, increment the epoch counter and
+                # decay the learning rate.
+                epoch_end = (t + 1) % iterations_per_epoch == 0
+                if epoch_end:
+                    self.epoch += 1
+                    for k in self.optim_configs:
+                        self.optim_configs[k]['learning_rate'] *= self.lr_decay
+
+                # Check train and val accuracy on the first iteration, the
+                # last iteration, and at the end of each epoch.
+                first_it = (t == 0)
+                last_it = (t == num_iterations - 1)
+                if first_it or last_it or epoch_end:
+                    if self.evaluator is not None:
+                        self._submit_accuracy(t + 1)
+                    else:
+                        train_acc = self.check_accuracy(self.X_train, self.y_train,
+                            num_samples=self.num_train_samples,
+                            batch_size=self.eval_batch_size)
+                        val_acc = self.check_accuracy(self.X_val, self.y_val,
+                            num_samples=self.num_val_samples,
+                            batch_size=self.eval_batch_size)
+                        self._record_accuracy(t + 1, self.epoch, train_acc, val_acc)
+                    self._save_checkpoint()
+
+                # Record any asynchronous evaluations that have finished
+                if self.evaluator is not None:
+                    self._collect_accuracy()
+        except BaseException:
+            # Stages may be in the middle of a minibatch, waiting on each
+            # other, so they are killed rather than asked to stop
+            if self.pipeline is not None:
+                self.pipeline.terminate()
+            raise
+        finally:
+            if self.parallel is not None:
+                self.parallel.close()
+                self.parallel = None
+            if self.pipeline is not None:
+                self.pipeline.close()
+                self.pipeline = None
+
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+
+        self.train_time = time.perf_counter() - start_time
+        self.num_examples_trained = num_iterations * examples_per_step
+        self.examples_per_sec = self.num_examples_trained / max(self.train_time, 1e-12)
+        if self.evaluator is not None:
+            self._collect_accuracy(block=True)
+            self.evaluator.close()
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.close()
 
         # At the end of training swap the best params into the model
+        if self.flat is not None:
+            if self.best_flat is not None:
+                self.flat.load(self.best_flat)
+                if self.master_params is not None:
+                    self._load_master_params()
+            return
         self.model.params = self.best_params
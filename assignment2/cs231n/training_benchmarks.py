@@ -0,0 +1,233 @@
+from __future__ import print_function, division
+from builtins import range
+import argparse
+import json
+import multiprocessing
+import platform
+import sys
+import time
+
+import numpy as np
+
+from cs231n import intra_op
+from cs231n.threading_policy import (apply_policy, available_cores, get_blas_threads,
+                                     thread_environment)
+
+
+"""
+This file implements end-to-end training throughput benchmarks for the
+models of this package, trained by a Solver on synthetic data shaped like
+CIFAR-10.
+
+Every configuration runs in a fresh process, started with the 'spawn' method,
+so that its peak resident set size is not inflated by earlier runs. The
+process builds the data, then times the construction of the model and the
+Solver together with the first training step (the time to first step). It
+then runs a few warmup steps and times num_steps more to measure the steady
+state steps and samples per second:
+
+    python -m cs231n.training_benchmarks --output training.json
+    python -m cs231n.training_benchmarks --configs cnn --steps 50
+    python -m cs231n.training_benchmarks --blas-threads 1 --intra-op-threads 4
+
+A threading policy (see threading_policy.py) is applied in the benchmark
+process before the data is built; its BLAS thread count also goes into the
+environment of the spawned process, so it holds without threadpoolctl.
+"""
+
+
+def _cifar_data(num_train, flatten, dtype, seed=0):
+    """
+    Synthetic data shaped like CIFAR-10.
+    """
+    rng = np.random.RandomState(seed)
+    shape = (3 * 32 * 32,) if flatten else (3, 32, 32)
+    data = {}
+    for split, n in (('train', num_train), ('val', max(num_train // 10, 1))):
+        data['X_' + split] = rng.randn(n, *shape).astype(dtype)
+        data['y_' + split] = rng.randint(10, size=n)
+    return data
+
+
+def _fc_model(**kwargs):
+    from cs231n.classifiers.fc_net import FullyConnectedNet
+    return FullyConnectedNet([100, 100], weight_scale=5e-2, **kwargs)
+
+
+def _cnn_model():
+    from cs231n.classifiers.cnn import ThreeLayerConvNet
+    return ThreeLayerConvNet(weight_scale=1e-2)
+
+
+# The benchmarked configurations: a function building the model, whether the
+# inputs are flattened, and the Solver arguments.
+CONFIGS = {
+    'fc': {'model': _fc_model, 'flatten': True,
+           'solver': {'update_rule': 'adam', 'batch_size': 100}},
+    'fc_batchnorm': {'model': lambda: _fc_model(use_batchnorm=True), 'flatten': True,
+                     'solver': {'update_rule': 'adam', 'batch_size': 100}},
+    'fc_dropout': {'model': lambda: _fc_model(dropout=0.5), 'flatten': True,
+                   'solver': {'update_rule': 'adam', 'batch_size': 100}},
+    'fc_batchnorm_dropout': {'model': lambda: _fc_model(use_batchnorm=True, dropout=0.5),
+                             'flatten': True,
+                             'solver': {'update_rule': 'adam', 'batch_size': 100}},
+    'cnn': {'model': _cnn_model, 'flatten': False,
+            'solver': {'update_rule': 'adam', 'batch_size': 50}},
+}
+
+
+def peak_rss_bytes():
+    """
+    Return the peak resident set size of this process in bytes, or None if it
+    cannot be measured on this platform.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _benchmark(name, num_steps, warmup, num_train, policy=None):
+    """
+    Benchmark one configuration in this process.
+    """
+    from cs231n.solver import Solver
+
+    apply_policy(policy)
+    config = CONFIGS[name]
+    data = _cifar_data(num_train, config['flatten'], np.float32)
+    rss_before = peak_rss_bytes()
+    np.random.seed(0)
+
+    start = time.perf_counter()
+    model = config['model']()
+    solver = Solver(model, data, num_epochs=1, verbose=False, **config['solver'])
+    solver._step()
+    first_step = time.perf_counter() - start
+
+    for _ in range(warmup):
+        solver._step()
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        solver._step()
+    elapsed = time.perf_counter() - start
+
+    batch_size = solver.batch_size * solver.accumulate_steps
+    return {
+        'config': name, 'model': type(model).__name__, 'batch_size': batch_size,
+        'steps': num_steps, 'time_to_first_step': first_step,
+        'steps_per_sec': num_steps / elapsed,
+        'samples_per_sec': num_steps * batch_size / elapsed,
+        'data_rss_bytes': rss_before, 'peak_rss_bytes': peak_rss_bytes(),
+        'final_loss': float(solver.loss_history[-1]),
+        'blas_threads': get_blas_threads(), 'intra_op_threads': intra_op.get_num_threads(),
+    }
+
+
+def _benchmark_worker(queue, *args):
+    try:
+        queue.put(_benchmark(*args))
+    except Exception as e:
+        queue.put({'config': args[0], 'exception': '%s: %s' % (type(e).__name__, e)})
+
+
+def benchmark_config(name, num_steps=20, warmup=3, num_train=2000, isolate=True,
+                     policy=None):
+    """
+    Benchmark the training throughput of one configuration.
+
+    Inputs:
+    - name: Key of CONFIGS
+    - num_steps: Number of timed steps
+    - warmup: Number of untimed steps after the first one
+    - num_train: Number of synthetic training examples
+    - isolate: If True, run in a fresh process so the peak RSS belongs to this
+      configuration alone.
+    - policy: Optional threading policy to run with; without isolate it is
+      applied to this process.
+
+    Returns:
+    - result: Dictionary with 'config', 'model', 'batch_size', 'steps',
+      'time_to_first_step' (seconds), 'steps_per_sec', 'samples_per_sec',
+      'data_rss_bytes' (peak RSS once the data was built), 'peak_rss_bytes'
+      'final_loss', 'blas_threads' (see get_blas_threads) and
+      'intra_op_threads', or 'exception' if the run failed.
+    """
+    args = (name, num_steps, warmup, num_train, policy)
+    if not isolate:
+        return _benchmark(*args)
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_benchmark_worker, args=(queue,) + args)
+    with thread_environment((policy or {}).get('blas_threads')):
+        process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def format_result(result):
+    """
+    Format one result as a line of text.
+    """
+    if 'exception' in result:
+        return '%-22s FAILED %s' % (result['config'], result['exception'])
+    mib = 1024.0 ** 2
+    return ('%-22s batch %4d  first step %7.3f s  %8.2f steps/s  %9.1f samples/s  '
+            'peak RSS %7.1f MiB' % (
+                result['config'], result['batch_size'], result['time_to_first_step'],
+                result['steps_per_sec'], result['samples_per_sec'],
+                (result['peak_rss_bytes'] or 0) / mib))
+
+
+def run_benchmarks(configs=None, num_steps=20, warmup=3, num_train=2000,
+                   isolate=True, verbose=True, policy=None):
+    """
+    Benchmark several configurations.
+
+    Returns:
+    - report: Dictionary with 'meta' describing the machine and 'results', the
+      list of results of benchmark_config.
+    """
+    results = []
+    for name in configs or sorted(CONFIGS):
+        result = benchmark_config(name, num_steps, warmup, num_train, isolate, policy)
+        results.append(result)
+        if verbose:
+            print(format_result(result))
+    meta = {'numpy': np.__version__, 'python': platform.python_version(),
+            'machine': platform.machine(), 'processor': platform.processor(),
+            'cores': len(available_cores()), 'policy': policy,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+    return {'meta': meta, 'results': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark end-to-end training throughput.')
+    parser.add_argument('--configs', nargs='*', choices=sorted(CONFIGS))
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--num-train', type=int, default=2000)
+    parser.add_argument('--in-process', action='store_true',
+                        help='run every configuration in this process')
+    parser.add_argument('--blas-threads', type=int,
+                        help='number of BLAS and OpenMP threads')
+    parser.add_argument('--intra-op-threads', type=int,
+                        help='number of intra-op threads of the layers')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    policy = {'blas_threads': args.blas_threads, 'intra_op_threads': args.intra_op_threads}
+    report = run_benchmarks(args.configs, args.steps, args.warmup, args.num_train,
+                            isolate=not args.in_process, policy=policy)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if any('exception' in r for r in report['results']) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
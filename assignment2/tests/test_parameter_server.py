@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from cs231n.classifiers.fc_net import FullyConnectedNet
+from cs231n.parameter_server import (ParameterServerTrainer, QuantizeCompressor,
+                                     TopKCompressor, compress_with_feedback)
+
+
+def _separable_data(num_train=300, num_val=100, D=10, C=3, seed=0):
+    """
+    Gaussian clusters around well separated class centers.
+    """
+    rng = np.random.RandomState(seed)
+    centers = 3 * rng.randn(C, D)
+    y = rng.randint(C, size=num_train + num_val)
+    X = centers[y] + 0.5 * rng.randn(num_train + num_val, D)
+    return {'X_train': X[:num_train], 'y_train': y[:num_train],
+            'X_val': X[num_train:], 'y_val': y[num_train:]}
+
+
+@pytest.mark.parametrize('compression', [None, 'topk', 'quantize'])
+def test_parameter_server_trains(compression):
+    np.random.seed(0)
+    model = FullyConnectedNet([20], input_dim=10, num_classes=3, dtype=np.float64)
+    trainer = ParameterServerTrainer(model, _separable_data(), update_rule='sgd_momentum',
+                                     optim_config={'learning_rate': 0.05},
+                                     batch_size=25, num_epochs=5, num_workers=2,
+                                     compression=compression, compression_ratio=0.2,
+                                     pull_every=2, seed=0, verbose=False)
+    trainer.train()
+    losses = trainer.loss_history
+    assert len(losses) == trainer.stats['pushes'] > 0
+    assert np.mean(losses[-5:]) < 0.5 * np.mean(losses[:5])
+    assert trainer.val_acc > 0.8
+
+
+def test_topk_round_trip():
+    g = np.random.RandomState(0).randn(100)
+    compressor = TopKCompressor(ratio=0.1)
+    out = compressor.decompress(compressor.compress(g), np.empty_like(g))
+    kept = np.argsort(np.abs(g))[-10:]
+    np.testing.assert_array_equal(out[kept], g[kept])
+    assert np.count_nonzero(out) == 10
+
+
+def test_quantize_round_trip():
+    g = np.random.RandomState(0).randn(100)
+    compressor = QuantizeCompressor(bits=8)
+    scale, q = compressor.compress(g)
+    assert q.dtype == np.int8
+    out = compressor.decompress((scale, q), np.empty_like(g))
+    assert np.max(np.abs(out - g)) <= 0.5 * scale / compressor.levels + 1e-12
+
+
+@pytest.mark.parametrize('compressor', [TopKCompressor(ratio=0.05), QuantizeCompressor(bits=2)])
+def test_error_feedback_keeps_what_compression_left_out(compressor):
+    rng = np.random.RandomState(0)
+    residual = np.zeros(50)
+    sent = np.empty(50)
+    total_grad, total_sent = np.zeros(50), np.zeros(50)
+    for _ in range(10):
+        g = rng.randn(50)
+        total_grad += g
+        compress_with_feedback(compressor, g, residual, sent)
+        total_sent += sent
+    # Every gradient was either sent or is still in the residual
+    np.testing.assert_allclose(total_sent + residual, total_grad, atol=1e-10)
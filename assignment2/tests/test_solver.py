@@ -0,0 +1,56 @@
+import numpy as np
+
+from cs231n.checkpoint import load_checkpoint
+from cs231n.classifiers.sequential import Sequential, Affine, ReLU
+from cs231n.solver import Solver
+
+
+def _data(num_train=50, D=12, C=4, seed=0):
+    rng = np.random.RandomState(seed)
+    return {'X_train': rng.randn(num_train, D), 'y_train': rng.randint(C, size=num_train),
+            'X_val': rng.randn(10, D), 'y_val': rng.randint(C, size=10)}
+
+
+def _one_step(batch_size, accumulate_steps, flat_params):
+    """
+    Take a single sgd step on the whole training set of 50 examples, as one
+    minibatch or as accumulate_steps micro-batches, and return the params.
+    """
+    np.random.seed(0)
+    model = Sequential([Affine(16), ReLU(), Affine(4)], input_dim=12,
+                       weight_scale=0.1, dtype=np.float64)
+    solver = Solver(model, _data(), update_rule='sgd', batch_size=batch_size,
+                    accumulate_steps=accumulate_steps, flat_params=flat_params,
+                    optim_config={'learning_rate': 1.0}, verbose=False)
+    solver._step()
+    return {k: v.copy() for k, v in model.params.items()}
+
+
+def test_accumulated_step_matches_full_batch_step_with_flat_params():
+    full = _one_step(50, 1, flat_params=True)
+    accumulated = _one_step(25, 2, flat_params=True)
+    for k in full:
+        np.testing.assert_allclose(accumulated[k], full[k], rtol=0, atol=1e-10, err_msg=k)
+
+
+def test_accumulated_step_matches_full_batch_step():
+    full = _one_step(50, 1, flat_params=False)
+    accumulated = _one_step(25, 2, flat_params=False)
+    for k in full:
+        np.testing.assert_allclose(accumulated[k], full[k], rtol=0, atol=1e-10, err_msg=k)
+
+
+def test_flat_checkpoint_round_trip(tmp_path):
+    np.random.seed(0)
+    model = Sequential([Affine(16), ReLU(), Affine(4)], input_dim=12, weight_scale=0.1)
+    solver = Solver(model, _data(), update_rule='adam', num_epochs=1, batch_size=25,
+                    flat_params=True, compact_checkpoints=True,
+                    checkpoint_name=str(tmp_path / 'model'), verbose=False)
+    solver.train()
+    params, optim_configs, _, counters = load_checkpoint(str(tmp_path / 'model_epoch_1.npz'))
+    assert counters['epoch'] == 1
+    assert optim_configs['__flat__']['m'].shape == (solver.flat.size,)
+    best, _, _, _ = load_checkpoint(str(tmp_path / 'model_best.npz'))
+    for k, v in solver.best_params.items():
+        np.testing.assert_array_equal(best[k], v, err_msg=k)
+        assert params[k].shape == v.shape
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from cs231n import threading_policy
+from cs231n.async_eval import AsyncEvaluator
+from cs231n.classifiers.fc_net import FullyConnectedNet
+from cs231n.hyperparameter_search import SolverTrial, successive_halving
+from cs231n.parameter_server import ParameterServerTrainer
+from cs231n.solver import Solver
+
+
+"""
+Smoke tests of every pool of worker processes, with the workers started by
+'spawn' (the default without threadpoolctl) and by 'fork'.
+"""
+
+
+@pytest.fixture(params=['spawn', 'fork'])
+def start_method(request):
+    threading_policy.set_worker_start_method(request.param)
+    yield request.param
+    threading_policy.set_worker_start_method(None)
+
+
+def _data(num_train=100, num_val=20, D=10, C=3, seed=0):
+    rng = np.random.RandomState(seed)
+    return {'X_train': rng.randn(num_train, D), 'y_train': rng.randint(C, size=num_train),
+            'X_val': rng.randn(num_val, D), 'y_val': rng.randint(C, size=num_val)}
+
+
+def _model(**kwargs):
+    np.random.seed(0)
+    return FullyConnectedNet([16, 16], input_dim=10, num_classes=3, dtype=np.float64,
+                             **kwargs)
+
+
+def _train_solver(**kwargs):
+    solver = Solver(_model(use_batchnorm=True), _data(), num_epochs=1, batch_size=20,
+                    verbose=False, **kwargs)
+    solver.train()
+    return solver
+
+
+def test_data_parallel(start_method):
+    solver = _train_solver(data_parallel=2, data_parallel_seed=0)
+    assert len(solver.loss_history) == 5
+    assert np.all(np.isfinite(solver.loss_history))
+
+
+def test_pipeline_parallel(start_method):
+    serial = _train_solver()
+    pipelined = _train_solver(pipeline_stages=2, pipeline_microbatches=1)
+    np.testing.assert_allclose(pipelined.loss_history[0], serial.loss_history[0])
+    assert len(pipelined.loss_history) == 5
+
+
+def test_async_eval(start_method):
+    model = _model()
+    data = _data()
+    evaluator = AsyncEvaluator(data['X_train'], data['y_train'], data['X_val'], data['y_val'])
+    evaluator.submit(model, 1, 0)
+    evaluator.submit(model, 2, 1)
+    results = evaluator.poll(block=True) + evaluator.close()
+    assert [r[:2] for r in results] == [(1, 0), (2, 1)]
+    assert all(0.0 <= acc <= 1.0 for r in results for acc in r[2:])
+
+
+def test_parameter_server(start_method):
+    trainer = ParameterServerTrainer(_model(), _data(), batch_size=20, num_epochs=1,
+                                     num_workers=2, compression='topk', seed=0,
+                                     verbose=False)
+    trainer.train()
+    assert trainer.stats['pushes'] == 5
+    assert trainer.val_acc is not None
+
+
+def test_hyperparameter_search(start_method):
+    trial = SolverTrial(FullyConnectedNet, {'hidden_dims': [16], 'input_dim': 10,
+                                            'num_classes': 3, 'dtype': np.float64},
+                        {'batch_size': 20})
+    configs = [{'learning_rate': 1e-3}, {'learning_rate': 1e-2}]
+    best, results = successive_halving(trial, configs, _data(), 1, 2, eta=2, num_workers=2)
+    assert len(results) == 3
+    assert best['budget'] == 2
@@ -1,10 +1,14 @@
 from __future__ import print_function, division
 from builtins import range
 from builtins import object
+import time
+
 import numpy as np
 
 from cs231n import optim
+from cs231n.batch_tuner import autotune_batch_size
 from cs231n.coco_utils import sample_coco_minibatch
+from cs231n.prefetch import MinibatchPrefetcher
 
 
 class CaptioningSolver(object):
@@ -82,12 +86,31 @@ class CaptioningSolver(object):
         - lr_decay: A scalar for learning rate decay; after each epoch the learning
           rate is multiplied by this value.
         - batch_size: Size of minibatches used to compute loss and gradient during
-          training.
+          training. If 'auto', the batch size with the best throughput under
+          memory_budget is found by probing the model (see batch_tuner.py); the
+          probes are kept in batch_size_probes.
+        - memory_budget: Memory budget in bytes of a training step, used with
+          batch_size='auto'.
+        - autotune_config: A dictionary of keyword arguments for
+          autotune_batch_size, such as 'max_batch_size' and 'num_steps'.
         - num_epochs: The number of epochs to run for during training.
         - print_every: Integer; training losses will be printed every print_every
           iterations.
         - verbose: Boolean; if set to false then no output will be printed during
           training.
+        - accumulate_steps: Number of micro-batches of batch_size captions whose
+          gradients are averaged before each update, giving an effective batch
+          size of batch_size * accumulate_steps while only one micro-batch is
+          held in memory at a time.
+        - prefetch: Number of minibatches to sample ahead on a background
+          thread (see prefetch.py), gathered into preallocated buffers while
+          the current step computes. The default of 0 samples each minibatch
+          synchronously with sample_coco_minibatch.
+        - prefetch_seed: Seed for the prefetching thread's sampler; if None it
+          is drawn from the global numpy random state.
+        - profiler: An optional LayerProfiler (see profiler.py) that train()
+          runs under, recording the time and estimated FLOPs of every layer
+          function and the throughput of the run.
         """
         self.model = model
         self.data = data
@@ -97,10 +120,16 @@ class CaptioningSolver(object):
         self.optim_config = kwargs.pop('optim_config', {})
         self.lr_decay = kwargs.pop('lr_decay', 1.0)
         self.batch_size = kwargs.pop('batch_size', 100)
+        self.memory_budget = kwargs.pop('memory_budget', None)
+        self.autotune_config = kwargs.pop('autotune_config', {})
         self.num_epochs = kwargs.pop('num_epochs', 10)
 
         self.print_every = kwargs.pop('print_every', 10)
         self.verbose = kwargs.pop('verbose', True)
+        self.accumulate_steps = kwargs.pop('accumulate_steps', 1)
+        self.prefetch = kwargs.pop('prefetch', 0)
+        self.prefetch_seed = kwargs.pop('prefetch_seed', None)
+        self.profiler = kwargs.pop('profiler', None)
 
         # Throw an error if there are extra keyword arguments
         if len(kwargs) > 0:
@@ -113,9 +142,32 @@ class CaptioningSolver(object):
             raise ValueError('Invalid update_rule "%s"' % self.update_rule)
         self.update_rule = getattr(optim, self.update_rule)
 
+        self.batch_size_probes = None
+        if self.batch_size == 'auto':
+            self._autotune_batch_size()
+
         self._reset()
 
 
+    def _autotune_batch_size(self):
+        """
+        Set batch_size to the one recommended by autotune_batch_size, probing
+        with features and captions shaped like the training data.
+        """
+        if self.memory_budget is None:
+            raise ValueError('batch_size="auto" requires a memory_budget')
+        num_train, caption_length = self.data['train_captions'].shape
+        config = dict({'min_batch_size': min(8, num_train), 'max_batch_size': num_train,
+                       'update_rule': self.update_rule, 'caption_length': caption_length},
+                      **self.autotune_config)
+        tuned = autotune_batch_size(self.model, self.data['train_features'].shape[1:],
+                                    self.memory_budget, **config)
+        self.batch_size = tuned['batch_size']
+        self.batch_size_probes = tuned['probes']
+        if self.verbose:
+            print('Using batch size %d' % self.batch_size)
+
+
     def _reset(self):
         """
         Set up some book-keeping variables for optimization. Don't call this
@@ -129,26 +181,43 @@ class CaptioningSolver(object):
         self.train_acc_history = []
         self.val_acc_history = []
 
+        # The prefetching thread is started by the first minibatch request.
+        # Like sample_coco_minibatch it samples with replacement and gathers
+        # features through the image indices of the captions.
+        self.prefetcher = None
+        if self.prefetch > 0:
+            arrays = {
+                'captions': self.data['train_captions'],
+                'image_idxs': self.data['train_image_idxs'],
+                'features': (self.data['train_features'], 'image_idxs'),
+            }
+            dtypes = {'features': getattr(self.model, 'dtype', self.data['train_features'].dtype)}
+            self.prefetcher = MinibatchPrefetcher(arrays, self.batch_size, dtypes=dtypes,
+                                                  depth=self.prefetch, seed=self.prefetch_seed,
+                                                  replace=True)
+
         # Make a deep copy of the optim_config for each parameter
         self.optim_configs = {}
         for p in self.model.params:
             d = {k: v for k, v in self.optim_config.items()}
             self.optim_configs[p] = d
 
+        # Buffers that sum the gradients of the micro-batches
+        self.accum_grads = None
+        if self.accumulate_steps > 1:
+            self.accum_grads = {p: np.zeros_like(w) for p, w in self.model.params.items()}
+
 
     def _step(self):
         """
         Make a single gradient update. This is called by train() and should not
         be called manually.
         """
-        # Make a minibatch of training data
-        minibatch = sample_coco_minibatch(self.data,
-                      batch_size=self.batch_size,
-                      split='train')
-        captions, features, urls = minibatch
-
-        # Compute loss and gradient
-        loss, grads = self.model.loss(features, captions)
+        # Compute loss and gradient, over several micro-batches if needed
+        if self.accumulate_steps > 1:
+            loss, grads = self._accumulate_loss()
+        else:
+            loss, grads = self._minibatch_loss()
         self.loss_history.append(loss)
 
         # Perform a parameter update
@@ -160,6 +229,43 @@ class CaptioningSolver(object):
             self.optim_configs[p] = next_config
 
 
+    def _minibatch_loss(self):
+        """
+        Sample a minibatch of training data and compute the loss and gradients
+        of the model on it.
+        """
+        if self.prefetcher is not None:
+            batch = self.prefetcher.next()
+            return self.model.loss(batch['features'], batch['captions'])
+
+        minibatch = sample_coco_minibatch(self.data,
+                      batch_size=self.batch_size,
+                      split='train')
+        captions, features, urls = minibatch
+        return self.model.loss(features, captions)
+
+
+    def _accumulate_loss(self):
+        """
+        Average the loss and gradients over accumulate_steps micro-batches.
+        """
+        k = self.accumulate_steps
+        grads = self.accum_grads
+        loss = 0.0
+        for i in range(k):
+            micro_loss, micro_grads = self._minibatch_loss()
+            loss += micro_loss
+            for p, g in micro_grads.items():
+                if i == 0:
+                    np.copyto(grads[p], g)
+                else:
+                    grads[p] += g
+
+        for g in grads.values():
+            g /= k
+        return loss / k, grads
+
+
     # TODO: This does nothing right now; maybe implement BLEU?
     def check_accuracy(self, X, y, num_samples=None, batch_size=100):
         """
@@ -206,11 +312,28 @@ class CaptioningSolver(object):
     def train(self):
         """
         Run optimization to train the model.
+
+        Afterwards examples_per_sec holds the number of training examples
+        processed per second of wall time, accuracy checks included.
         """
+        if self.profiler is None:
+            self._train()
+            return
+        with self.profiler:
+            self._train()
+        self.profiler.record_run(type(self.model).__name__, self.num_examples_trained,
+                                 self.train_time, batch_size=self.batch_size)
+        if self.verbose:
+            print('(Training) %.1f examples / sec' % self.examples_per_sec)
+
+
+    def _train(self):
         num_train = self.data['train_captions'].shape[0]
-        iterations_per_epoch = max(num_train // self.batch_size, 1)
+        examples_per_step = self.batch_size * self.accumulate_steps
+        iterations_per_epoch = max(num_train // examples_per_step, 1)
         num_iterations = self.num_epochs * iterations_per_epoch
 
+        start_time = time.perf_counter()
         for t in range(num_iterations):
             self._step()
 
@@ -231,5 +354,12 @@ class CaptioningSolver(object):
             # iteration, and at the end of each epoch.
             # TODO: Implement some logic to check Bleu on validation set periodically
 
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+
+        self.train_time = time.perf_counter() - start_time
+        self.num_examples_trained = num_iterations * examples_per_step
+        self.examples_per_sec = self.num_examples_trained / max(self.train_time, 1e-12)
+
         # At the end of training swap the best params into the model
         # self.model.params = self.best_params
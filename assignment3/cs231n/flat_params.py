@@ -0,0 +1,162 @@
+from builtins import object
+import numpy as np
+
+
+"""
+This file implements a flat, contiguous layout for model parameters and their
+gradients.
+
+Models keep their parameters in a dictionary of separately allocated arrays,
+so anything that touches all of them (an optimizer step, a norm, a snapshot of
+the best parameters) loops over the dictionary and allocates per parameter.
+FlatParams copies every parameter once into a single 1-D buffer and hands the
+model back views into it, so that
+
+    flat = flatten_model_params(model)
+
+leaves model.params mapping the same names to arrays of the same shapes, but
+flat.params now holds all of their values back to back. Gradients use an
+identical layout in flat.grads, and the same operation on every parameter
+becomes one vectorized operation on one array:
+
+    flat.gather_grads(grads)
+    reg_loss = flat.add_l2_regularization(reg)
+    grad_norm = flat.norm(grads=True)
+    next_w, config = adam(flat.params, flat.grads, config)
+    snapshot = flat.params.copy()
+"""
+
+
+class FlatParams(object):
+    """
+    A contiguous buffer of parameters and a parallel buffer of gradients.
+
+    Attributes:
+    - params: 1-D array holding every parameter.
+    - grads: 1-D array with the same layout holding every gradient.
+    - param_views: Dictionary mapping parameter names to views into params,
+      with the original shapes.
+    - grad_views: Dictionary mapping parameter names to views into grads.
+    - layout: Dictionary mapping parameter names to (offset, shape).
+    """
+
+    def __init__(self, params, dtype=None):
+        """
+        Copy a dictionary of parameters into a flat buffer.
+
+        Inputs:
+        - params: Dictionary mapping names to numpy arrays.
+        - dtype: Datatype of the buffers; defaults to the common datatype of
+          all parameters.
+        """
+        if dtype is None:
+            dtype = np.result_type(*params.values())
+        self.layout = {}
+        offset = 0
+        for k, v in params.items():
+            self.layout[k] = (offset, v.shape)
+            offset += v.size
+        self.size = offset
+
+        self.params = np.empty(self.size, dtype=dtype)
+        self.grads = np.zeros(self.size, dtype=dtype)
+        self.param_views = self.unflatten(self.params)
+        self.grad_views = self.unflatten(self.grads)
+        for k, v in params.items():
+            self.param_views[k][...] = v
+
+
+    def __getstate__(self):
+        # The views would be pickled as separate arrays, so they are rebuilt
+        # from the buffers when unpickling instead
+        state = self.__dict__.copy()
+        del state['param_views'], state['grad_views']
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.param_views = self.unflatten(self.params)
+        self.grad_views = self.unflatten(self.grads)
+
+
+    def unflatten(self, flat):
+        """
+        Return a dictionary of views into an array with the same layout as
+        self.params, such as a snapshot made with self.params.copy().
+        """
+        views = {}
+        for k, (offset, shape) in self.layout.items():
+            size = int(np.prod(shape))
+            views[k] = flat[offset:offset + size].reshape(shape)
+        return views
+
+
+    def gather_grads(self, grads):
+        """
+        Copy a dictionary of gradients into self.grads. Gradients that a model
+        already wrote into self.grad_views are left alone.
+
+        Returns:
+        - grads: self.grads
+        """
+        for k, view in self.grad_views.items():
+            g = grads[k]
+            if g is not view:
+                view[...] = g
+        return self.grads
+
+
+    def norm(self, grads=False):
+        """
+        Return the L2 norm of all parameters, or of all gradients if grads is
+        True, computed with a single dot product over the flat buffer.
+        """
+        flat = self.grads if grads else self.params
+        return float(np.sqrt(flat.dot(flat)))
+
+
+    def add_l2_regularization(self, reg):
+        """
+        Add the gradient of the L2 penalty 0.5 * reg * ||params||^2 to
+        self.grads in place. The penalty covers every entry of the buffer,
+        biases included.
+
+        Returns:
+        - reg_loss: The value of the penalty
+        """
+        if reg == 0:
+            return 0.0
+        self.grads += reg * self.params
+        return 0.5 * reg * float(self.params.dot(self.params))
+
+
+    def load(self, flat):
+        """
+        Overwrite all parameters with the values in a flat array, keeping every
+        view handed out so far valid.
+        """
+        if flat is not self.params:
+            self.params[...] = flat
+
+
+def flatten_model_params(model):
+    """
+    Move the parameters of a model into a FlatParams buffer.
+
+    After this call model.params maps the same names to views into the flat
+    buffer. If the model writes its gradients into a preallocated model.grads
+    dictionary, that dictionary is pointed at the flat gradient buffer as well
+    so that gathering gradients costs nothing.
+
+    Inputs:
+    - model: A model with a params dictionary.
+
+    Returns:
+    - flat: The FlatParams object backing model.params
+    """
+    flat = FlatParams(model.params)
+    model.params = dict(flat.param_views)
+    if isinstance(getattr(model, 'grads', None), dict):
+        model.grads = dict(flat.grad_views)
+    return flat
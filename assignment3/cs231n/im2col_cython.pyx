@@ -28,18 +28,23 @@ def im2col_cython(np.ndarray[DTYPE_t, ndim=4] x, int field_height,
             dtype=x.dtype)
 
     # Moving the inner loop to a C function with no bounds checking works, but does
-    # not seem to help performance in any measurable way.
-
-    im2col_cython_inner(cols, x_padded, N, C, H, W, HH, WW,
-                        field_height, field_width, padding, stride)
+    # not seem to help performance in any measurable way. It does let the loop
+    # release the GIL, so that intra-op threads can run it on separate chunks
+    # of the batch in parallel.
+    cdef DTYPE_t[:, :] cols_view = cols
+    cdef DTYPE_t[:, :, :, :] x_padded_view = x_padded
+    with nogil:
+        im2col_cython_inner(cols_view, x_padded_view, N, C, H, W, HH, WW,
+                            field_height, field_width, padding, stride)
     return cols
 
 
 @cython.boundscheck(False)
-cdef int im2col_cython_inner(np.ndarray[DTYPE_t, ndim=2] cols,
-                             np.ndarray[DTYPE_t, ndim=4] x_padded,
-                             int N, int C, int H, int W, int HH, int WW,
-                             int field_height, int field_width, int padding, int stride) except? -1:
+@cython.wraparound(False)
+cdef void im2col_cython_inner(DTYPE_t[:, :] cols,
+                              DTYPE_t[:, :, :, :] x_padded,
+                              int N, int C, int H, int W, int HH, int WW,
+                              int field_height, int field_width, int padding, int stride) noexcept nogil:
     cdef int c, ii, jj, row, yy, xx, i, col
 
     for c in range(C):
@@ -64,18 +69,22 @@ def col2im_cython(np.ndarray[DTYPE_t, ndim=2] cols, int N, int C, int H, int W,
 
     # Moving the inner loop to a C-function with no bounds checking improves
     # performance quite a bit for col2im.
-    col2im_cython_inner(cols, x_padded, N, C, H, W, HH, WW, 
-                        field_height, field_width, padding, stride)
+    cdef DTYPE_t[:, :] cols_view = cols
+    cdef DTYPE_t[:, :, :, :] x_padded_view = x_padded
+    with nogil:
+        col2im_cython_inner(cols_view, x_padded_view, N, C, H, W, HH, WW,
+                            field_height, field_width, padding, stride)
     if padding > 0:
         return x_padded[:, :, padding:-padding, padding:-padding]
     return x_padded
 
 
 @cython.boundscheck(False)
-cdef int col2im_cython_inner(np.ndarray[DTYPE_t, ndim=2] cols,
-                             np.ndarray[DTYPE_t, ndim=4] x_padded,
-                             int N, int C, int H, int W, int HH, int WW,
-                             int field_height, int field_width, int padding, int stride) except? -1:
+@cython.wraparound(False)
+cdef void col2im_cython_inner(DTYPE_t[:, :] cols,
+                              DTYPE_t[:, :, :, :] x_padded,
+                              int N, int C, int H, int W, int HH, int WW,
+                              int field_height, int field_width, int padding, int stride) noexcept nogil:
     cdef int c, ii, jj, row, yy, xx, i, col
 
     for c in range(C):
@@ -91,10 +100,10 @@ cdef int col2im_cython_inner(np.ndarray[DTYPE_t, ndim=2] cols,
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-cdef col2im_6d_cython_inner(np.ndarray[DTYPE_t, ndim=6] cols,
-                            np.ndarray[DTYPE_t, ndim=4] x_padded,
-                            int N, int C, int H, int W, int HH, int WW,
-                            int out_h, int out_w, int pad, int stride):
+cdef void col2im_6d_cython_inner(DTYPE_t[:, :, :, :, :, :] cols,
+                                 DTYPE_t[:, :, :, :] x_padded,
+                                 int N, int C, int H, int W, int HH, int WW,
+                                 int out_h, int out_w, int pad, int stride) noexcept nogil:
 
     cdef int c, hh, ww, n, h, w
     for n in range(N):
@@ -114,7 +123,11 @@ def col2im_6d_cython(np.ndarray[DTYPE_t, ndim=6] cols, int N, int C, int H, int
     cdef np.ndarray[DTYPE_t, ndim=4] x_padded = np.zeros((N, C, H + 2 * pad, W + 2 * pad),
                                                   dtype=cols.dtype)
 
-    col2im_6d_cython_inner(cols, x_padded, N, C, H, W, HH, WW, out_h, out_w, pad, stride)
+    cdef DTYPE_t[:, :, :, :, :, :] cols_view = cols
+    cdef DTYPE_t[:, :, :, :] x_padded_view = x_padded
+    with nogil:
+        col2im_6d_cython_inner(cols_view, x_padded_view, N, C, H, W, HH, WW,
+                               out_h, out_w, pad, stride)
 
     if pad > 0:
         return x_padded[:, :, pad:-pad, pad:-pad]
@@ -0,0 +1,468 @@
+from __future__ import print_function, division
+from builtins import range
+import argparse
+import importlib
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+
+"""
+This file implements a microbenchmark suite for the layer functions.
+
+Every benchmarked layer has one or more implementations: the naive reference
+in layers.py and the competing versions in fast_layers.py, such as
+conv_forward_im2col and conv_forward_strides, or max_pool_forward_reshape and
+max_pool_forward_im2col. The suite sweeps each layer over a few realistic
+shapes and datatypes and times the forward and the backward pass of every
+implementation. It also checks that their outputs and gradients agree with
+the first implementation of the layer run in float64 on the same inputs, so a
+float32 run shows the error of the lower precision and a fast implementation
+shows its error against the reference.
+
+Implementations that are missing from this package are skipped. Results are
+written to JSON. A later run can be compared against a saved baseline, and
+every case that became slower by more than the tolerance, or stopped agreeing
+with the reference, is flagged:
+
+    python -m cs231n.layer_benchmarks --output baseline.json
+    python -m cs231n.layer_benchmarks --compare baseline.json --layers conv pool
+"""
+
+
+def _randn(rng, *shape):
+    return rng.randn(*shape)
+
+
+def _affine_args(rng, s):
+    x = np.maximum(_randn(rng, s['N'], s['D']), 0)
+    return [x, 0.1 * _randn(rng, s['D'], s['M']), _randn(rng, s['M'])]
+
+
+def _vector_args(rng, s):
+    return [_randn(rng, s['N'], s['D'])]
+
+
+def _batchnorm_args(rng, s):
+    return [_randn(rng, s['N'], s['D']), 1 + 0.1 * _randn(rng, s['D']),
+            0.1 * _randn(rng, s['D']), {'mode': 'train'}]
+
+
+def _dropout_args(rng, s):
+    return [_randn(rng, s['N'], s['D']), {'mode': 'train', 'p': 0.5, 'seed': 0}]
+
+
+def _conv_args(rng, s):
+    x = _randn(rng, s['N'], s['C'], s['H'], s['W'])
+    w = 0.1 * _randn(rng, s['F'], s['C'], s['HH'], s['HH'])
+    return [x, w, _randn(rng, s['F']), {'stride': s['stride'], 'pad': s['pad']}]
+
+
+def _pool_args(rng, s):
+    x = _randn(rng, s['N'], s['C'], s['H'], s['W'])
+    return [x, {'pool_height': s['P'], 'pool_width': s['P'], 'stride': s['P']}]
+
+
+def _spatial_batchnorm_args(rng, s):
+    x = _randn(rng, s['N'], s['C'], s['H'], s['W'])
+    return [x, 1 + 0.1 * _randn(rng, s['C']), 0.1 * _randn(rng, s['C']), {'mode': 'train'}]
+
+
+def _loss_args(rng, s):
+    return [_randn(rng, s['N'], s['C']), rng.randint(s['C'], size=s['N'])]
+
+
+def _rnn_step_args(rng, s):
+    N, D, H = s['N'], s['D'], s['H']
+    return [_randn(rng, N, D), _randn(rng, N, H), _randn(rng, D, H) / np.sqrt(D),
+            _randn(rng, H, H) / np.sqrt(H), _randn(rng, H)]
+
+
+def _lstm_step_args(rng, s):
+    N, D, H = s['N'], s['D'], s['H']
+    return [_randn(rng, N, D), _randn(rng, N, H), _randn(rng, N, H),
+            _randn(rng, D, 4 * H) / np.sqrt(D), _randn(rng, H, 4 * H) / np.sqrt(H),
+            _randn(rng, 4 * H)]
+
+
+def _recurrent_args(gates):
+    def args(rng, s):
+        N, T, D, H = s['N'], s['T'], s['D'], s['H']
+        return [_randn(rng, N, T, D), _randn(rng, N, H),
+                _randn(rng, D, gates * H) / np.sqrt(D),
+                _randn(rng, H, gates * H) / np.sqrt(H), _randn(rng, gates * H)]
+    return args
+
+
+def _word_embedding_args(rng, s):
+    return [rng.randint(s['V'], size=(s['N'], s['T'])), _randn(rng, s['V'], s['D'])]
+
+
+def _temporal_affine_args(rng, s):
+    return [_randn(rng, s['N'], s['T'], s['D']), _randn(rng, s['D'], s['M']) / np.sqrt(s['D']),
+            _randn(rng, s['M'])]
+
+
+def _temporal_softmax_args(rng, s):
+    N, T, V = s['N'], s['T'], s['V']
+    return [_randn(rng, N, T, V), rng.randint(V, size=(N, T)), rng.rand(N, T) > 0.2]
+
+
+# The benchmarked layers. Each has a function building the float64 inputs for
+# a shape, the shapes to sweep, and its implementations as (module, forward,
+# backward) triples, optionally followed by a dictionary of parameters that
+# only that implementation takes. Loss functions are marked with 'loss'; they
+# return (loss, dx) and have no backward function. Naive implementations are too slow
+# for realistic shapes; they are only run, together with all the others, on
+# the small shapes listed under 'naive_shapes'. The first implementation that
+# runs on a shape is the reference.
+LAYERS = [
+    {'name': 'affine', 'args': _affine_args,
+     'shapes': [{'N': 100, 'D': 3072, 'M': 100}, {'N': 100, 'D': 500, 'M': 10}],
+     'impls': [('layers', 'affine_forward', 'affine_backward'),
+               ('fast_layers', 'affine_forward_sparse', 'affine_backward_sparse', {})]},
+    {'name': 'relu', 'args': _vector_args,
+     'shapes': [{'N': 100, 'D': 4096}],
+     'impls': [('layers', 'relu_forward', 'relu_backward')]},
+    {'name': 'batchnorm', 'args': _batchnorm_args,
+     'shapes': [{'N': 100, 'D': 500}, {'N': 256, 'D': 4096}],
+     'impls': [('layers', 'batchnorm_forward', 'batchnorm_backward'),
+               ('layers', 'batchnorm_forward', 'batchnorm_backward_alt')]},
+    {'name': 'dropout', 'args': _dropout_args,
+     'shapes': [{'N': 100, 'D': 4096}],
+     'impls': [('layers', 'dropout_forward', 'dropout_backward')]},
+    {'name': 'conv', 'args': _conv_args,
+     'shapes': [{'N': 50, 'C': 3, 'H': 32, 'W': 32, 'F': 32, 'HH': 3, 'stride': 1, 'pad': 1},
+                {'N': 50, 'C': 32, 'H': 16, 'W': 16, 'F': 64, 'HH': 3, 'stride': 1, 'pad': 1},
+                {'N': 50, 'C': 3, 'H': 32, 'W': 32, 'F': 32, 'HH': 7, 'stride': 2, 'pad': 3}],
+     'naive_shapes': [{'N': 4, 'C': 3, 'H': 16, 'W': 16, 'F': 8, 'HH': 3, 'stride': 1, 'pad': 1}],
+     'impls': [('layers', 'conv_forward_naive', 'conv_backward_naive'),
+               ('fast_layers', 'conv_forward_im2col', 'conv_backward_im2col'),
+               ('fast_layers', 'conv_forward_strides', 'conv_backward_strides')]},
+    {'name': 'pool', 'args': _pool_args,
+     'shapes': [{'N': 50, 'C': 32, 'H': 32, 'W': 32, 'P': 2},
+                {'N': 50, 'C': 64, 'H': 16, 'W': 16, 'P': 2}],
+     'naive_shapes': [{'N': 4, 'C': 8, 'H': 16, 'W': 16, 'P': 2}],
+     'impls': [('layers', 'max_pool_forward_naive', 'max_pool_backward_naive'),
+               ('fast_layers', 'max_pool_forward_fast', 'max_pool_backward_fast'),
+               ('fast_layers', 'max_pool_forward_reshape', 'max_pool_backward_reshape'),
+               ('fast_layers', 'max_pool_forward_im2col', 'max_pool_backward_im2col')]},
+    {'name': 'spatial_batchnorm', 'args': _spatial_batchnorm_args,
+     'shapes': [{'N': 50, 'C': 32, 'H': 32, 'W': 32}],
+     'impls': [('layers', 'spatial_batchnorm_forward', 'spatial_batchnorm_backward')]},
+    {'name': 'softmax_loss', 'loss': True, 'args': _loss_args,
+     'shapes': [{'N': 100, 'C': 10}, {'N': 256, 'C': 1000}],
+     'impls': [('layers', 'softmax_loss', None),
+               ('fast_layers', 'softmax_loss_fast', None),
+               ('fast_layers', 'softmax_loss_chunked', None)]},
+    {'name': 'svm_loss', 'loss': True, 'args': _loss_args,
+     'shapes': [{'N': 100, 'C': 10}, {'N': 256, 'C': 1000}],
+     'impls': [('layers', 'svm_loss', None),
+               ('fast_layers', 'svm_loss_fast', None)]},
+    {'name': 'rnn_step', 'args': _rnn_step_args,
+     'shapes': [{'N': 50, 'D': 256, 'H': 512}],
+     'impls': [('rnn_layers', 'rnn_step_forward', 'rnn_step_backward')]},
+    {'name': 'rnn', 'args': _recurrent_args(1),
+     'shapes': [{'N': 50, 'T': 16, 'D': 256, 'H': 512}],
+     'impls': [('rnn_layers', 'rnn_forward', 'rnn_backward')]},
+    {'name': 'lstm_step', 'args': _lstm_step_args,
+     'shapes': [{'N': 50, 'D': 256, 'H': 512}],
+     'impls': [('rnn_layers', 'lstm_step_forward', 'lstm_step_backward')]},
+    {'name': 'lstm', 'args': _recurrent_args(4),
+     'shapes': [{'N': 50, 'T': 16, 'D': 256, 'H': 512}],
+     'impls': [('rnn_layers', 'lstm_forward', 'lstm_backward')]},
+    {'name': 'word_embedding', 'args': _word_embedding_args,
+     'shapes': [{'N': 50, 'T': 16, 'V': 1004, 'D': 256}],
+     'impls': [('rnn_layers', 'word_embedding_forward', 'word_embedding_backward')]},
+    {'name': 'temporal_affine', 'args': _temporal_affine_args,
+     'shapes': [{'N': 50, 'T': 16, 'D': 512, 'M': 1004}],
+     'impls': [('rnn_layers', 'temporal_affine_forward', 'temporal_affine_backward')]},
+    {'name': 'temporal_softmax_loss', 'loss': True, 'args': _temporal_softmax_args,
+     'shapes': [{'N': 50, 'T': 16, 'V': 1004}],
+     'impls': [('rnn_layers', 'temporal_softmax_loss', None)]},
+]
+
+
+def _load(module_name, name):
+    """
+    Return cs231n.<module_name>.<name>, or None if it does not exist.
+    """
+    if name is None:
+        return None
+    try:
+        module = importlib.import_module('cs231n.' + module_name)
+    except ImportError:
+        return None
+    return getattr(module, name, None)
+
+
+def _cast(args, dtype):
+    """
+    Convert the floating point arrays of a list of arguments to dtype, and
+    copy the parameter dictionaries so implementations do not share them.
+    """
+    out = []
+    for a in args:
+        if isinstance(a, np.ndarray) and np.issubdtype(a.dtype, np.floating):
+            a = a.astype(dtype)
+        elif isinstance(a, dict):
+            a = dict(a)
+        out.append(a)
+    return out
+
+
+def _split(result, loss):
+    """
+    Split the result of a forward function into its outputs and its cache.
+    Loss functions return (loss, dx) and have no cache.
+    """
+    if loss:
+        return list(result), None
+    return list(result[:-1]), result[-1]
+
+
+def _as_list(result):
+    return list(result) if isinstance(result, tuple) else [result]
+
+
+def _arrays(values):
+    return [np.asarray(v, dtype=np.float64) for v in values if v is not None]
+
+
+def _rel_error(values, reference):
+    """
+    Largest absolute difference between two lists of arrays, relative to the
+    largest magnitude in the reference.
+    """
+    error = 0.0
+    for a, r in zip(_arrays(values), _arrays(reference)):
+        scale = max(np.max(np.abs(r)) if r.size else 0.0, 1e-8)
+        error = max(error, np.max(np.abs(a - r)) / scale if r.size else 0.0)
+    return float(error)
+
+
+def _time(func, min_time, max_repeat):
+    """
+    Return the best time per call of func in milliseconds, calling it until
+    min_time seconds have passed or max_repeat calls were made.
+    """
+    func()
+    best, total, calls = float('inf'), 0.0, 0
+    while calls < max_repeat and (total < min_time or calls == 0):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        total += elapsed
+        calls += 1
+    return 1000 * best
+
+
+def _shape_label(shape):
+    return ','.join('%s=%s' % (k, shape[k]) for k in sorted(shape))
+
+
+def _tolerance(dtype):
+    return {np.dtype(np.float64): 1e-6, np.dtype(np.float32): 1e-3}.get(np.dtype(dtype), 5e-2)
+
+
+def benchmark_layer(layer, shape, dtype, min_time=0.1, max_repeat=50, seed=0):
+    """
+    Benchmark every available implementation of one layer on one shape.
+
+    Inputs:
+    - layer: An entry of LAYERS
+    - shape: Dictionary of sizes passed to the layer's argument builder
+    - dtype: Datatype of the floating point inputs
+    - min_time: Minimum time in seconds spent timing each pass
+    - max_repeat: Maximum number of timed calls of each pass
+    - seed: Seed for the random inputs
+
+    Returns:
+    - results: List of dictionaries with 'layer', 'impl', 'shape', 'dtype',
+      'forward_ms', 'backward_ms', 'forward_error', 'backward_error',
+      'exception' (the error raised by the implementation, if any) and 'ok'.
+    """
+    rng = np.random.RandomState(seed)
+    base_args = layer['args'](rng, shape)
+    naive = shape in layer.get('naive_shapes', [])
+
+    impls = []
+    for impl in layer['impls']:
+        module_name, fwd_name, bwd_name = impl[:3]
+        forward, backward = _load(module_name, fwd_name), _load(module_name, bwd_name)
+        if forward is None or (bwd_name is not None and backward is None):
+            continue
+        if fwd_name.endswith('_naive') and not naive:
+            continue
+        extra = [impl[3]] if len(impl) > 3 else []
+        impls.append((module_name, fwd_name, forward, backward, extra))
+    if not impls:
+        return []
+
+    # Reference outputs and gradients in float64, with the same upstream
+    # gradients that the timed implementations receive. If the reference
+    # fails, the other implementations are timed without checking them.
+    loss = layer.get('loss', False)
+    _, _, forward, backward, extra = impls[0]
+    ref_outputs = ref_grads = douts = None
+    try:
+        ref_outputs, cache = _split(forward(*_cast(base_args + extra, np.float64)), loss)
+        if backward is not None:
+            douts = [rng.randn(*np.shape(out)) for out in ref_outputs]
+            ref_grads = _as_list(backward(*(douts + [cache])))
+    except Exception:
+        pass
+
+    results = []
+    for module_name, fwd_name, forward, backward, extra in impls:
+        bwd_name = backward.__name__ if backward is not None else None
+        result = {
+            'layer': layer['name'], 'shape': _shape_label(shape),
+            'impl': '%s.%s' % (module_name, fwd_name if backward is None else
+                               '%s/%s' % (fwd_name, bwd_name)),
+            'dtype': np.dtype(dtype).name,
+            'forward_ms': None, 'forward_error': None,
+            'backward_ms': None, 'backward_error': None, 'exception': None,
+        }
+        try:
+            args = _cast(base_args + extra, dtype)
+            outputs, cache = _split(forward(*args), loss)
+            result['forward_ms'] = _time(lambda: forward(*args), min_time, max_repeat)
+            if ref_outputs is not None:
+                result['forward_error'] = _rel_error(outputs, ref_outputs)
+            if backward is not None and douts is not None:
+                d = [dout.astype(dtype) for dout in douts]
+                grads = _as_list(backward(*(d + [cache])))
+                result['backward_ms'] = _time(lambda: backward(*(d + [cache])),
+                                              min_time, max_repeat)
+                result['backward_error'] = _rel_error(grads, ref_grads)
+        except Exception as e:
+            result['exception'] = '%s: %s' % (type(e).__name__, e)
+        errors = [e for e in (result['forward_error'], result['backward_error']) if e is not None]
+        result['ok'] = (result['exception'] is None and
+                        all(e <= _tolerance(dtype) for e in errors))
+        results.append(result)
+    return results
+
+
+def run_benchmarks(layers=None, dtypes=(np.float64, np.float32), quick=False,
+                   min_time=0.1, max_repeat=50, verbose=True):
+    """
+    Run the benchmark suite.
+
+    Inputs:
+    - layers: Optional list of layer names to benchmark; default is all.
+    - dtypes: Datatypes to sweep.
+    - quick: If True, only benchmark the first shape of each layer.
+    - min_time, max_repeat: Passed to benchmark_layer.
+    - verbose: If True, print each result.
+
+    Returns:
+    - report: Dictionary with 'meta' describing the machine and 'results',
+      the list of results from benchmark_layer.
+    """
+    results = []
+    for layer in LAYERS:
+        if layers and layer['name'] not in layers:
+            continue
+        shapes = layer['shapes'][:1] if quick else layer['shapes']
+        for shape in shapes + layer.get('naive_shapes', []):
+            for dtype in dtypes:
+                for result in benchmark_layer(layer, shape, dtype, min_time, max_repeat):
+                    results.append(result)
+                    if verbose:
+                        print(format_result(result))
+    meta = {'numpy': np.__version__, 'python': platform.python_version(),
+            'machine': platform.machine(), 'processor': platform.processor(),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+    return {'meta': meta, 'results': results}
+
+
+def format_result(result):
+    """
+    Format one result as a line of text.
+    """
+    def ms(t):
+        return '%9.3f' % t if t is not None else '        -'
+
+    def err(e):
+        return '%.1e' % e if e is not None else '-'
+
+    return '%-18s %-62s %-7s %-40s fwd %s ms  bwd %s ms  err %s/%s%s' % (
+        result['layer'], result['impl'], result['dtype'], result['shape'],
+        ms(result['forward_ms']), ms(result['backward_ms']),
+        err(result['forward_error']), err(result['backward_error']),
+        '' if result['ok'] else '  FAILED %s' % (result['exception'] or 'mismatch'))
+
+
+def compare_results(results, baseline, tolerance=0.1):
+    """
+    Compare benchmark results against a baseline.
+
+    Inputs:
+    - results: List of results of the current run
+    - baseline: List of results of an earlier run
+    - tolerance: Relative slowdown that is flagged as a regression
+
+    Returns:
+    - regressions: List of (result, reason) pairs for the cases that became
+      slower by more than tolerance or no longer agree with the reference.
+    """
+    def key(r):
+        return (r['layer'], r['impl'], r['shape'], r['dtype'])
+
+    base = {key(r): r for r in baseline}
+    regressions = []
+    for r in results:
+        b = base.get(key(r))
+        if b is None:
+            continue
+        if b['ok'] and not r['ok']:
+            regressions.append((r, 'no longer agrees with the reference'))
+        for name in ('forward_ms', 'backward_ms'):
+            if r[name] is None or b[name] is None:
+                continue
+            if r[name] > b[name] * (1 + tolerance):
+                regressions.append((r, '%s %.3f -> %.3f (%+.0f%%)' % (
+                    name, b[name], r[name], 100 * (r[name] / b[name] - 1))))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the layer functions.')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of baseline results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='relative slowdown flagged as a regression')
+    parser.add_argument('--layers', nargs='*', help='names of the layers to benchmark')
+    parser.add_argument('--dtypes', nargs='*', default=['float64', 'float32'])
+    parser.add_argument('--quick', action='store_true', help='only the first shape of each layer')
+    parser.add_argument('--min-time', type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.layers, [np.dtype(d) for d in args.dtypes],
+                            quick=args.quick, min_time=args.min_time)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    failed = [r for r in report['results'] if not r['ok']]
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare_results(report['results'], baseline, args.tolerance)
+        for r, reason in regressions:
+            print('REGRESSION %s %s %s %s: %s' % (r['layer'], r['impl'], r['dtype'],
+                                                  r['shape'], reason))
+        if not regressions:
+            print('No regressions against %s' % args.compare)
+        failed += [r for r, _ in regressions]
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,7 @@
 import numpy as np
 
+from cs231n.flat_params import FlatParams
+
 """
 This file implements various first-order update rules that are commonly used for
 training neural networks. Each update rule accepts current weights and the
@@ -26,10 +28,28 @@ well; however the default values of the other hyperparameters should work well
 for a variety of different problems.
 
 For efficiency, update rules may perform in-place updates, mutating w and
-setting next_w equal to w.
+setting next_w equal to w. sgd_momentum, rmsprop and adam do so: w and the
+state arrays in config are updated in place, and every intermediate result is
+written into a scratch array stored in config['scratch'], so that after the
+first call an update allocates no memory.
+
+To update all parameters of a model with one call to an update rule, use
+multi_tensor_update.
 """
 
 
+def _scratch(x, config):
+    """
+    Return a preallocated array with the shape and datatype of x, stored in
+    config['scratch'] and reused across calls.
+    """
+    scratch = config.get('scratch')
+    if scratch is None or scratch.shape != x.shape or scratch.dtype != x.dtype:
+        scratch = np.empty_like(x)
+        config['scratch'] = scratch
+    return scratch
+
+
 def sgd(w, dw, config=None):
     """
     Performs vanilla stochastic gradient descent.
@@ -44,6 +64,72 @@ def sgd(w, dw, config=None):
     return w, config
 
 
+def sgd_momentum(w, dw, config=None):
+    """
+    Performs stochastic gradient descent with momentum.
+
+    config format:
+    - learning_rate: Scalar learning rate.
+    - momentum: Scalar between 0 and 1 giving the momentum value.
+      Setting momentum = 0 reduces to sgd.
+    - velocity: A numpy array of the same shape as w and dw used to store a
+      moving average of the gradients.
+    """
+    if config is None: config = {}
+    config.setdefault('learning_rate', 1e-2)
+    config.setdefault('momentum', 0.9)
+    if 'velocity' not in config: config['velocity'] = np.zeros_like(w)
+
+    next_w = None
+    # v = momentum * v - learning_rate * dw; w += v
+    v, scratch = config['velocity'], _scratch(w, config)
+    v *= config['momentum']
+    np.multiply(dw, config['learning_rate'], out=scratch)
+    v -= scratch
+    w += v
+    next_w = w
+
+    return next_w, config
+
+
+def rmsprop(x, dx, config=None):
+    """
+    Uses the RMSProp update rule, which uses a moving average of squared
+    gradient values to set adaptive per-parameter learning rates.
+
+    config format:
+    - learning_rate: Scalar learning rate.
+    - decay_rate: Scalar between 0 and 1 giving the decay rate for the squared
+      gradient cache.
+    - epsilon: Small scalar used for smoothing to avoid dividing by zero.
+    - cache: Moving average of second moments of gradients.
+    """
+    if config is None: config = {}
+    config.setdefault('learning_rate', 1e-2)
+    config.setdefault('decay_rate', 0.99)
+    config.setdefault('epsilon', 1e-8)
+    if 'cache' not in config: config['cache'] = np.zeros_like(x)
+
+    next_x = None
+    # cache = decay_rate * cache + (1 - decay_rate) * dx * dx
+    decay_rate = config['decay_rate']
+    cache, scratch = config['cache'], _scratch(x, config)
+    cache *= decay_rate
+    np.multiply(dx, dx, out=scratch)
+    scratch *= 1 - decay_rate
+    cache += scratch
+
+    # x -= learning_rate * dx / (sqrt(cache) + epsilon)
+    np.sqrt(cache, out=scratch)
+    scratch += config['epsilon']
+    np.divide(dx, scratch, out=scratch)
+    scratch *= config['learning_rate']
+    x -= scratch
+    next_x = x
+
+    return next_x, config
+
+
 def adam(x, dx, config=None):
     """
     Uses the Adam update rule, which incorporates moving averages of both the
@@ -63,21 +149,78 @@ def adam(x, dx, config=None):
     config.setdefault('beta1', 0.9)
     config.setdefault('beta2', 0.999)
     config.setdefault('epsilon', 1e-8)
-    config.setdefault('m', np.zeros_like(x))
-    config.setdefault('v', np.zeros_like(x))
+    if 'm' not in config: config['m'] = np.zeros_like(x)
+    if 'v' not in config: config['v'] = np.zeros_like(x)
     config.setdefault('t', 0)
 
     next_x = None
     beta1, beta2, eps = config['beta1'], config['beta2'], config['epsilon']
-    t, m, v = config['t'], config['m'], config['v']
-    m = beta1 * m + (1 - beta1) * dx
-    v = beta2 * v + (1 - beta2) * (dx * dx)
-    t += 1
+    m, v, scratch = config['m'], config['v'], _scratch(x, config)
+    config['t'] += 1
+    t = config['t']
+
+    # m = beta1 * m + (1 - beta1) * dx
+    m *= beta1
+    np.multiply(dx, 1 - beta1, out=scratch)
+    m += scratch
+
+    # v = beta2 * v + (1 - beta2) * (dx * dx)
+    v *= beta2
+    np.multiply(dx, dx, out=scratch)
+    scratch *= 1 - beta2
+    v += scratch
+
+    # x -= alpha * (m / (sqrt(v) + eps))
     alpha = config['learning_rate'] * np.sqrt(1 - beta2 ** t) / (1 - beta1 ** t)
-    x -= alpha * (m / (np.sqrt(v) + eps))
-    config['t'] = t
-    config['m'] = m
-    config['v'] = v
+    np.sqrt(v, out=scratch)
+    scratch += eps
+    np.divide(m, scratch, out=scratch)
+    scratch *= alpha
+    x -= scratch
     next_x = x
 
     return next_x, config
+
+
+def multi_tensor_update(update_rule, params, grads, config=None):
+    """
+    Updates every parameter of a model with a single call to an update rule.
+
+    On the first call the parameters are copied into one flat buffer (see
+    flat_params.py), so that the update rule and all of its state (velocity,
+    cache, m, v) operate on one contiguous array rather than one array per
+    parameter. Gradients are gathered into the flat gradient buffer before each
+    update and the new values are written back into the arrays of params in
+    place. If params already holds views into the flat buffer, for example
+    after model.params = config['flat'].param_views, no copies are made at all.
+
+    Inputs:
+    - update_rule: One of the update rules above, such as adam.
+    - params: Dictionary mapping parameter names to numpy arrays.
+    - grads: Dictionary with the same keys as params mapping parameter names
+      to gradients.
+    - config: Configuration for update_rule shared by all parameters. The
+      flat buffers are stored in config['flat'].
+
+    Returns a tuple of:
+    - params: The updated params dictionary.
+    - config: The config dictionary to be passed to the next iteration.
+    """
+    if config is None: config = {}
+    flat = config.get('flat')
+    if flat is None or set(flat.layout) != set(params):
+        flat = FlatParams(params)
+        config['flat'] = flat
+    else:
+        for k, view in flat.param_views.items():
+            if params[k] is not view:
+                view[...] = params[k]
+
+    flat.gather_grads(grads)
+    next_w, config = update_rule(flat.params, flat.grads, config)
+    flat.load(next_w)
+
+    for k, view in flat.param_views.items():
+        if params[k] is not view:
+            params[k][...] = view
+    return params, config
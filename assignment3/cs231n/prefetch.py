@@ -0,0 +1,174 @@
+from builtins import range
+from builtins import object
+import threading
+from queue import Queue
+
+import numpy as np
+
+from cs231n.sampler import MinibatchSampler
+
+
+"""
+This file implements background prefetching of training minibatches.
+
+Gathering a random minibatch with fancy indexing touches memory scattered all
+over the training set, and for large datasets it takes a noticeable part of
+each step. A MinibatchPrefetcher moves that work to a background thread:
+while the model computes on one minibatch, the thread samples the indices of
+the next one and gathers (and type-converts) it into a preallocated buffer.
+numpy releases the GIL while it copies, so the two overlap.
+
+There are depth + 1 buffers. The training thread owns the buffer of the
+current minibatch until it asks for the next one, and the background thread
+keeps up to depth filled buffers waiting in a bounded queue; with the default
+depth of 1 this is double buffering.
+
+The background thread draws indices from a MinibatchSampler with its own
+RandomState, so the sequence of minibatches depends only on the seed and not on
+thread timing.
+"""
+
+
+class MinibatchPrefetcher(object):
+    """
+    Samples minibatches on a background thread into reusable buffers.
+
+    Example usage:
+
+    prefetcher = MinibatchPrefetcher({'X': X_train, 'y': y_train}, 100,
+                                     dtypes={'X': np.float32}, seed=0)
+    prefetcher.start()
+    for t in range(num_iterations):
+        batch = prefetcher.next()
+        loss, grads = model.loss(batch['X'], batch['y'])
+    prefetcher.stop()
+    """
+
+    def __init__(self, arrays, batch_size, dtypes=None, depth=1, seed=None,
+                 replace=False, sort=False):
+        """
+        Inputs:
+        - arrays: Dictionary mapping names to arrays to gather minibatches
+          from. Each value is either an array, gathered along its first axis
+          with the sampled indices, or a tuple (array, name) to gather array
+          with the already gathered values of arrays[name] as indices. For
+          example {'image_idxs': idxs, 'features': (features, 'image_idxs')}
+          gathers features[idxs[mask]].
+        - batch_size: Number of examples in each minibatch.
+        - dtypes: Optional dictionary mapping names to the datatype each
+          minibatch should be converted to.
+        - depth: Maximum number of minibatches gathered ahead.
+        - seed: Seed for sampling the indices. If None, one is drawn from the
+          global numpy random state, so np.random.seed still makes training
+          reproducible.
+        - replace, sort: Passed to the MinibatchSampler that draws the indices.
+        """
+        dtypes = dtypes or {}
+        self.arrays = arrays
+        self.batch_size = batch_size
+        self.depth = depth
+        if seed is None:
+            seed = np.random.randint(2 ** 31)
+        first = next(iter(arrays.values()))
+        self.sampler = MinibatchSampler(first.shape[0], batch_size, replace=replace,
+                                        sort=sort, seed=seed)
+
+        self.buffers = []
+        for _ in range(depth + 1):
+            buffers = {}
+            for name, source in arrays.items():
+                a = source[0] if isinstance(source, tuple) else source
+                dtype = dtypes.get(name, a.dtype)
+                # Zero-filled rather than empty: np.take casts through a copy
+                # of out, and stray bit patterns could raise float warnings.
+                buffers[name] = np.zeros((batch_size,) + a.shape[1:], dtype=dtype)
+            self.buffers.append(buffers)
+
+        self._free = Queue()
+        self._full = Queue(maxsize=depth)
+        self._current = None
+        self._stop = threading.Event()
+        self._thread = None
+
+
+    def _fill(self, buffers):
+        """
+        Sample one minibatch and gather it into a set of buffers.
+        """
+        mask = self.sampler.indices()
+        for name, source in self.arrays.items():
+            if isinstance(source, tuple):
+                source, via = source
+                idx = buffers[via]
+            else:
+                idx = mask
+            # The indices are always in range, and mode='clip' lets np.take
+            # write straight into out instead of into a temporary copy.
+            np.take(source, idx, axis=0, out=buffers[name], mode='clip')
+
+
+    def _run(self):
+        try:
+            while True:
+                i = self._free.get()
+                if self._stop.is_set():
+                    return
+                self._fill(self.buffers[i])
+                self._full.put(i)
+        except Exception as e:
+            self._full.put(e)
+
+
+    def start(self):
+        """
+        Start the background thread.
+        """
+        if self._thread is not None:
+            return
+        for i in range(len(self.buffers)):
+            self._free.put(i)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def next(self):
+        """
+        Return the next minibatch.
+
+        Returns:
+        - batch: Dictionary mapping the names of arrays to minibatches. The
+          arrays are buffers owned by the prefetcher and are overwritten after
+          the following call to next.
+        """
+        if self._thread is None:
+            self.start()
+        if self._current is not None:
+            self._free.put(self._current)
+            self._current = None
+        i = self._full.get()
+        if isinstance(i, Exception):
+            raise i
+        self._current = i
+        return self.buffers[i]
+
+
+    def stop(self):
+        """
+        Stop the background thread and discard any prefetched minibatches.
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        # Wake the thread up if it is waiting for a free buffer or a free slot
+        # in the queue.
+        self._free.put(None)
+        while self._thread.is_alive():
+            while not self._full.empty():
+                self._full.get()
+            self._thread.join(0.01)
+        self._thread = None
+        self._current = None
+        self._free = Queue()
+        self._full = Queue(maxsize=self.depth)
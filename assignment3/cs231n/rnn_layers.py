@@ -106,8 +106,8 @@ def rnn_forward(x, h0, Wx, Wh, b):
     N, T, D = x.shape
     _, H = Wx.shape
 
-    h = np.zeros((N, T, H))
-    h0_time_series = np.zeros((N, T, H))
+    h = np.zeros((N, T, H), dtype=x.dtype)
+    h0_time_series = np.zeros((N, T, H), dtype=x.dtype)
     for t in range(T):
         h0_time_series[:, t, :] = h0
         next_h, cache = rnn_step_forward(x[:, t, :], h0, Wx, Wh, b)
@@ -147,8 +147,8 @@ def rnn_backward(dh, cache):
     N, T, D = x.shape
     _, H = Wx.shape
 
-    dx, dh0, dWx, dWh = np.zeros(x.shape), np.zeros((N, H)), np.zeros(Wx.shape), np.zeros(Wh.shape)
-    db, dprev_h = np.zeros(b.shape), np.zeros((N, H))
+    dx, dh0, dWx, dWh = np.zeros_like(x), np.zeros((N, H), dtype=x.dtype), np.zeros_like(Wx), np.zeros_like(Wh)
+    db, dprev_h = np.zeros_like(b), np.zeros((N, H), dtype=x.dtype)
 
     for t in reversed(range(T)):
         cache = (h[:, t, :], h0_time_series[:, t, :], Wx, Wh, x[:, t, :], b)
@@ -217,7 +217,7 @@ def word_embedding_backward(dout, cache):
     # HINT: Look up the function np.add.at                                       #
     ##############################################################################
     x, W = cache
-    dW = np.zeros(W.shape)
+    dW = np.zeros_like(W)
     np.add.at(dW, x, dout)
     ##############################################################################
     #                               END OF YOUR CODE                             #
@@ -374,13 +374,13 @@ def lstm_forward(x, h0, Wx, Wh, b):
     _, H = h0.shape
 
     # Create time series variables
-    h = np.zeros((N, T, H))
-    cell_states = np.zeros((N, T, H))
+    h = np.zeros((N, T, H), dtype=x.dtype)
+    cell_states = np.zeros((N, T, H), dtype=x.dtype)
     caches = dict()
 
     # Run it in sequence
     prev_h = h0
-    prev_c = np.zeros(prev_h.shape)
+    prev_c = np.zeros_like(prev_h)
     for t in range(T):
         next_h, next_c, caches[t] = lstm_step_forward(x[:, t, :], prev_h, prev_c, Wx, Wh, b)
         h[:, t, :], cell_states[:, t, :] = next_h, next_c
@@ -415,11 +415,11 @@ def lstm_backward(dh, cache):
     # You should use the lstm_step_backward function that you just defined.     #
     #############################################################################
     N, T, H = dh.shape
-    dnext_c = np.zeros((N, T, H))
+    dnext_c = np.zeros_like(dh)
     x0, h0, Wx, Wh, b, c, caches = cache
 
-    dx, dWx, dWh, db = np.zeros(x0.shape), np.zeros(Wx.shape), np.zeros(Wh.shape), np.zeros(b.shape)
-    dprev_h, dprev_c = np.zeros((N, H)), np.zeros((N, H))
+    dx, dWx, dWh, db = np.zeros_like(x0), np.zeros_like(Wx), np.zeros_like(Wh), np.zeros_like(b)
+    dprev_h, dprev_c = np.zeros((N, H), dtype=dh.dtype), np.zeros((N, H), dtype=dh.dtype)
 
     for t in reversed(range(T)):
         dx[:, t, :], dprev_h, dprev_c, dWx_t, dWh_t, db_t = lstm_step_backward(dh[:, t, :] + dprev_h, dprev_c, caches[t])
@@ -0,0 +1,114 @@
+from builtins import object
+import numpy as np
+
+
+"""
+This file implements the minibatch sampler shared by the training loops.
+
+Sampling each minibatch independently with np.random.choice draws with
+replacement, so an "epoch" does not actually visit every training example, and
+the gathered rows are scattered across the whole training set. A
+MinibatchSampler instead walks through a fresh random permutation of the data
+every epoch, so each epoch visits every example at most once. It can also sort
+the indices within each minibatch. The minibatch is the same set of examples,
+but the rows of the training set are then read in increasing address order.
+Minibatches are gathered with np.take into buffers that are allocated once
+and reused:
+
+    sampler = MinibatchSampler([X_train, y_train], batch_size=100)
+    for t in range(num_iterations):
+        X_batch, y_batch = sampler.sample()
+"""
+
+
+class MinibatchSampler(object):
+    """
+    Draws minibatches of indices and gathers minibatches of data.
+
+    If the number of examples is not a multiple of the batch size, the last
+    num_examples % batch_size examples of each permutation are left out of
+    that epoch; a new permutation is drawn for the next one.
+    """
+
+    def __init__(self, arrays, batch_size, replace=False, sort=False,
+                 seed=None, dtypes=None):
+        """
+        Inputs:
+        - arrays: List of arrays with the same length along their first axis,
+          such as [X, y], or just that length as an integer if the sampler
+          is only used for indices.
+        - batch_size: Number of examples in each minibatch.
+        - replace: If True, sample each minibatch independently with
+          replacement instead of walking through permutations.
+        - sort: If True, sort the indices within each minibatch.
+        - seed: Seed for a private RandomState. If None the global numpy random
+          state is used, so np.random.seed makes sampling reproducible.
+        - dtypes: Optional list giving, for each array, the datatype its
+          minibatches are converted to (None keeps the datatype).
+        """
+        if isinstance(arrays, (int, np.integer)):
+            self.arrays = []
+            self.num_examples = arrays
+        else:
+            self.arrays = list(arrays)
+            self.num_examples = self.arrays[0].shape[0]
+        self.batch_size = batch_size
+        self.replace = replace
+        self.sort = sort
+        self.rng = np.random if seed is None else np.random.RandomState(seed)
+
+        dtypes = dtypes or [None] * len(self.arrays)
+        self.buffers = []
+        for a, dtype in zip(self.arrays, dtypes):
+            # Zero-filled rather than empty: np.take may cast through a copy of
+            # out, and stray bit patterns could raise float warnings.
+            shape = (batch_size,) + a.shape[1:]
+            self.buffers.append(np.zeros(shape, dtype=dtype or a.dtype))
+
+        self.epoch = 0
+        self._order = None
+        self._pos = 0
+
+
+    def indices(self):
+        """
+        Return the indices of the next minibatch.
+
+        Returns:
+        - idx: Integer array of shape (batch_size,)
+        """
+        if self.replace or self.batch_size > self.num_examples:
+            idx = self.rng.choice(self.num_examples, self.batch_size)
+        else:
+            if self._order is None or self._pos + self.batch_size > self.num_examples:
+                if self._order is not None:
+                    self.epoch += 1
+                self._order = self.rng.permutation(self.num_examples)
+                self._pos = 0
+            idx = self._order[self._pos:self._pos + self.batch_size]
+            self._pos += self.batch_size
+        if self.sort:
+            idx = np.sort(idx)
+        return idx
+
+
+    def gather(self, idx):
+        """
+        Gather the rows idx of every array into the minibatch buffers.
+
+        Returns:
+        - batch: List with a minibatch of each array. These are buffers owned
+          by the sampler and are overwritten by the next call.
+        """
+        for a, out in zip(self.arrays, self.buffers):
+            # The indices are always in range, and mode='clip' lets np.take
+            # write straight into out instead of into a temporary copy.
+            np.take(a, idx, axis=0, out=out, mode='clip')
+        return self.buffers
+
+
+    def sample(self):
+        """
+        Gather the next minibatch; shorthand for gather(indices()).
+        """
+        return self.gather(self.indices())
@@ -0,0 +1,214 @@
+from __future__ import print_function, division
+from builtins import range
+import argparse
+import json
+import multiprocessing
+import platform
+import sys
+import time
+
+import numpy as np
+
+
+"""
+This file implements end-to-end training throughput benchmarks for the
+captioning models of this package, trained by a CaptioningSolver on synthetic
+data shaped like the COCO captioning data (512-dimensional image features,
+captions of 17 words from a vocabulary of 1004).
+
+Every configuration runs in a fresh process, started with the 'spawn' method,
+so that its peak resident set size is not inflated by earlier runs. The
+process builds the data, then times the construction of the model and the
+CaptioningSolver together with the first training step (the time to first
+step). It then runs a few warmup steps and times num_steps more to measure the
+steady state steps and samples per second:
+
+    python -m cs231n.training_benchmarks --output training.json
+    python -m cs231n.training_benchmarks --configs lstm --steps 50
+"""
+
+
+def _coco_data(num_train, seed=0):
+    """
+    Synthetic data shaped like the COCO captioning data.
+    """
+    rng = np.random.RandomState(seed)
+    vocab_size, max_length, num_images = 1004, 17, max(num_train // 5, 1)
+    word_to_idx = {'<NULL>': 0, '<START>': 1, '<END>': 2}
+    for i in range(3, vocab_size):
+        word_to_idx['w%d' % i] = i
+    captions = rng.randint(3, vocab_size, size=(num_train, max_length))
+    captions[:, 0] = word_to_idx['<START>']
+    lengths = rng.randint(8, max_length, size=num_train)
+    for i, length in enumerate(lengths):
+        captions[i, length] = word_to_idx['<END>']
+        captions[i, length + 1:] = word_to_idx['<NULL>']
+    return {
+        'train_captions': captions,
+        'train_image_idxs': rng.randint(num_images, size=num_train),
+        'train_features': rng.randn(num_images, 512).astype(np.float32),
+        'train_urls': np.array(['image%d.jpg' % i for i in range(num_images)]),
+        'word_to_idx': word_to_idx,
+    }
+
+
+def _captioning_model(word_to_idx, cell_type):
+    from cs231n.classifiers.rnn import CaptioningRNN
+    return CaptioningRNN(word_to_idx, input_dim=512, wordvec_dim=256, hidden_dim=512,
+                         cell_type=cell_type)
+
+
+# The benchmarked configurations: a function building the model from the
+# vocabulary, and the CaptioningSolver arguments.
+CONFIGS = {
+    'rnn': {'model': lambda word_to_idx: _captioning_model(word_to_idx, 'rnn'),
+            'solver': {'update_rule': 'adam', 'batch_size': 50,
+                       'optim_config': {'learning_rate': 5e-3}}},
+    'lstm': {'model': lambda word_to_idx: _captioning_model(word_to_idx, 'lstm'),
+             'solver': {'update_rule': 'adam', 'batch_size': 50,
+                        'optim_config': {'learning_rate': 5e-3}}},
+}
+
+
+def peak_rss_bytes():
+    """
+    Return the peak resident set size of this process in bytes, or None if it
+    cannot be measured on this platform.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _benchmark(name, num_steps, warmup, num_train):
+    """
+    Benchmark one configuration in this process.
+    """
+    from cs231n.captioning_solver import CaptioningSolver
+
+    config = CONFIGS[name]
+    data = _coco_data(num_train)
+    rss_before = peak_rss_bytes()
+    np.random.seed(0)
+
+    start = time.perf_counter()
+    model = config['model'](data['word_to_idx'])
+    solver = CaptioningSolver(model, data, num_epochs=1, verbose=False, **config['solver'])
+    solver._step()
+    first_step = time.perf_counter() - start
+
+    for _ in range(warmup):
+        solver._step()
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        solver._step()
+    elapsed = time.perf_counter() - start
+
+    batch_size = solver.batch_size * solver.accumulate_steps
+    return {
+        'config': name, 'model': type(model).__name__, 'batch_size': batch_size,
+        'steps': num_steps, 'time_to_first_step': first_step,
+        'steps_per_sec': num_steps / elapsed,
+        'samples_per_sec': num_steps * batch_size / elapsed,
+        'data_rss_bytes': rss_before, 'peak_rss_bytes': peak_rss_bytes(),
+        'final_loss': float(solver.loss_history[-1]),
+    }
+
+
+def _benchmark_worker(queue, *args):
+    try:
+        queue.put(_benchmark(*args))
+    except Exception as e:
+        queue.put({'config': args[0], 'exception': '%s: %s' % (type(e).__name__, e)})
+
+
+def benchmark_config(name, num_steps=20, warmup=3, num_train=2000, isolate=True):
+    """
+    Benchmark the training throughput of one configuration.
+
+    Inputs:
+    - name: Key of CONFIGS
+    - num_steps: Number of timed steps
+    - warmup: Number of untimed steps after the first one
+    - num_train: Number of synthetic training examples
+    - isolate: If True, run in a fresh process so the peak RSS belongs to this
+      configuration alone.
+
+    Returns:
+    - result: Dictionary with 'config', 'model', 'batch_size', 'steps',
+      'time_to_first_step' (seconds), 'steps_per_sec', 'samples_per_sec',
+      'data_rss_bytes' (peak RSS once the data was built), 'peak_rss_bytes'
+      and 'final_loss', or 'exception' if the run failed.
+    """
+    args = (name, num_steps, warmup, num_train)
+    if not isolate:
+        return _benchmark(*args)
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_benchmark_worker, args=(queue,) + args)
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def format_result(result):
+    """
+    Format one result as a line of text.
+    """
+    if 'exception' in result:
+        return '%-22s FAILED %s' % (result['config'], result['exception'])
+    mib = 1024.0 ** 2
+    return ('%-22s batch %4d  first step %7.3f s  %8.2f steps/s  %9.1f samples/s  '
+            'peak RSS %7.1f MiB' % (
+                result['config'], result['batch_size'], result['time_to_first_step'],
+                result['steps_per_sec'], result['samples_per_sec'],
+                (result['peak_rss_bytes'] or 0) / mib))
+
+
+def run_benchmarks(configs=None, num_steps=20, warmup=3, num_train=2000,
+                   isolate=True, verbose=True):
+    """
+    Benchmark several configurations.
+
+    Returns:
+    - report: Dictionary with 'meta' describing the machine and 'results', the
+      list of results of benchmark_config.
+    """
+    results = []
+    for name in configs or sorted(CONFIGS):
+        result = benchmark_config(name, num_steps, warmup, num_train, isolate)
+        results.append(result)
+        if verbose:
+            print(format_result(result))
+    meta = {'numpy': np.__version__, 'python': platform.python_version(),
+            'machine': platform.machine(), 'processor': platform.processor(),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+    return {'meta': meta, 'results': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark end-to-end training throughput.')
+    parser.add_argument('--configs', nargs='*', choices=sorted(CONFIGS))
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--num-train', type=int, default=2000)
+    parser.add_argument('--in-process', action='store_true',
+                        help='run every configuration in this process')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.configs, args.steps, args.warmup, args.num_train,
+                            isolate=not args.in_process)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if any('exception' in r for r in report['results']) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())